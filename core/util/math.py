@@ -19,6 +19,7 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import functools
 import numpy as np
 from scipy import signal
 
@@ -54,11 +55,32 @@ def get_ft_windows():
     return win
 
 
+@functools.lru_cache(maxsize=64)
+def get_ft_window(window, length):
+    """ Retrieve the values of a window function (see get_ft_windows) for a given length.
+    The window values are computed once for each (window, length) and cached afterwards.
+
+    @param str window: name of the window function
+    @param int length: number of window points
+
+    @return: tuple(window_val, ampl_norm): read-only 1D array with the window values and the
+             amplitude normalization factor of the window. (None, 1.0) for unknown windows.
+    """
+    avail_windows = get_ft_windows()
+    if window not in avail_windows:
+        return None, 1.0
+    window_val = np.asarray(avail_windows[window]['func'](length), dtype=float)
+    window_val.flags.writeable = False
+    return window_val, avail_windows[window]['ampl_norm']
+
+
 def compute_ft(x_val, y_val, zeropad_num=0, window='none', base_corr=True, psd=False):
     """ Compute the Discrete fourier Transform of the power spectral density
 
     @param numpy.array x_val: 1D array
-    @param numpy.array y_val: 1D array of same size as x_val
+    @param numpy.array y_val: 1D array of same size as x_val or 2D array with
+                              one signal of the same size as x_val per row.
+                              All rows are transformed at once.
     @param int zeropad_num: optional, zeropadding (adding zeros to the end of
                             the array). zeropad_num >= 0, the size of the array
                             which is add to the end of the y_val before
@@ -85,6 +107,8 @@ def compute_ft(x_val, y_val, zeropad_num=0, window='none', base_corr=True, psd=F
                 be aware that the return arrays' length depend on the zeropad
                 number like
                     len(dft_x) = len(dft_y) = (len(y_val)/2)*(zeropad_num+1)
+                dft_y is a 2D array with one row per row of y_val if y_val
+                is 2D.
 
     Pay attention that the return values of the FT have only half of the
     entries compared to the used signal input (if zeropad=0).
@@ -108,32 +132,29 @@ def compute_ft(x_val, y_val, zeropad_num=0, window='none', base_corr=True, psd=F
     your signal, i.e. the amplitude and phase of harmonics in your signal.
     """
 
-    avail_windows = get_ft_windows()
-
-    x_val = np.array(x_val)
-    y_val = np.array(y_val)
+    x_val = np.asarray(x_val)
+    y_val = np.asarray(y_val, dtype=float)
+    num_points = y_val.shape[-1]
 
     # Make a baseline correction to avoid a constant offset near zero
     # frequencies. Offset of the y_val from mean corresponds to half the value
     # at fft_y[0].
     corrected_y = y_val
     if base_corr:
-        corrected_y = y_val - y_val.mean()
+        corrected_y = y_val - y_val.mean(axis=-1, keepdims=True)
 
-    ampl_norm_fact = 1.0
     # apply window to data to account for spectral leakage:
-    if window in avail_windows:
-        window_val = avail_windows[window]['func'](len(y_val))
+    window_val, ampl_norm_fact = get_ft_window(window, num_points)
+    if window_val is not None:
         corrected_y = corrected_y * window_val
-        # to get the correct amplitude in the amplitude spectrum
-        ampl_norm_fact = avail_windows[window]['ampl_norm']
 
-    # zeropad for sinc interpolation:
-    zeropad_arr = np.zeros(len(corrected_y)*(zeropad_num+1))
-    zeropad_arr[:len(corrected_y)] = corrected_y
+    # zeropad for sinc interpolation (done by the FFT itself with the padded
+    # length n):
+    padded_length = num_points * (zeropad_num + 1)
 
-    # Get the amplitude values from the fourier transformed y values.
-    fft_y = np.abs(np.fft.fft(zeropad_arr))
+    # Get the amplitude values from the fourier transformed y values. The
+    # transform of real data is symmetric, so only the first half is computed.
+    fft_y = np.abs(np.fft.rfft(corrected_y, n=padded_length, axis=-1))
 
     # Power spectral density (PSD) or just amplitude spectrum of fourier signal:
     power_value = 1.0
@@ -143,13 +164,13 @@ def compute_ft(x_val, y_val, zeropad_num=0, window='none', base_corr=True, psd=F
     # The factor 2 accounts for the fact that just the half of the spectrum was
     # taken. The ampl_norm_fact is the normalization factor due to the applied
     # window function (the offset value in the window function):
-    fft_y = ((2/len(y_val)) * fft_y * ampl_norm_fact)**power_value
+    fft_y = ((2/num_points) * fft_y * ampl_norm_fact)**power_value
 
     # Due to the sampling theorem you can only identify frequencies at half
     # of the sample rate, therefore the FT contains an almost symmetric
     # spectrum (the asymmetry results from aliasing effects). Therefore take
     # the half of the values for the display.
-    middle = int((len(zeropad_arr)+1)//2)
+    middle = int((padded_length+1)//2)
 
     # sample spacing of x_axis, if x is a time axis than it corresponds to a
     # timestep:
@@ -157,6 +178,6 @@ def compute_ft(x_val, y_val, zeropad_num=0, window='none', base_corr=True, psd=F
 
     # use the helper function of numpy to calculate the x_values for the
     # fourier space. That function will handle an occuring devision by 0:
-    fft_x = np.fft.fftfreq(len(zeropad_arr), d=x_spacing)
+    fft_x = np.fft.fftfreq(padded_length, d=x_spacing)
 
-    return abs(fft_x[:middle]), fft_y[:middle]
+    return abs(fft_x[:middle]), fft_y[..., :middle]
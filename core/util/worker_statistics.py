@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the statistics bookkeeping shared by the Qudi background workers.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import threading
+from collections import deque
+
+
+class WorkerStatistics:
+    """
+    Thread safe event counters and duration statistics (last, mean and max of the most recent
+    values) of the stages of a background worker.
+    """
+
+    def __init__(self, stages, counters, length=100):
+        """
+        @param iterable stages: names of the stages to record durations for
+        @param iterable counters: names of the event counters
+        @param int length: number of most recent durations to keep per stage
+        """
+        self._stages = tuple(stages)
+        self._counter_names = tuple(counters)
+        self._length = int(length)
+        self._lock = threading.Lock()
+        self._durations = dict()
+        self._counters = dict()
+        self.reset()
+        return
+
+    def reset(self):
+        """
+        Clears all recorded durations and sets all counters to zero.
+        """
+        with self._lock:
+            self._durations = {stage: deque(maxlen=self._length) for stage in self._stages}
+            self._counters = {name: 0 for name in self._counter_names}
+        return
+
+    def increment(self, counter, value=1):
+        """
+        @param str counter: name of the counter to increment
+        @param int value: amount to add to the counter
+        """
+        with self._lock:
+            self._counters[counter] += value
+        return
+
+    def add_duration(self, stage, duration):
+        """
+        @param str stage: name of the stage
+        @param float duration: duration of the stage in s
+        """
+        with self._lock:
+            self._durations[stage].append(duration)
+        return
+
+    def as_dict(self):
+        """
+        @return dict: counter values and a dict with keys "last", "mean" and "max" per stage
+                      (all None if no duration was recorded yet)
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            for stage, values in self._durations.items():
+                if values:
+                    stats[stage] = {'last': values[-1],
+                                    'mean': sum(values) / len(values),
+                                    'max': max(values)}
+                else:
+                    stats[stage] = {'last': None, 'mean': None, 'max': None}
+        return stats
@@ -2960,7 +2960,12 @@ class PulsedMeasurementGui(GUIBase):
             label.setObjectName('extract_param_label_' + param_name)
 
             # Create widget for parameter and connect update signal
-            if isinstance(value, float):
+            # (bool needs to be checked before int since it is a subclass of int)
+            if isinstance(value, bool):
+                widget = QtWidgets.QCheckBox()
+                widget.setChecked(value)
+                widget.stateChanged.connect(self.extraction_settings_changed)
+            elif isinstance(value, float):
                 widget = ScienDSpinBox()
                 widget.setValue(value)
                 widget.editingFinished.connect(self.extraction_settings_changed)
@@ -2972,10 +2977,6 @@ class PulsedMeasurementGui(GUIBase):
                 widget = QtWidgets.QLineEdit()
                 widget.setText(value)
                 widget.editingFinished.connect(self.extraction_settings_changed)
-            elif isinstance(value, bool):
-                widget = QtWidgets.QCheckBox()
-                widget.setChecked(value)
-                widget.stateChanged.connect(self.extraction_settings_changed)
             else:
                 self.log.error('Could not create widget for extraction parameter "{0}".\n'
                                'Default parameter value is of invalid type.'.format(param_name))
@@ -39,12 +39,16 @@ class FastCounterDummy(Base, FastCounterInterface):
         module.Class: 'fast_counter_dummy.FastCounterDummy'
         gated: False
         #load_trace: None # path to the saved dummy trace
+        #differential: False # return only the counts since the last call of get_data_trace
 
     """
 
     # config option
     _gated = ConfigOption('gated', False, missing='warn')
     trace_path = ConfigOption('load_trace', None)
+    # Return differential frames (the loaded trace as counts acquired since the last call) instead
+    # of the accumulated trace
+    _differential = ConfigOption('differential', False, missing='nothing')
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
@@ -222,12 +226,22 @@ class FastCounterDummy(Base, FastCounterInterface):
             - 'elapsed_sweeps' : the elapsed number of sweeps
             - 'elapsed_time' : the elapsed time in seconds
 
+        and optionally:
+            - 'is_differential' : True if the returned data only contains the counts acquired
+                                  since the last call of get_data_trace (or since start_measure)
+
         If the hardware does not support these features, the values should be None
         """
 
         # include an artificial waiting time
         time.sleep(0.5)
         info_dict = {'elapsed_sweeps': None, 'elapsed_time': None}
+        if self._differential:
+            # Each call acquires the loaded trace once more (nothing while paused)
+            info_dict['is_differential'] = True
+            if self.statusvar == 3:
+                return np.zeros_like(self._count_data), info_dict
+            return self._count_data.copy(), info_dict
         return self._count_data, info_dict
 
     def get_frequency(self):
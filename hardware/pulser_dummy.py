@@ -41,11 +41,13 @@ class PulserDummy(Base, PulserInterface):
 
     pulser_dummy:
         module.Class: 'pulser_dummy.PulserDummy'
+        simulate_transfer_time: True  # optional, set False to skip the simulated upload delays
 
     """
 
     activation_config = StatusVar(default=None)
     force_sequence_option = ConfigOption('force_sequence_option', default=False)
+    simulate_transfer_time = ConfigOption('simulate_transfer_time', default=True)
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
@@ -307,11 +309,13 @@ class PulserDummy(Base, PulserInterface):
         if len(analog_samples) > 0:
             for chnl in analog_samples:
                 waveforms.append(name + chnl[1:])
-                time.sleep(number_of_samples * 5 * 8 / 1024 ** 3)
+                if self.simulate_transfer_time:
+                    time.sleep(number_of_samples * 5 * 8 / 1024 ** 3)
         else:
             for chnl in digital_samples:
                 waveforms.append(name + chnl[1:])
-                time.sleep(number_of_samples * 8 / 1024 ** 3)
+                if self.simulate_transfer_time:
+                    time.sleep(number_of_samples * 8 / 1024 ** 3)
 
         self.waveform_set.update(waveforms)
 
@@ -340,7 +344,8 @@ class PulserDummy(Base, PulserInterface):
             del self.sequence_dict[name]
 
         self.sequence_dict[name] = len(sequence_parameter_list[0][0])
-        time.sleep(1)
+        if self.simulate_transfer_time:
+            time.sleep(1)
 
         self.log.info('Sequence with name "{0}" directly written on dummy pulser.'.format(name))
         return len(sequence_parameter_list)
@@ -69,6 +69,7 @@ class PulseStreamer(Base, PulserInterface, ODMRCounterInterface):
         self.__current_status = -1
         self.__currently_loaded_waveform = ''  # loaded and armed waveform name
         self.__samples_written = 0
+        self.__waveform_runs = dict()
         self._trigger = ps.TriggerStart.SOFTWARE
         self._laser_mw_on_state = ps.OutputState([self._laser_channel], 0, 0)
 
@@ -665,30 +666,68 @@ class PulseStreamer(Base, PulserInterface, ODMRCounterInterface):
         if is_first_chunk:
             self.__current_waveform_name = name
             self.__samples_written = 0
-            # initalise to a dict of lists that describe pulse pattern in swabian language
-            self.__current_waveform = {key:[] for key in digital_samples.keys()}
+            # Run-length encoded samples of each channel as lists of (durations, levels) arrays.
+            # The last run of each channel is kept open to merge it with the next chunk.
+            self.__waveform_runs = {key: ([], []) for key in digital_samples.keys()}
+            self.__current_waveform = dict()
 
+        number_of_samples = 0
+        encoded_chunks = list()
         for channel_number, samples in digital_samples.items():
-            new_channel_indices = np.where(samples[:-1] != samples[1:])[0]
-            new_channel_indices = np.unique(new_channel_indices)
-
-            # add in indices for the start and end of the sequence to simplify iteration
-            new_channel_indices = np.insert(new_channel_indices, 0, [-1])
-            new_channel_indices = np.insert(new_channel_indices, new_channel_indices.size, [samples.shape[0] - 1])
-            pulses = []
-            for new_channel_index in range(1, new_channel_indices.size):
-                pulse = [new_channel_indices[new_channel_index] - new_channel_indices[new_channel_index - 1],
-                         samples[new_channel_indices[new_channel_index - 1] + 1].astype(np.byte)]
-                pulses.append(pulse)
-
-            # extend (as opposed to rewrite) for chunky business
-            #print(pulses)
-            self.__current_waveform[channel_number].extend(pulses)
-
-        return len(samples), [self.__current_waveform_name]
-
+            number_of_samples = len(samples)
+            # Channels with identical samples are encoded only once
+            for encoded_samples, runs in encoded_chunks:
+                if np.array_equal(samples, encoded_samples):
+                    break
+            else:
+                runs = self._run_length_encode(samples)
+                encoded_chunks.append((samples, runs))
+
+            durations, levels = runs
+            if durations.size == 0:
+                continue
+            duration_list, level_list = self.__waveform_runs[channel_number]
+            if level_list and level_list[-1][-1] == levels[0]:
+                # Continue the open run of the previous chunk
+                duration_list[-1] = duration_list[-1].copy()
+                duration_list[-1][-1] += durations[0]
+                durations, levels = durations[1:], levels[1:]
+            if durations.size > 0:
+                duration_list.append(durations)
+                level_list.append(levels)
+        self.__samples_written += number_of_samples
+
+        if is_last_chunk:
+            # Convert to the swabian pulse pattern, i.e. a list of (duration, level) tuples
+            patterns = dict()
+            for channel_number, (duration_list, level_list) in self.__waveform_runs.items():
+                durations = np.concatenate(duration_list) if duration_list else np.empty(0, int)
+                levels = np.concatenate(level_list) if level_list else np.empty(0, int)
+                key = (durations.tobytes(), levels.tobytes())
+                if key not in patterns:
+                    patterns[key] = list(zip(durations.tolist(), levels.tolist()))
+                self.__current_waveform[channel_number] = patterns[key]
+            self.__waveform_runs = dict()
+
+        return number_of_samples, [self.__current_waveform_name]
+
+    @staticmethod
+    def _run_length_encode(samples):
+        """ Run-length encoding of a digital sample array.
+
+        @param numpy.ndarray samples: 1D array of bool samples
+
+        @return (numpy.ndarray, numpy.ndarray): durations (int64) and levels (uint8) of the runs
+        """
+        samples = np.asarray(samples, dtype=bool)
+        if samples.size == 0:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='uint8')
+        run_starts = np.flatnonzero(samples[1:] != samples[:-1]) + 1
+        run_starts = np.concatenate(([0], run_starts))
+        durations = np.diff(np.append(run_starts, samples.size)).astype('int64')
+        levels = samples[run_starts].astype('uint8')
+        return durations, levels
 
-    
     def write_sequence(self, name, sequence_parameters):
         """
         Write a new sequence on the device memory.
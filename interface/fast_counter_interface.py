@@ -171,6 +171,9 @@ class FastCounterInterface(metaclass=InterfaceMetaclass):
         info_dict is a dictionary with keys :
             - 'elapsed_sweeps' : the elapsed number of sweeps
             - 'elapsed_time' : the elapsed time in seconds
+        and optionally:
+            - 'is_differential' : True if the returned data only contains the counts acquired
+                                  since the last call of get_data_trace (or since start_measure)
 
         If the hardware does not support these features, the values should be None
         """
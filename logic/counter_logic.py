@@ -25,6 +25,7 @@ import numpy as np
 import time
 import matplotlib.pyplot as plt
 
+from core.configoption import ConfigOption
 from core.connector import Connector
 from core.statusvariable import StatusVar
 from logic.generic_logic import GenericLogic
@@ -59,12 +60,19 @@ class CounterLogic(GenericLogic):
     counter1 = Connector(interface='SlowCounterInterface')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    # number of rows of the saved count trace written to disk at once
+    _stream_block_rows = ConfigOption('stream_block_rows', 4096)
+
     # status vars
     _count_length = StatusVar('count_length', 300)
     _smooth_window_length = StatusVar('smooth_window_length', 10)
     _counting_samples = StatusVar('counting_samples', 1)
     _count_frequency = StatusVar('count_frequency', 50)
     _saving = StatusVar('saving', False)
+    _saving_start_time = StatusVar('saving_start_time', 0)
+    # sidecar file of the count trace recording, resumed after reactivation
+    _recording_path = StatusVar('recording_path', None)
 
 
     def __init__(self, config, **kwargs):
@@ -116,12 +124,21 @@ class CounterLogic(GenericLogic):
         self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
         self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
         self._already_counted_samples = 0  # For gated counting
-        self._data_to_save = []
+        # recording of the count trace to save (streamed to disk if it is saved to file,
+        # otherwise kept in memory)
+        self._recorder = None
+        self._recording_columns = self._get_recording_columns()
+        self._trace_buffer = np.empty((0, self._recording_columns))
+        self._trace_rows = 0
 
         # Flag to stop the loop
         self.stopRequested = False
 
-        self._saving_start_time = time.time()
+        # continue recording if saving was active before deactivation
+        if self._saving:
+            self._resume_recording()
+        else:
+            self._saving_start_time = time.time()
 
         # connect signals
         self.sigCountDataNext.connect(self.count_loop_body, QtCore.Qt.QueuedConnection)
@@ -137,6 +154,7 @@ class CounterLogic(GenericLogic):
         if self.module_state() == 'locked':
             self._stopCount_wait()
 
+        self._close_recording()
         self.sigCountDataNext.disconnect()
         return
 
@@ -255,16 +273,45 @@ class CounterLogic(GenericLogic):
         """
         return self._saving
 
-    def start_saving(self, resume=False):
+    @property
+    def _data_to_save(self):
+        """
+        Count trace recorded since start_saving (rows of time and counts of all channels). Can be
+        indexed and sliced like a 2D numpy.ndarray.
+        """
+        if self._recorder is None:
+            return self._trace_buffer[:self._trace_rows]
+        return self._recorder
+
+    def start_saving(self, resume=False, to_file=True):
         """
-        Sets up start-time and initializes data array, if not resuming, and changes saving state.
+        Sets up start-time and starts a new recording of the count trace, if not resuming, and
+        changes saving state.
+        If the count trace is going to be saved to file, it is streamed into a file in the Counter
+        data directory in blocks, so a crash leaves a partial recording (see
+        logic.save_backends.load_saved_data). This file is removed after the count trace has been
+        saved or when a new recording is started. If the module is deactivated while saving, the
+        file is kept and the recording is continued after the next activation.
         If the counter is not running it will be started in order to have data to save.
 
+        @param bool resume: continue the current recording
+        @param bool to_file: the count trace is going to be saved to file (see save_data). If False
+                             the count trace is only kept in memory.
+
         @return bool: saving state
         """
+        if resume and self._recording_columns != self._get_recording_columns():
+            self.log.warning('Number of counter channels changed. Starting a new recording of the '
+                             'count trace instead of resuming.')
+            resume = False
         if not resume:
-            self._data_to_save = []
             self._saving_start_time = time.time()
+            self._start_recording(to_file)
+        elif to_file and self._recorder is None:
+            # Move the count trace recorded in memory to a file
+            trace = self._data_to_save
+            self._start_recording(to_file)
+            self._recorder.append(trace)
 
         self._saving = True
 
@@ -282,7 +329,9 @@ class CounterLogic(GenericLogic):
         @param str postfix: an additional tag, which will be added to the filename upon save
         @param bool save_figure: select whether png and pdf should be saved
 
-        @return dict parameters: Dictionary which contains the saving parameters
+        @return (array-like, dict): recorded count trace (empty after it has been saved to file,
+                                    since the recording is removed then) and dictionary which
+                                    contains the saving parameters
         """
         # stop saving thus saving state has to be set to False
         self._saving = False
@@ -295,6 +344,8 @@ class CounterLogic(GenericLogic):
         parameters['Count frequency (Hz)'] = self._count_frequency
         parameters['Oversampling (Samples)'] = self._counting_samples
         parameters['Smooth Window Length (# of events)'] = self._smooth_window_length
+        if self._recorder is not None:
+            self._recorder.flush(parameters)
 
         if to_file:
             # If there is a postfix then add separating underscore
@@ -304,24 +355,154 @@ class CounterLogic(GenericLogic):
                 filelabel = 'count_trace_' + postfix
 
             # prepare the data in a dict or in an OrderedDict:
-            header = 'Time (s)'
-            for i, detector in enumerate(self.get_channels()):
-                header = header + ',Signal{0} (counts/s)'.format(i)
+            header = self._get_recording_header()
 
-            data = {header: self._data_to_save}
+            # memory map of the recording (not loaded into memory)
+            if self._recorder is not None:
+                data = {header: self._recorder.read()}
+            else:
+                data = {header: self._data_to_save}
             filepath = self._save_logic.get_path_for_module(module_name='Counter')
 
             if save_figure:
-                fig = self.draw_figure(data=np.array(self._data_to_save))
+                fig = self.draw_figure(data=data[header])
             else:
                 fig = None
-            self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
-                                       filelabel=filelabel, plotfig=fig, delimiter='\t')
-            self.log.info('Counter Trace saved to:\n{0}'.format(filepath))
+            result = self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
+                                                filelabel=filelabel, plotfig=fig, delimiter='\t')
+            if result == -1:
+                self.log.error('Saving the counter trace failed. The recording is kept.')
+            else:
+                self.log.info('Counter Trace saved to:\n{0}'.format(filepath))
+                # The count trace is saved, remove the recording
+                del data
+                self._start_recording(to_file=False)
 
         self.sigSavingStatusChanged.emit(self._saving)
         return self._data_to_save, parameters
 
+    def _get_recording_columns(self):
+        """ Number of columns of the recorded count trace (time and counts of each channel).
+        """
+        if self._counting_mode == CountingMode['GATED']:
+            # gated counting only records the first channel
+            return 2
+        return len(self.get_channels()) + 1
+
+    def _get_recording_header(self):
+        header = 'Time (s)'
+        for i in range(self._recording_columns - 1):
+            header = header + ',Signal{0} (counts/s)'.format(i)
+        return header
+
+    def _start_recording(self, to_file=True):
+        """ Discards the previous recording of the count trace and starts a new one.
+
+        @param bool to_file: stream the count trace to disk, otherwise it is kept in memory
+        """
+        self._discard_recording()
+        self._recording_columns = self._get_recording_columns()
+        self._trace_buffer = np.empty((0, self._recording_columns))
+        self._trace_rows = 0
+        if not to_file:
+            return
+        header = self._get_recording_header()
+
+        parameters = OrderedDict()
+        parameters['Start counting time'] = time.strftime('%d.%m.%Y %Hh:%Mmin:%Ss', time.localtime(self._saving_start_time))
+        parameters['Count frequency (Hz)'] = self._count_frequency
+        parameters['Oversampling (Samples)'] = self._counting_samples
+        parameters['Smooth Window Length (# of events)'] = self._smooth_window_length
+
+        self._recorder = self._save_logic.open_data_stream(
+            header,
+            self._recording_columns,
+            filepath=self._save_logic.get_path_for_module(module_name='Counter'),
+            parameters=parameters,
+            filelabel='count_trace_recording',
+            block_rows=self._stream_block_rows)
+        self._recording_path = self._recorder.file_path
+        return
+
+    def _resume_recording(self):
+        """ Continues the recording of the count trace of the last activation. Starts a new
+        recording if it can not be reopened or the number of counter channels changed.
+        """
+        if self._recording_path is not None:
+            try:
+                self._recorder = self._save_logic.reopen_data_stream(
+                    self._recording_path, block_rows=self._stream_block_rows)
+            except (OSError, ValueError, KeyError, IndexError):
+                self.log.warning('Could not reopen the count trace recording "{0}". Starting a '
+                                 'new recording.'.format(self._recording_path))
+            else:
+                if self._recorder.metadata['arrays'][0]['shape'][1] == self._recording_columns:
+                    return
+                self.log.warning('Number of counter channels changed. Starting a new recording '
+                                 'of the count trace instead of resuming "{0}".'
+                                 ''.format(self._recording_path))
+                self._recorder.close()
+                self._recorder = None
+        self._saving_start_time = time.time()
+        self._start_recording()
+        return
+
+    def _close_recording(self):
+        """ Writes the current recording of the count trace to disk and closes it. The files are
+        kept and only resumed after reactivation if saving is still active.
+        """
+        if self._recorder is None:
+            return
+        self._recorder.close()
+        if not self._saving:
+            self.log.info('Kept the unsaved count trace recording "{0}".'
+                          ''.format(self._recorder.file_path))
+            self._recording_path = None
+        self._recorder = None
+        return
+
+    def _discard_recording(self):
+        """ Deletes the files of the current recording of the count trace.
+        """
+        if self._recorder is None:
+            return
+        try:
+            self._recorder.discard()
+        except OSError:
+            # e.g. the file is still memory mapped by someone on Windows
+            self.log.warning('Could not delete the count trace recording "{0}".'
+                             ''.format(self._recorder.file_path))
+        self._recorder = None
+        self._recording_path = None
+        return
+
+    def _record_rows(self, rows):
+        """ Appends rows (time and counts of each channel) to the recorded count trace.
+
+        @param numpy.ndarray rows: single row or 2D array of rows
+        """
+        rows = np.atleast_2d(rows)
+        if rows.shape[1] != self._recording_columns:
+            self.log.error('Number of counter channels changed from {0:d} to {1:d} while saving. '
+                           'Stopped recording of the count trace.'
+                           ''.format(self._recording_columns - 1, rows.shape[1] - 1))
+            self._saving = False
+            self.sigSavingStatusChanged.emit(self._saving)
+            return
+        if self._recorder is not None:
+            self._recorder.append(rows)
+            return
+        # Grow the memory buffer geometrically to append in amortized constant time
+        num_rows = self._trace_rows + rows.shape[0]
+        if num_rows > self._trace_buffer.shape[0]:
+            buffer = np.empty((max(num_rows, 2 * self._trace_buffer.shape[0], 1024),
+                               self._recording_columns))
+            buffer[:self._trace_rows] = self._trace_buffer[:self._trace_rows]
+            self._trace_buffer = buffer
+        self._trace_buffer[self._trace_rows:num_rows] = rows
+        self._trace_rows = num_rows
+        return
+
     def draw_figure(self, data):
         """ Draw figure to save with data file.
 
@@ -568,24 +749,21 @@ class CounterLogic(GenericLogic):
 
         # save the data if necessary
         if self._saving:
-             # if oversampling is necessary
+            chans = self.get_channels()
+            # if oversampling is necessary
             if self._counting_samples > 1:
-                chans = self.get_channels()
-                self._sampling_data = np.empty([len(chans) + 1, self._counting_samples])
-                self._sampling_data[0, :] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    self._sampling_data[i+1, 0] = self.rawdata[i]
-
-                self._data_to_save.extend(list(self._sampling_data))
+                # one row (timestamp, counts of all channels) per sample
+                self._sampling_data = np.empty([self._counting_samples, len(chans) + 1])
+                self._sampling_data[:, 0] = time.time() - self._saving_start_time
+                self._sampling_data[:, 1:] = self.rawdata[:len(chans)].T
+                self._record_rows(self._sampling_data)
             # if we don't want to use oversampling
             else:
                 # append tuple to data stream (timestamp, average counts)
-                chans = self.get_channels()
                 newdata = np.empty((len(chans) + 1, ))
                 newdata[0] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    newdata[i+1] = self.countdata[i, -1]
-                self._data_to_save.append(newdata)
+                newdata[1:] = self.countdata[:len(chans), -1]
+                self._record_rows(newdata)
         return
 
     def _process_data_gated(self):
@@ -610,12 +788,11 @@ class CounterLogic(GenericLogic):
                 self._sampling_data = np.empty((self._counting_samples, 2))
                 self._sampling_data[:, 0] = time.time() - self._saving_start_time
                 self._sampling_data[:, 1] = self.rawdata[0]
-                self._data_to_save.extend(list(self._sampling_data))
+                self._record_rows(self._sampling_data)
             # if we don't want to use oversampling
             else:
                 # append tuple to data stream (timestamp, average counts)
-                self._data_to_save.append(np.array((time.time() - self._saving_start_time,
-                                                    self.countdata[-1])))
+                self._record_rows((time.time() - self._saving_start_time, self.countdata[-1]))
         return
 
     def _process_data_finite_gated(self):
@@ -1141,7 +1141,7 @@ class MagnetLogic(GenericLogic):
         if self._counter_logic.get_counting_mode() != CountingMode.CONTINUOUS:
             self._counter_logic.set_counting_mode(mode=CountingMode.CONTINUOUS)
 
-        self._counter_logic.start_saving()
+        self._counter_logic.start_saving(to_file=False)
         time.sleep(self._fluorescence_integration_time)
         data_array, parameters = self._counter_logic.save_data(to_file=False)
 
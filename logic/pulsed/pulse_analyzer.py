@@ -23,11 +23,139 @@ import os
 import sys
 import inspect
 import importlib
+import numpy as np
 
 from core.util.modules import get_main_dir
 from core.util.helpers import natural_sort
 
 
+class CumulativeWindowSums:
+    """
+    Window sum backend based on a single cumulative sum along the time bin axis of laser_data.
+    After the cumulative sum has been calculated once, the sums over an arbitrary time bin window
+    are obtained for all laser pulses with a single subtraction (O(1) per laser pulse).
+    Integer data is summed exactly (int64), floating point data in float64.
+    """
+    def __init__(self, laser_data):
+        """
+        @param numpy.ndarray laser_data: 2D array (dim 0: laser pulse; dim 1: time bin)
+        """
+        self.laser_data = laser_data
+        self.number_of_bins = laser_data.shape[1]
+        if np.issubdtype(laser_data.dtype, np.integer) or laser_data.dtype == bool:
+            dtype = np.int64
+        else:
+            dtype = np.float64
+        self._cumsum = np.zeros((laser_data.shape[0], self.number_of_bins + 1), dtype=dtype)
+        np.cumsum(laser_data, axis=1, dtype=dtype, out=self._cumsum[:, 1:])
+
+    def window_sum(self, start_bin, stop_bin):
+        """
+        Sum over the time bins [start_bin:stop_bin] (python slice semantics) of each laser pulse.
+
+        @param int start_bin: first time bin of the window
+        @param int stop_bin: time bin after the last time bin of the window
+
+        @return (numpy.ndarray, int): window sum for each laser pulse, number of bins in the window
+        """
+        start, stop, _ = slice(start_bin, stop_bin).indices(self.number_of_bins)
+        if stop <= start:
+            return np.zeros(self._cumsum.shape[0], dtype=self._cumsum.dtype), 0
+        return self._cumsum[:, stop] - self._cumsum[:, start], stop - start
+
+
+class DirectWindowSums:
+    """
+    Window sum backend summing directly over the time bin window of laser_data.
+    Needs no additional memory but each window sum costs O(window length) per laser pulse.
+    Like CumulativeWindowSums integer data is summed in int64 and floating point data (e.g. float32
+    data of a fast counter) in float64.
+    """
+    def __init__(self, laser_data):
+        """
+        @param numpy.ndarray laser_data: 2D array (dim 0: laser pulse; dim 1: time bin)
+        """
+        self.laser_data = laser_data
+        self.number_of_bins = laser_data.shape[1]
+        if np.issubdtype(laser_data.dtype, np.integer) or laser_data.dtype == bool:
+            self._dtype = np.int64
+        else:
+            self._dtype = np.float64
+
+    def window_sum(self, start_bin, stop_bin):
+        """
+        Sum over the time bins [start_bin:stop_bin] (python slice semantics) of each laser pulse.
+
+        @param int start_bin: first time bin of the window
+        @param int stop_bin: time bin after the last time bin of the window
+
+        @return (numpy.ndarray, int): window sum for each laser pulse, number of bins in the window
+        """
+        start, stop, _ = slice(start_bin, stop_bin).indices(self.number_of_bins)
+        window = self.laser_data[:, start:stop]
+        return np.sum(window, axis=1, dtype=self._dtype), window.shape[1]
+
+
+class RunningWindowSums:
+    """
+    Window sum backend for accumulated laser_data (see incremental accumulation of
+    PulsedMeasurementLogic). The sums over each requested time bin window are calculated once
+    from laser_data and afterwards only updated with the window sums of the laser pulses extracted
+    from newly acquired counts (see add_increment). Analysing the accumulated data then costs
+    O(1) per laser pulse and window instead of O(window length).
+    Like the other backends integer data is summed in int64 and floating point data in float64.
+    """
+    def __init__(self, laser_data):
+        """
+        @param numpy.ndarray laser_data: 2D array (dim 0: laser pulse; dim 1: time bin)
+        """
+        self.laser_data = laser_data
+        self.number_of_bins = laser_data.shape[1]
+        if np.issubdtype(laser_data.dtype, np.integer) or laser_data.dtype == bool:
+            self._dtype = np.int64
+        else:
+            self._dtype = np.float64
+        # Accumulated sums of all windows requested so far ((start, stop): sum per laser pulse)
+        self._sums = dict()
+
+    def window_sum(self, start_bin, stop_bin):
+        """
+        Sum over the time bins [start_bin:stop_bin] (python slice semantics) of each laser pulse.
+
+        @param int start_bin: first time bin of the window
+        @param int stop_bin: time bin after the last time bin of the window
+
+        @return (numpy.ndarray, int): window sum for each laser pulse, number of bins in the window
+        """
+        start, stop, _ = slice(start_bin, stop_bin).indices(self.number_of_bins)
+        stop = max(start, stop)
+        window_sum = self._sums.get((start, stop))
+        if window_sum is None:
+            window_sum = np.sum(self.laser_data[:, start:stop], axis=1, dtype=self._dtype)
+            self._sums[(start, stop)] = window_sum
+        return window_sum, stop - start
+
+    def add_increment(self, laser_increment, laser_data):
+        """
+        Adds the window sums of newly extracted laser pulses to all accumulated window sums.
+
+        @param numpy.ndarray laser_increment: laser pulses extracted from the newly acquired counts
+        @param numpy.ndarray laser_data: new accumulated laser_data (old laser_data + increment)
+        """
+        # Publish new arrays since returned window sums may still be in use by an analysis
+        self._sums = {(start, stop): window_sum + np.sum(laser_increment[:, start:stop], axis=1,
+                                                         dtype=self._dtype)
+                      for (start, stop), window_sum in self._sums.items()}
+        self.laser_data = laser_data
+        return
+
+
+# Available window sum backends for analysis methods. Selected by the ConfigOption
+# "analysis_window_sum_backend" of PulsedMeasurementLogic. With "auto" a single analysis uses
+# direct window sums and a scan over several analysis settings uses a shared cumulative sum.
+WINDOW_SUM_BACKENDS = {'cumsum': CumulativeWindowSums, 'direct': DirectWindowSums}
+
+
 class PulseAnalyzerBase:
     """
     All analyzer classes to import from must inherit exclusively from this base class.
@@ -38,6 +166,45 @@ class PulseAnalyzerBase:
     """
     def __init__(self, pulsedmeasurementlogic):
         self.__pulsedmeasurementlogic = pulsedmeasurementlogic
+        # Window sum backend instance for the laser_data currently analysed
+        self._window_sums = None
+
+    def get_window_sums(self, laser_data):
+        """
+        Returns a window sum backend instance (see WINDOW_SUM_BACKENDS) for laser_data.
+        The instance is reused as long as the same laser_data array is analysed, so several windows
+        (or several calls with different window settings) only need a single preparation step.
+        Cached instances must be discarded by calling clear_window_sums (done by PulseAnalyzer).
+
+        @param numpy.ndarray laser_data: 2D array (dim 0: laser pulse; dim 1: time bin)
+
+        @return object: window sum backend instance providing the method "window_sum"
+        """
+        if self._window_sums is None or self._window_sums.laser_data is not laser_data:
+            self._window_sums = self._get_window_sum_backend(scan=False)(laser_data)
+        return self._window_sums
+
+    def _get_window_sum_backend(self, scan):
+        """
+        Returns the window sum backend class selected by the ConfigOption
+        "analysis_window_sum_backend" of PulsedMeasurementLogic.
+
+        @param bool scan: whether the window sums are used for several analysis settings
+
+        @return class: window sum backend class (see WINDOW_SUM_BACKENDS)
+        """
+        backend = getattr(self.__pulsedmeasurementlogic, 'analysis_window_sum_backend', 'auto')
+        if backend in WINDOW_SUM_BACKENDS:
+            return WINDOW_SUM_BACKENDS[backend]
+        return CumulativeWindowSums if scan else DirectWindowSums
+
+    def clear_window_sums(self):
+        """
+        Discards the window sum backend instance. Must be called whenever the content of an already
+        analysed laser_data array might have changed.
+        """
+        self._window_sums = None
+        return
 
     @property
     def is_gated(self):
@@ -91,6 +258,10 @@ class PulseAnalyzer(PulseAnalyzerBase):
         self._parameters = dict()
         # Currently selected analysis method
         self._current_analysis_method = None
+        # Instances of all imported analyzer classes
+        self._analyzer_instances = list()
+        # Running window sums of accumulated laser_data (see start_running_window_sums)
+        self._running_window_sums = None
 
         # import path for analysis modules from default directory (logic.pulse_analysis_methods)
         path_list = [os.path.join(get_main_dir(), 'logic', 'pulsed', 'pulsed_analysis_methods')]
@@ -101,11 +272,11 @@ class PulseAnalyzer(PulseAnalyzerBase):
         # Import analysis modules and get a list of analyzer classes
         analyzer_classes = self.__import_external_analyzers(paths=path_list)
 
-        # create an instance of each class and put them in a temporary list
-        analyzer_instances = [cls(pulsedmeasurementlogic) for cls in analyzer_classes]
+        # create an instance of each class and put them in a list
+        self._analyzer_instances = [cls(pulsedmeasurementlogic) for cls in analyzer_classes]
 
         # add references to all analysis methods in each instance to a dict
-        self.__populate_method_dict(instance_list=analyzer_instances)
+        self.__populate_method_dict(instance_list=self._analyzer_instances)
 
         # populate "_parameters" dictionary from analysis method signatures
         self.__populate_parameter_dict()
@@ -206,8 +377,110 @@ class PulseAnalyzer(PulseAnalyzerBase):
         analysis_method = self._analysis_methods[self._current_analysis_method]
 
         kwargs = self._get_analysis_method_kwargs(analysis_method)
+        # laser_data buffers can be reused with new content, so do not rely on cached window sums
+        self.clear_window_sums()
+        # Accumulated laser_data is analysed with the running window sums
+        running_sums = self._running_window_sums
+        if running_sums is not None and running_sums.laser_data is laser_data:
+            for instance in self._analyzer_instances:
+                instance._window_sums = running_sums
         return analysis_method(laser_data=laser_data, **kwargs)
 
+    def start_running_window_sums(self, laser_data):
+        """
+        Starts running window sums (see RunningWindowSums) for accumulated laser_data. As long as
+        the accumulated laser_data is only updated with add_laser_increment, analysing it only
+        needs the window sums of the increments.
+
+        @param numpy.ndarray laser_data: 2D array of the accumulated laser pulses
+        """
+        self._running_window_sums = RunningWindowSums(laser_data)
+        return
+
+    def add_laser_increment(self, laser_increment, laser_data):
+        """
+        Updates the running window sums with newly extracted laser pulses.
+
+        @param numpy.ndarray laser_increment: laser pulses extracted from the newly acquired counts
+        @param numpy.ndarray laser_data: new accumulated laser_data (old laser_data + increment)
+        """
+        if self._running_window_sums is None:
+            self.start_running_window_sums(laser_data)
+        else:
+            self._running_window_sums.add_increment(laser_increment, laser_data)
+        return
+
+    def stop_running_window_sums(self):
+        """
+        Discards the running window sums (e.g. if laser_data is extracted from the complete trace).
+        """
+        self._running_window_sums = None
+        return
+
+    def scan_analysis_settings(self, laser_data, settings_list):
+        """
+        Analyses the same laser_data with several analysis settings (e.g. to scan the signal and
+        normalization windows). The window sum preparation (e.g. cumulative sum) of laser_data is
+        only done once for all settings.
+        The currently selected analysis settings are not changed.
+
+        @param numpy.ndarray laser_data: 2D numpy array containing the timetraces for all extracted
+                                         laser pulses.
+        @param list settings_list: list of analysis settings dicts. Parameters missing in a dict are
+                                   taken from the current settings. The key "method" can be used to
+                                   select another analysis method.
+
+        @return list: list of (signal data, error data) tuples, one for each settings dict
+        """
+        # Share a single window sum instance between all analyzer instances
+        window_sums = self._get_window_sum_backend(scan=True)(laser_data)
+        for instance in self._analyzer_instances:
+            instance._window_sums = window_sums
+        results = list()
+        for settings in settings_list:
+            method_name = settings.get('method', self._current_analysis_method)
+            analysis_method = self._analysis_methods.get(method_name)
+            if analysis_method is None:
+                self.log.error('Analysis method "{0}" could not be found in PulseAnalyzer.'
+                               ''.format(method_name))
+                results.append((np.zeros(laser_data.shape[0]), np.zeros(laser_data.shape[0])))
+                continue
+            kwargs = self._get_analysis_method_kwargs(analysis_method)
+            for name, value in settings.items():
+                if name == 'method':
+                    continue
+                if name not in kwargs:
+                    self.log.error('Analysis method "{0}" has no parameter "{1}". Ignoring it in '
+                                   'analysis settings scan.'.format(method_name, name))
+                    continue
+                if type(value) != type(kwargs[name]):
+                    # Cast to the type of the setting if possible without loss (e.g. int to float)
+                    try:
+                        cast_value = type(kwargs[name])(value)
+                        if cast_value != value:
+                            raise ValueError
+                    except (TypeError, ValueError):
+                        self.log.error('Value {0!r} of analysis parameter "{1}" in analysis '
+                                       'settings scan has the wrong type (expected {2}). Using '
+                                       'current value {3!r} instead.'
+                                       ''.format(value, name, type(kwargs[name]).__name__,
+                                                 kwargs[name]))
+                        continue
+                    value = cast_value
+                kwargs[name] = value
+            results.append(analysis_method(laser_data=laser_data, **kwargs))
+        self.clear_window_sums()
+        return results
+
+    def clear_window_sums(self):
+        """
+        Discards the cached window sums of all analyzer instances.
+        """
+        super().clear_window_sums()
+        for instance in self._analyzer_instances:
+            instance.clear_window_sums()
+        return
+
     def _get_analysis_method_kwargs(self, method):
         """
         Get the proper values for keyword arguments other than "laser_data" for <method>.
@@ -45,19 +45,19 @@ class BasicPulseExtractor(PulseExtractorBase):
         @param int flank_width: The width of the flank in pixel to include/exclude additionally from the found position
 
         @return dict: The extracted laser pulses of the timetrace as well as the indices for rising
-                      and falling flanks.
+                      and falling flanks. The laser pulses are a view of count_data (native dtype).
         """
         # Create return dictionary
         return_dict = {'laser_counts_arr': np.zeros(0, dtype='int64'),
                        'laser_indices_rising': -1,
                        'laser_indices_falling': -1}
 
-        # sum up all gated timetraces to ease flank detection
-        timetrace_sum = np.sum(count_data, 0)
+        # sum up all gated timetraces to ease flank detection (directly in float for the filter)
+        timetrace_sum = np.sum(count_data, 0, dtype=float)
 
         # apply gaussian filter to remove noise and compute the gradient of the timetrace sum
         try:
-            conv = ndimage.filters.gaussian_filter1d(timetrace_sum.astype(float), conv_std_dev)
+            conv = ndimage.filters.gaussian_filter1d(timetrace_sum, conv_std_dev)
         except:
             conv = np.zeros(timetrace_sum.size)
         try:
@@ -72,13 +72,13 @@ class BasicPulseExtractor(PulseExtractorBase):
 
         # If gaussian smoothing or derivative failed, the returned array only contains zeros.
         # Check for that and return also only zeros to indicate a failed pulse extraction.
-        if len(conv_deriv.nonzero()[0]) == 0:
-            laser_arr = np.zeros(count_data.shape, dtype='int64')
+        if not conv_deriv.any():
+            laser_arr = np.zeros(count_data.shape, dtype=count_data.dtype)
         else:
-            # slice the data array to cut off anything but laser pulses
+            # slice the data array to cut off anything but laser pulses (no copy)
             laser_arr = count_data[:, rising_ind:falling_ind]
 
-        return_dict['laser_counts_arr'] = laser_arr.astype('int64')
+        return_dict['laser_counts_arr'] = laser_arr
         return_dict['laser_indices_rising'] = rising_ind
         return_dict['laser_indices_falling'] = falling_ind
 
@@ -133,127 +133,127 @@ class BasicPulseExtractor(PulseExtractorBase):
         if not isinstance(number_of_lasers, int):
             return return_dict
 
-        # apply gaussian filter to remove noise and compute the gradient of the timetrace sum
-        try:
-            conv = ndimage.filters.gaussian_filter1d(count_data.astype(float), conv_std_dev)
-        except:
-            conv = np.zeros(count_data.size)
-        try:
-            conv_deriv = np.gradient(conv)
-        except:
-            conv_deriv = np.zeros(conv.size)
-
+        flanks = self._detect_ungated_flanks(count_data, conv_std_dev, number_of_lasers)
         # if gaussian smoothing or derivative failed, the returned array only contains zeros.
         # Check for that and return also only zeros to indicate a failed pulse extraction.
-        if len(conv_deriv.nonzero()[0]) == 0:
+        if flanks is None:
             return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, 10), dtype='int64')
             return return_dict
-
-        # use a reference for array, because the exact position of the peaks or dips
-        # (i.e. maxima or minima, which are the inflection points in the pulse) are distorted by
-        # a large conv_std_dev value.
-        try:
-            conv = ndimage.filters.gaussian_filter1d(count_data.astype(float), 10)
-        except:
-            conv = np.zeros(count_data.size)
-        try:
-            conv_deriv_ref = np.gradient(conv)
-        except:
-            conv_deriv_ref = np.zeros(conv.size)
-
-        # initialize arrays to contain indices for all rising and falling
-        # flanks, respectively
-        rising_ind = np.empty(number_of_lasers, dtype='int64')
-        falling_ind = np.empty(number_of_lasers, dtype='int64')
-
-        # Find as many rising and falling flanks as there are laser pulses in
-        # the trace:
-        for i in range(number_of_lasers):
-            # save the index of the absolute maximum of the derived time trace
-            # as rising edge position
-            rising_ind[i] = np.argmax(conv_deriv)
-
-            # refine the rising edge detection, by using a small and fixed
-            # conv_std_dev parameter to find the inflection point more precise
-            start_ind = int(rising_ind[i] - conv_std_dev)
-            if start_ind < 0:
-                start_ind = 0
-
-            stop_ind = int(rising_ind[i] + conv_std_dev)
-            if stop_ind > len(conv_deriv):
-                stop_ind = len(conv_deriv)
-
-            if start_ind == stop_ind:
-                stop_ind = start_ind + 1
-
-            rising_ind[i] = start_ind + np.argmax(conv_deriv_ref[start_ind:stop_ind])
-
-            # set this position and the surrounding of the saved edge to 0 to
-            # avoid a second detection
-            if rising_ind[i] < 2 * conv_std_dev:
-                del_ind_start = 0
-            else:
-                del_ind_start = rising_ind[i] - int(2 * conv_std_dev)
-            if (conv_deriv.size - rising_ind[i]) < 2 * conv_std_dev:
-                del_ind_stop = conv_deriv.size - 1
-            else:
-                del_ind_stop = rising_ind[i] + int(2 * conv_std_dev)
-                conv_deriv[del_ind_start:del_ind_stop] = 0
-
-            # save the index of the absolute minimum of the derived time trace
-            # as falling edge position
-            falling_ind[i] = np.argmin(conv_deriv)
-
-            # refine the falling edge detection, by using a small and fixed
-            # conv_std_dev parameter to find the inflection point more precise
-            start_ind = int(falling_ind[i] - conv_std_dev)
-            if start_ind < 0:
-                start_ind = 0
-
-            stop_ind = int(falling_ind[i] + conv_std_dev)
-            if stop_ind > len(conv_deriv):
-                stop_ind = len(conv_deriv)
-
-            if start_ind == stop_ind:
-                stop_ind = start_ind + 1
-
-            falling_ind[i] = start_ind + np.argmin(conv_deriv_ref[start_ind:stop_ind])
-
-            # set this position and the sourrounding of the saved flank to 0 to
-            #  avoid a second detection
-            if falling_ind[i] < 2 * conv_std_dev:
-                del_ind_start = 0
-            else:
-                del_ind_start = falling_ind[i] - int(2 * conv_std_dev)
-            if (conv_deriv.size - falling_ind[i]) < 2 * conv_std_dev:
-                del_ind_stop = conv_deriv.size - 1
-            else:
-                del_ind_stop = falling_ind[i] + int(2 * conv_std_dev)
-            conv_deriv[del_ind_start:del_ind_stop] = 0
-
-        # sort all indices of rising and falling flanks
-        rising_ind.sort()
-        falling_ind.sort()
+        rising_ind, falling_ind = flanks
 
         # find the maximum laser length to use as size for the laser array
-        laser_length = np.max(falling_ind - rising_ind)
+        laser_length = int(np.max(falling_ind - rising_ind))
 
-        # initialize the empty output array
-        laser_arr = np.zeros((number_of_lasers, laser_length), dtype='int64')
+        # initialize the laser array in the native dtype of the count data
+        laser_arr = np.empty((number_of_lasers, laser_length), dtype=count_data.dtype)
         # slice the detected laser pulses of the timetrace and save them in the
         # output array according to the found rising edge
         for i in range(number_of_lasers):
             if rising_ind[i] + laser_length > count_data.size:
                 lenarr = count_data[rising_ind[i]:].size
                 laser_arr[i, 0:lenarr] = count_data[rising_ind[i]:]
+                laser_arr[i, lenarr:] = 0
             else:
                 laser_arr[i] = count_data[rising_ind[i]:rising_ind[i] + laser_length]
 
-        return_dict['laser_counts_arr'] = laser_arr.astype('int64')
+        return_dict['laser_counts_arr'] = laser_arr
         return_dict['laser_indices_rising'] = rising_ind
         return_dict['laser_indices_falling'] = falling_ind
         return return_dict
 
+    def ungated_conv_deriv_cached(self, count_data, conv_std_dev=20.0,
+                                  use_sampling_information=False, delay=5e-7,
+                                  min_detection_counts=10000):
+        """
+        Extracts the laser pulses in the ungated timetrace data like "conv_deriv" but determines
+        the laser flank positions only once per measurement. All later calls just gather the laser
+        pulses from the timetrace at the cached positions.
+
+        @param numpy.ndarray count_data: The raw timetrace data (1D) from an ungated fast counter
+        @param float conv_std_dev: The standard deviation of the gaussian used for smoothing
+        @param bool use_sampling_information: Derive the flank positions from the laser rising and
+                                              falling bins of the sampled waveform instead of
+                                              detecting them in the timetrace
+        @param float delay: Delay of the laser pulses in the timetrace with respect to the
+                            sampled waveform (only used with use_sampling_information)
+        @param int min_detection_counts: Minimum number of total counts in the timetrace before
+                                         detected flank positions are cached. Flanks are
+                                         detected on every call until this number is reached.
+
+        @return dict: The extracted laser pulses of the timetrace as well as the indices for rising
+                      and falling flanks. "fixed_laser_windows" is True once the flank positions
+                      are cached (see PulsedMeasurementLogic incremental accumulation).
+        """
+        return_dict = {'laser_counts_arr': np.empty(0, dtype='int64'),
+                       'laser_indices_rising': np.empty(0, dtype='int64'),
+                       'laser_indices_falling': np.empty(0, dtype='int64'),
+                       'fixed_laser_windows': False}
+
+        number_of_lasers = self.measurement_settings.get('number_of_lasers')
+        if not isinstance(number_of_lasers, int):
+            return return_dict
+
+        cache_key = ('conv_deriv', count_data.shape, number_of_lasers, conv_std_dev,
+                     use_sampling_information, delay)
+        cached = self.extraction_cache.get('laser_flanks')
+        if cached is None or cached['key'] != cache_key:
+            if use_sampling_information:
+                flanks = self._get_laser_bins_from_sampling_information()
+                if flanks is None:
+                    return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, 10),
+                                                               dtype='int64')
+                    return return_dict
+                delay_bins = int(round(delay / self.fast_counter_settings['bin_width']))
+                rising_ind = np.clip(flanks[0] + delay_bins, 0, count_data.size)
+                falling_ind = np.clip(flanks[1] + delay_bins, 0, count_data.size)
+                cache_flanks = True
+            else:
+                flanks = self._detect_ungated_flanks(count_data, conv_std_dev, number_of_lasers)
+                if flanks is None:
+                    return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, 10),
+                                                               dtype='int64')
+                    return return_dict
+                rising_ind, falling_ind = flanks
+                cache_flanks = count_data.sum() >= min_detection_counts
+
+            laser_length = int(np.max(falling_ind - rising_ind)) if rising_ind.size > 0 else 0
+            cached = {'key': cache_key,
+                      'laser_indices_rising': rising_ind,
+                      'laser_indices_falling': falling_ind,
+                      'laser_length': laser_length,
+                      # Number of lasers fully contained in the timetrace (rising_ind is sorted)
+                      'complete_lasers': int(np.searchsorted(
+                          rising_ind, count_data.size - laser_length, side='right'))}
+            if cache_flanks:
+                self.extraction_cache['laser_flanks'] = cached
+
+        rising_ind = cached['laser_indices_rising']
+        complete = cached['complete_lasers']
+        laser_length = cached['laser_length']
+        # Gather the laser pulses in the native dtype of the count data into a new array (the
+        # returned array is published as laser data and must not be altered by the next call)
+        laser_arr = np.empty((rising_ind.size, laser_length), dtype=count_data.dtype)
+        if laser_length > 0 and complete > 0:
+            # Gather all complete laser pulses at once from a strided view of the timetrace
+            # (one row for each possible start bin)
+            laser_windows = np.lib.stride_tricks.as_strided(
+                count_data,
+                shape=(count_data.size - laser_length + 1, laser_length),
+                strides=(count_data.strides[0], count_data.strides[0]),
+                writeable=False)
+            np.take(laser_windows, rising_ind[:complete], axis=0, out=laser_arr[:complete])
+        # Laser pulses truncated by the end of the timetrace are padded with zeros
+        for i in range(complete, rising_ind.size):
+            remaining = count_data[rising_ind[i]:]
+            laser_arr[i, :remaining.size] = remaining
+            laser_arr[i, remaining.size:] = 0
+
+        return_dict['laser_counts_arr'] = laser_arr
+        return_dict['laser_indices_rising'] = rising_ind
+        return_dict['laser_indices_falling'] = cached['laser_indices_falling']
+        return_dict['fixed_laser_windows'] = self.extraction_cache.get('laser_flanks') is cached
+        return return_dict
+
     def ungated_threshold(self, count_data, count_threshold=10, min_laser_length=200e-9,
                           threshold_tolerance=20e-9):
         """
@@ -349,30 +349,15 @@ class BasicPulseExtractor(PulseExtractorBase):
         @return 2D numpy.ndarray: 2D array, the extracted laser pulses of the timetrace.
                                   dimensions: 0: laser number, 1: time bin
         """
-        # get the generation sampling rate
-        sample_rate = self.sampling_information['pulse_generator_settings']['sample_rate']
         # get the fastcounter binwidth
         fc_binwidth = self.fast_counter_settings['bin_width']
-        # get laser rising and falling bins
-        laser_rising_bins = self.sampling_information['laser_rising_bins']
-        laser_falling_bins = self.sampling_information['laser_falling_bins']
-
-        # Sort out trailing or leading incomplete laser pulse
-        while len(laser_rising_bins) != len(laser_falling_bins):
-            if len(laser_rising_bins) > len(laser_falling_bins):
-                if laser_rising_bins[-1] >= laser_falling_bins[-1]:
-                    laser_rising_bins = laser_rising_bins[:-1]
-                else:
-                    laser_rising_bins = laser_rising_bins[1:]
-            else:
-                if laser_rising_bins[0] >= laser_falling_bins[0]:
-                    laser_falling_bins = laser_falling_bins[1:]
-                else:
-                    laser_falling_bins = laser_falling_bins[:-1]
-
-        # convert to bins of fastcounter
-        laser_rising_bins = np.rint(laser_rising_bins / sample_rate / fc_binwidth).astype('int64')
-        laser_falling_bins = np.rint(laser_falling_bins / sample_rate / fc_binwidth).astype('int64')
+        # get laser rising and falling bins in fastcounter bins
+        laser_bins = self._get_laser_bins_from_sampling_information()
+        if laser_bins is None:
+            return {'laser_counts_arr': np.zeros(0, dtype='int64'),
+                    'laser_indices_rising': -1,
+                    'laser_indices_falling': -1}
+        laser_rising_bins, laser_falling_bins = laser_bins
         # convert to fastcounter bins
         safety_bins = round(safety / fc_binwidth)
         delay_bins = round(delay / fc_binwidth)
@@ -382,11 +367,10 @@ class BasicPulseExtractor(PulseExtractorBase):
         num_col = max_laser_length + 2 * safety_bins
         # compute from laser_start_indices and laser length the respective position of the laser
         # pulses
-        laser_pulses = np.empty((num_rows, num_col))
+        laser_pulses = np.empty((num_rows, num_col), dtype=count_data.dtype)
         for ii in range(num_rows):
-            laser_pulses[ii][:] = count_data[
-                np.arange(laser_rising_bins[ii] + delay_bins - safety_bins,
-                          laser_rising_bins[ii] + delay_bins + safety_bins + max_laser_length)]
+            start = laser_rising_bins[ii] + delay_bins - safety_bins
+            laser_pulses[ii] = count_data[start:start + num_col]
         # use the gated extraction method
         return_dict = self.gated_conv_deriv(laser_pulses, conv_std_dev)
         return return_dict
@@ -406,7 +390,8 @@ class BasicPulseExtractor(PulseExtractorBase):
         # Create return dictionary
         return_dict = {'laser_counts_arr': np.reshape(count_data, (-1, 1)),
                        'laser_indices_rising': np.arange(len(count_data)),
-                       'laser_indices_falling': np.arange(len(count_data))}
+                       'laser_indices_falling': np.arange(len(count_data)),
+                       'fixed_laser_windows': True}
 
         return return_dict
 
@@ -422,8 +407,160 @@ class BasicPulseExtractor(PulseExtractorBase):
                       and falling flanks.
         """
         # Create return dictionary
-        return_dict = {'laser_counts_arr': np.array(count_data),
+        return_dict = {'laser_counts_arr': np.asarray(count_data),
                        'laser_indices_rising': np.arange(len(count_data)),
-                       'laser_indices_falling': np.arange(len(count_data))}
+                       'laser_indices_falling': np.arange(len(count_data)),
+                       'fixed_laser_windows': True}
+
+        return return_dict
+
+    def _detect_ungated_flanks(self, count_data, conv_std_dev, number_of_lasers):
+        """
+        Detects the rising and falling flanks of the laser pulses in an ungated timetrace.
+        See ungated_conv_deriv for a description of the procedure.
+
+        @param numpy.ndarray count_data: The raw timetrace data (1D) from an ungated fast counter
+        @param float conv_std_dev: The standard deviation of the gaussian used for smoothing
+        @param int number_of_lasers: The number of laser pulses to detect
+
+        @return tuple: sorted rising and falling flank indices (numpy.ndarray). None if the
+                       detection failed.
+        """
+        # apply gaussian filter to remove noise and compute the gradient of the timetrace sum
+        try:
+            conv = ndimage.filters.gaussian_filter1d(count_data.astype(float), conv_std_dev)
+        except:
+            conv = np.zeros(count_data.size)
+        try:
+            conv_deriv = np.gradient(conv)
+        except:
+            conv_deriv = np.zeros(conv.size)
+
+        # if gaussian smoothing or derivative failed, the returned array only contains zeros.
+        # Check for that and return None to indicate a failed flank detection.
+        if len(conv_deriv.nonzero()[0]) == 0:
+            return None
+
+        # use a reference for array, because the exact position of the peaks or dips
+        # (i.e. maxima or minima, which are the inflection points in the pulse) are distorted by
+        # a large conv_std_dev value.
+        try:
+            conv = ndimage.filters.gaussian_filter1d(count_data.astype(float), 10)
+        except:
+            conv = np.zeros(count_data.size)
+        try:
+            conv_deriv_ref = np.gradient(conv)
+        except:
+            conv_deriv_ref = np.zeros(conv.size)
+
+        # initialize arrays to contain indices for all rising and falling
+        # flanks, respectively
+        rising_ind = np.empty(number_of_lasers, dtype='int64')
+        falling_ind = np.empty(number_of_lasers, dtype='int64')
+
+        # Find as many rising and falling flanks as there are laser pulses in
+        # the trace:
+        for i in range(number_of_lasers):
+            # save the index of the absolute maximum of the derived time trace
+            # as rising edge position
+            rising_ind[i] = np.argmax(conv_deriv)
+
+            # refine the rising edge detection, by using a small and fixed
+            # conv_std_dev parameter to find the inflection point more precise
+            start_ind = int(rising_ind[i] - conv_std_dev)
+            if start_ind < 0:
+                start_ind = 0
+
+            stop_ind = int(rising_ind[i] + conv_std_dev)
+            if stop_ind > len(conv_deriv):
+                stop_ind = len(conv_deriv)
+
+            if start_ind == stop_ind:
+                stop_ind = start_ind + 1
+
+            rising_ind[i] = start_ind + np.argmax(conv_deriv_ref[start_ind:stop_ind])
+
+            # set this position and the surrounding of the saved edge to 0 to
+            # avoid a second detection
+            if rising_ind[i] < 2 * conv_std_dev:
+                del_ind_start = 0
+            else:
+                del_ind_start = rising_ind[i] - int(2 * conv_std_dev)
+            if (conv_deriv.size - rising_ind[i]) < 2 * conv_std_dev:
+                del_ind_stop = conv_deriv.size - 1
+            else:
+                del_ind_stop = rising_ind[i] + int(2 * conv_std_dev)
+                conv_deriv[del_ind_start:del_ind_stop] = 0
+
+            # save the index of the absolute minimum of the derived time trace
+            # as falling edge position
+            falling_ind[i] = np.argmin(conv_deriv)
+
+            # refine the falling edge detection, by using a small and fixed
+            # conv_std_dev parameter to find the inflection point more precise
+            start_ind = int(falling_ind[i] - conv_std_dev)
+            if start_ind < 0:
+                start_ind = 0
+
+            stop_ind = int(falling_ind[i] + conv_std_dev)
+            if stop_ind > len(conv_deriv):
+                stop_ind = len(conv_deriv)
+
+            if start_ind == stop_ind:
+                stop_ind = start_ind + 1
+
+            falling_ind[i] = start_ind + np.argmin(conv_deriv_ref[start_ind:stop_ind])
+
+            # set this position and the sourrounding of the saved flank to 0 to
+            #  avoid a second detection
+            if falling_ind[i] < 2 * conv_std_dev:
+                del_ind_start = 0
+            else:
+                del_ind_start = falling_ind[i] - int(2 * conv_std_dev)
+            if (conv_deriv.size - falling_ind[i]) < 2 * conv_std_dev:
+                del_ind_stop = conv_deriv.size - 1
+            else:
+                del_ind_stop = falling_ind[i] + int(2 * conv_std_dev)
+            conv_deriv[del_ind_start:del_ind_stop] = 0
+
+        # sort all indices of rising and falling flanks
+        rising_ind.sort()
+        falling_ind.sort()
+
+        return rising_ind, falling_ind
+
+    def _get_laser_bins_from_sampling_information(self):
+        """
+        Converts the laser rising and falling bins of the sampled waveform into fast counter bins.
+        Trailing or leading incomplete laser pulses are sorted out.
+
+        @return tuple: rising and falling flank positions (numpy.ndarray) in fast counter bins.
+                       None if the sampling information is not available.
+        """
+        try:
+            sample_rate = self.sampling_information['pulse_generator_settings']['sample_rate']
+            laser_rising_bins = self.sampling_information['laser_rising_bins']
+            laser_falling_bins = self.sampling_information['laser_falling_bins']
+        except (KeyError, TypeError):
+            self.log.error('Unable to determine laser flank positions. No sampling information '
+                           'available for the current measurement.')
+            return None
+        fc_binwidth = self.fast_counter_settings['bin_width']
 
-        return return_dict
\ No newline at end of file
+        # Sort out trailing or leading incomplete laser pulse
+        while len(laser_rising_bins) != len(laser_falling_bins):
+            if len(laser_rising_bins) > len(laser_falling_bins):
+                if laser_rising_bins[-1] >= laser_falling_bins[-1]:
+                    laser_rising_bins = laser_rising_bins[:-1]
+                else:
+                    laser_rising_bins = laser_rising_bins[1:]
+            else:
+                if laser_rising_bins[0] >= laser_falling_bins[0]:
+                    laser_falling_bins = laser_falling_bins[1:]
+                else:
+                    laser_falling_bins = laser_falling_bins[:-1]
+
+        # convert to bins of fastcounter
+        laser_rising_bins = np.rint(laser_rising_bins / sample_rate / fc_binwidth).astype('int64')
+        laser_falling_bins = np.rint(laser_falling_bins / sample_rate / fc_binwidth).astype('int64')
+        return laser_rising_bins, laser_falling_bins
@@ -38,6 +38,9 @@ class PulseExtractorBase:
     """
     def __init__(self, pulsedmeasurementlogic):
         self.__pulsedmeasurementlogic = pulsedmeasurementlogic
+        # Storage for extraction methods to keep results valid for a whole measurement (e.g. laser
+        # flank positions). Cleared upon each measurement start.
+        self.extraction_cache = dict()
 
     @property
     def is_gated(self):
@@ -78,6 +81,11 @@ class PulseExtractor(PulseExtractorBase):
        default data type.
     8) The keyword "method" must not be used in the extraction method parameters
 
+    Extraction methods can set the optional key "fixed_laser_windows" of the returned dict to True
+    if the laser pulses are cut from fixed positions of the count data that do not change on later
+    calls (e.g. cached flank positions). Only then laser pulses are extracted incrementally (see
+    config option "incremental_accumulation" of PulsedMeasurementLogic).
+
     See BasicPulseExtractor class for an example usage.
     """
 
@@ -85,6 +93,8 @@ class PulseExtractor(PulseExtractorBase):
         # Init base class
         super().__init__(pulsedmeasurementlogic)
 
+        # Extractor class instances providing the extraction methods
+        self._extractor_instances = list()
         # Dictionaries holding references to the extraction methods
         self._gated_extraction_methods = dict()
         self._ungated_extraction_methods = dict()
@@ -102,11 +112,11 @@ class PulseExtractor(PulseExtractorBase):
         # Import extraction modules and get a list of extractor classes
         extractor_classes = self.__import_external_extractors(paths=path_list)
 
-        # create an instance of each class and put them in a temporary list
-        extractor_instances = [cls(pulsedmeasurementlogic) for cls in extractor_classes]
+        # create an instance of each class
+        self._extractor_instances = [cls(pulsedmeasurementlogic) for cls in extractor_classes]
 
         # add references to all extraction methods in each instance to a dict
-        self.__populate_method_dicts(instance_list=extractor_instances)
+        self.__populate_method_dicts(instance_list=self._extractor_instances)
 
         # populate "_parameters" dictionary from extraction method signatures
         self.__populate_parameter_dict()
@@ -225,6 +235,16 @@ class PulseExtractor(PulseExtractorBase):
         kwargs = self._get_extraction_method_kwargs(extraction_method)
         return extraction_method(count_data=count_data, **kwargs)
 
+    def clear_extraction_cache(self):
+        """
+        Clears the extraction cache of all extractor instances. Needs to be called whenever cached
+        results (e.g. laser flank positions) become invalid, i.e. upon measurement start.
+        """
+        self.extraction_cache.clear()
+        for instance in self._extractor_instances:
+            instance.extraction_cache.clear()
+        return
+
     def _get_extraction_method_kwargs(self, method):
         """
         Get the proper values for keyword arguments other than "count_data" for <method>.
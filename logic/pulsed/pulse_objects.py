@@ -28,11 +28,35 @@ import importlib
 import numpy as np
 from collections import OrderedDict
 
-from logic.pulsed.sampling_functions import SamplingFunctions
+from logic.pulsed.sampling_functions import SamplingFunctions, SamplingBase
 from core.util.modules import get_main_dir
 from core.util.helpers import natural_sort
 
 
+def _get_function_index(func, functions, key_to_index):
+    """
+    Helper returning the index of a sampling function instance within a table of distinct sampling
+    functions. Functions not yet present are appended to the table. Functions with unhashable
+    parameters are always appended.
+
+    @param SamplingBase func: sampling function instance
+    @param list functions: table of distinct sampling function instances
+    @param dict key_to_index: maps the hashable function keys to their index in functions
+
+    @return int: index of func in functions
+    """
+    key = func.get_hashable_key()
+    if key is None:
+        functions.append(func)
+        return len(functions) - 1
+    func_index = key_to_index.get(key)
+    if func_index is None:
+        func_index = len(functions)
+        key_to_index[key] = func_index
+        functions.append(func)
+    return func_index
+
+
 class PulseBlockElement(object):
     """
     Object representing a single atomic element in a pulse block.
@@ -159,9 +183,23 @@ class PulseBlock(object):
         self.analog_channels = set()
         self.digital_channels = set()
         self.channel_set = set()
+        # Memoized per-element parameters (see get_element_table)
+        self._element_table = None
         self.refresh_parameters()
         return
 
+    def __getstate__(self):
+        # Do not serialize the memoized element table
+        state = self.__dict__.copy()
+        state['_element_table'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Instances pickled by older versions do not have the element table attribute
+        self._element_table = None
+        return
+
     def __repr__(self):
         repr_str = 'PulseBlock(name=\'{0}\', element_list=['.format(self.name)
         repr_str += ', '.join((repr(elem) for elem in self.element_list)) + '])'
@@ -233,6 +271,7 @@ class PulseBlock(object):
         else:
             raise TypeError('PulseBlock indices must be int or slice, not {0}'.format(type(key)))
         self.element_list[key] = copy.deepcopy(value)
+        self._element_table = None
         return
 
     def __delitem__(self, key):
@@ -248,6 +287,7 @@ class PulseBlock(object):
             self.init_length_s -= element.init_length_s
             self.increment_s -= element.increment_s
         del self.element_list[key]
+        self._element_table = None
         if len(self.element_list) == 0:
             self.init_length_s = 0.0
             self.increment_s = 0.0
@@ -276,6 +316,7 @@ class PulseBlock(object):
         which are attached in the element_list.
         """
         # the Pulse_Block parameters
+        self._element_table = None
         self.init_length_s = 0.0
         self.increment_s = 0.0
         self.channel_set = set()
@@ -298,6 +339,7 @@ class PulseBlock(object):
     def pop(self, position=None):
         if len(self.element_list) == 0:
             raise IndexError('pop from empty PulseBlock')
+        self._element_table = None
 
         if position is None:
             self.init_length_s -= self.element_list[-1].init_length_s
@@ -348,6 +390,7 @@ class PulseBlock(object):
         self.increment_s += element.increment_s
 
         self.element_list.insert(position, copy.deepcopy(element))
+        self._element_table = None
         return
 
     def append(self, element):
@@ -363,6 +406,7 @@ class PulseBlock(object):
 
     def clear(self):
         del self.element_list[:]
+        self._element_table = None
         self.init_length_s = 0.0
         self.increment_s = 0.0
         self.analog_channels = set()
@@ -372,8 +416,46 @@ class PulseBlock(object):
 
     def reverse(self):
         self.element_list.reverse()
+        self._element_table = None
         return
 
+    def get_element_table(self):
+        """
+        Returns the parameters of all PulseBlockElements in this block as numpy arrays.
+        The table is memoized and invalidated whenever the element list is altered through the
+        PulseBlock API or refresh_parameters is called. Call refresh_parameters after changing
+        PulseBlockElement instances in place.
+
+        @return dict: 'init_length_s' (float64 array), 'increment_s' (float64 array),
+                      'laser_on' (bool array), 'digital_high' (dict with keys being the digital
+                      channel descriptors and items being bool arrays), 'functions' (list of
+                      distinct sampling function instances) and 'function_indices' (dict with
+                      keys being the analog channel descriptors and items being int64 arrays of
+                      indices into 'functions')
+        """
+        if self._element_table is None:
+            table = dict()
+            table['init_length_s'] = np.array([elem.init_length_s for elem in self.element_list],
+                                              dtype='float64')
+            table['increment_s'] = np.array([elem.increment_s for elem in self.element_list],
+                                            dtype='float64')
+            table['laser_on'] = np.array([elem.laser_on for elem in self.element_list], dtype=bool)
+            table['digital_high'] = {
+                chnl: np.array([elem.digital_high[chnl] for elem in self.element_list], dtype=bool)
+                for chnl in self.digital_channels}
+            functions = list()
+            key_to_index = dict()
+            function_indices = {chnl: np.empty(len(self.element_list), dtype='int64')
+                                for chnl in self.analog_channels}
+            for elem_index, elem in enumerate(self.element_list):
+                for chnl, func in elem.pulse_function.items():
+                    func_index = _get_function_index(func, functions, key_to_index)
+                    function_indices[chnl][elem_index] = func_index
+            table['functions'] = functions
+            table['function_indices'] = function_indices
+            self._element_table = table
+        return self._element_table
+
     def get_dict_representation(self):
         dict_repr = dict()
         dict_repr['name'] = self.name
@@ -384,11 +466,375 @@ class PulseBlock(object):
 
     @staticmethod
     def block_from_dict(block_dict):
+        if 'element_table' in block_dict:
+            return CompactPulseBlock.block_from_dict(block_dict)
         for ii, element_dict in enumerate(block_dict['element_list']):
             block_dict['element_list'][ii] = PulseBlockElement.element_from_dict(element_dict)
         return PulseBlock(**block_dict)
 
 
+class CompactPulseBlock(PulseBlock):
+    """
+    PulseBlock storing its elements as structure-of-arrays instead of a list of PulseBlockElement
+    instances. Meant for blocks with very many elements (e.g. long dynamical decoupling trains).
+
+    Element lengths, increments and laser flags are kept in numpy arrays, the digital channel
+    states in a bitmask (one bit per digital channel, max. 64 channels) and the analog channels as
+    indices into a table of distinct sampling function instances.
+
+    The list-like API of PulseBlock is preserved. Element access (indexing, iteration,
+    element_list) creates new PulseBlockElement instances on the fly, so altering those in place
+    has no effect on the block. Use item assignment instead.
+    """
+    _max_digital_channels = 64
+
+    def __init__(self, name, element_list=None):
+        """
+        @param str name: chosen name for the CompactPulseBlock
+        @param list element_list: PulseBlockElement instances to initialize the block with
+        """
+        self._reset_table()
+        super().__init__(name=name, element_list=element_list)
+        return
+
+    def _reset_table(self):
+        self._analog_channel_order = list()
+        self._digital_channel_order = list()
+        self._init_length_s = np.empty(0, dtype='float64')
+        self._increment_s = np.empty(0, dtype='float64')
+        self._laser_on = np.empty(0, dtype=bool)
+        self._digital_mask = np.empty(0, dtype='uint64')
+        self._function_indices = np.empty((0, 0), dtype='int32')
+        self._functions = list()
+        self._function_keys = dict()
+        self.init_length_s = 0.0
+        self.increment_s = 0.0
+        self.analog_channels = set()
+        self.digital_channels = set()
+        self.channel_set = set()
+        self._element_table = None
+        return
+
+    def __repr__(self):
+        repr_str = 'CompactPulseBlock(name=\'{0}\', element_list=['.format(self.name)
+        repr_str += ', '.join((repr(elem) for elem in self)) + '])'
+        return repr_str
+
+    def __len__(self):
+        return self._init_length_s.size
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._get_element(index)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._get_element(self._normalize_index(key))
+        if isinstance(key, slice):
+            return [self._get_element(index) for index in range(*key.indices(len(self)))]
+        raise TypeError('PulseBlock indices must be int or slice, not {0}'.format(type(key)))
+
+    def __setitem__(self, key, value):
+        if isinstance(key, int):
+            if not isinstance(value, PulseBlockElement):
+                raise TypeError('PulseBlock element list entries must be of type PulseBlockElement,'
+                                ' not {0}'.format(type(value)))
+            index = self._normalize_index(key)
+            key = slice(index, index + 1)
+            value = [value]
+        elif not isinstance(key, slice):
+            raise TypeError('PulseBlock indices must be int or slice, not {0}'.format(type(key)))
+
+        arrays = self._elements_to_arrays(value)
+        start, stop, step = key.indices(len(self))
+        if step == 1:
+            stop = max(start, stop)
+            self._init_length_s, self._increment_s, self._laser_on, self._digital_mask = (
+                np.concatenate((old[:start], new, old[stop:])) for old, new in
+                zip(self._get_arrays()[:4], arrays[:4]))
+            self._function_indices = np.concatenate((self._function_indices[:, :start],
+                                                     arrays[4],
+                                                     self._function_indices[:, stop:]), axis=1)
+        else:
+            number_of_indices = len(range(start, stop, step))
+            if number_of_indices != len(arrays[0]):
+                raise ValueError('attempt to assign sequence of size {0:d} to extended slice of '
+                                 'size {1:d}'.format(len(arrays[0]), number_of_indices))
+            for old, new in zip(self._get_arrays()[:4], arrays[:4]):
+                old[key] = new
+            self._function_indices[:, key] = arrays[4]
+        self.refresh_parameters()
+        return
+
+    def __delitem__(self, key):
+        if isinstance(key, int):
+            key = self._normalize_index(key)
+        elif not isinstance(key, slice):
+            raise TypeError('PulseBlock indices must be int or slice, not {0}'.format(type(key)))
+        keep = np.ones(len(self), dtype=bool)
+        keep[key] = False
+        self._init_length_s, self._increment_s, self._laser_on, self._digital_mask = (
+            array[keep] for array in self._get_arrays()[:4])
+        self._function_indices = self._function_indices[:, keep]
+        self.refresh_parameters()
+        return
+
+    @property
+    def element_list(self):
+        """ List of PulseBlockElement instances created from the element table """
+        return list(self)
+
+    @element_list.setter
+    def element_list(self, element_list):
+        self.clear()
+        self.extend(element_list)
+        return
+
+    def refresh_parameters(self):
+        """ Initialize the parameters which describe this CompactPulseBlock object from the element
+        table.
+        """
+        self._element_table = None
+        # Accumulate sequentially like PulseBlock does to end up with identical lengths
+        self.init_length_s = float(np.cumsum(self._init_length_s)[-1]) if len(self) else 0.0
+        self.increment_s = float(np.cumsum(self._increment_s)[-1]) if len(self) else 0.0
+        self.analog_channels = set(self._analog_channel_order)
+        self.digital_channels = set(self._digital_channel_order)
+        self.channel_set = self.analog_channels.union(self.digital_channels)
+        return
+
+    def pop(self, position=None):
+        if len(self) == 0:
+            raise IndexError('pop from empty PulseBlock')
+        if position is None:
+            position = -1
+        if not isinstance(position, int):
+            raise TypeError('PulseBlock.pop position argument expects integer, not {0}'
+                            ''.format(type(position)))
+        element = self[position]
+        del self[position]
+        return element
+
+    def insert(self, position, element):
+        """ Insert a PulseBlockElement at the given position. The old element at this position and
+        all consecutive elements after that will be shifted to higher indices.
+
+        @param int position: position in the element list
+        @param PulseBlockElement element: PulseBlockElement instance
+        """
+        if not isinstance(element, PulseBlockElement):
+            raise ValueError('PulseBlock elements must be of type PulseBlockElement, not {0}'
+                             ''.format(type(element)))
+        if position < 0:
+            position = len(self) + position
+        if len(self) < position or position < 0:
+            raise IndexError('PulseBlock element list index out of range')
+        self[position:position] = [element]
+        return
+
+    def extend(self, iterable):
+        self[len(self):] = list(iterable)
+        return
+
+    def clear(self):
+        self._reset_table()
+        return
+
+    def reverse(self):
+        self._init_length_s, self._increment_s, self._laser_on, self._digital_mask = (
+            array[::-1].copy() for array in self._get_arrays()[:4])
+        self._function_indices = self._function_indices[:, ::-1].copy()
+        self._element_table = None
+        return
+
+    def get_element_table(self):
+        """
+        Returns the parameters of all elements in this block as numpy arrays.
+        See PulseBlock.get_element_table for the content of the returned dict.
+        The arrays must not be altered.
+        """
+        if self._element_table is None:
+            table = dict()
+            table['init_length_s'] = self._init_length_s
+            table['increment_s'] = self._increment_s
+            table['laser_on'] = self._laser_on
+            table['digital_high'] = {
+                chnl: (self._digital_mask & np.uint64(1 << bit)).astype(bool)
+                for bit, chnl in enumerate(self._digital_channel_order)}
+            table['functions'] = list(self._functions)
+            table['function_indices'] = {
+                chnl: self._function_indices[row].astype('int64')
+                for row, chnl in enumerate(self._analog_channel_order)}
+            self._element_table = table
+        return self._element_table
+
+    def get_dict_representation(self):
+        # Only keep the sampling functions still in use
+        used, indices = np.unique(self._function_indices, return_inverse=True)
+        table = dict()
+        table['init_length_s'] = self._init_length_s.copy()
+        table['increment_s'] = self._increment_s.copy()
+        table['laser_on'] = self._laser_on.copy()
+        table['digital_channels'] = list(self._digital_channel_order)
+        table['digital_mask'] = self._digital_mask.copy()
+        table['analog_channels'] = list(self._analog_channel_order)
+        table['functions'] = [self._functions[index].get_dict_representation() for index in used]
+        table['function_indices'] = indices.reshape(self._function_indices.shape).astype('int32')
+        return {'name': self.name, 'element_table': table}
+
+    @staticmethod
+    def block_from_dict(block_dict):
+        table = block_dict['element_table']
+        block = CompactPulseBlock(name=block_dict['name'])
+        block._set_channels(table['analog_channels'], table['digital_channels'])
+        for func_dict in table['functions']:
+            sf_class = getattr(SamplingFunctions, func_dict['name'])
+            func = sf_class(**func_dict['params'])
+            key = func.get_hashable_key()
+            if key is not None:
+                block._function_keys.setdefault(key, len(block._functions))
+            block._functions.append(func)
+        block._init_length_s = np.array(table['init_length_s'], dtype='float64')
+        block._increment_s = np.array(table['increment_s'], dtype='float64')
+        block._laser_on = np.array(table['laser_on'], dtype=bool)
+        block._digital_mask = np.array(table['digital_mask'], dtype='uint64')
+        block._function_indices = np.array(table['function_indices'], dtype='int32')
+        block.refresh_parameters()
+        return block
+
+    @classmethod
+    def from_arrays(cls, name, init_length_s, increment_s=None, laser_on=None, digital_high=None,
+                    pulse_function=None):
+        """
+        Creates a CompactPulseBlock directly from per-element parameter arrays without creating
+        PulseBlockElement instances.
+
+        @param str name: chosen name for the CompactPulseBlock
+        @param numpy.ndarray init_length_s: initial lengths of all elements in seconds
+        @param numpy.ndarray increment_s: length increments of all elements in seconds
+                                          (default: 0)
+        @param numpy.ndarray laser_on: laser_on flags of all elements (default: False)
+        @param dict digital_high: keys being the digital channel descriptors and items being bool
+                                  arrays with the channel states of all elements
+        @param dict pulse_function: keys being the analog channel descriptors and items being
+                                    either a single sampling function instance used for all
+                                    elements or a sequence with one instance per element
+
+        @return CompactPulseBlock: the created block
+        """
+        block = cls(name=name)
+        init_length_s = np.array(init_length_s, dtype='float64', ndmin=1)
+        number_of_elements = init_length_s.size
+        digital_high = dict() if digital_high is None else digital_high
+        pulse_function = dict() if pulse_function is None else pulse_function
+        block._set_channels(natural_sort(pulse_function), natural_sort(digital_high))
+
+        block._init_length_s = init_length_s
+        block._increment_s = np.zeros(number_of_elements, dtype='float64')
+        if increment_s is not None:
+            block._increment_s[:] = increment_s
+        block._laser_on = np.zeros(number_of_elements, dtype=bool)
+        if laser_on is not None:
+            block._laser_on[:] = laser_on
+        block._digital_mask = np.zeros(number_of_elements, dtype='uint64')
+        for bit, chnl in enumerate(block._digital_channel_order):
+            states = np.broadcast_to(np.asarray(digital_high[chnl], dtype=bool),
+                                     (number_of_elements,))
+            block._digital_mask[states] |= np.uint64(1 << bit)
+        block._function_indices = np.empty((len(pulse_function), number_of_elements),
+                                           dtype='int32')
+        for row, chnl in enumerate(block._analog_channel_order):
+            functions = pulse_function[chnl]
+            if isinstance(functions, SamplingBase):
+                block._function_indices[row] = block._add_function(functions)
+            else:
+                if len(functions) != number_of_elements:
+                    raise ValueError('Number of sampling functions for channel "{0}" ({1:d}) '
+                                     'does not match the number of elements ({2:d}).'
+                                     ''.format(chnl, len(functions), number_of_elements))
+                block._function_indices[row] = [block._add_function(func) for func in functions]
+        block.refresh_parameters()
+        return block
+
+    def _normalize_index(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('PulseBlock element list index out of range')
+        return index
+
+    def _get_arrays(self):
+        return (self._init_length_s, self._increment_s, self._laser_on, self._digital_mask,
+                self._function_indices)
+
+    def _set_channels(self, analog_channels, digital_channels):
+        """ Fixes the channel layout of the element table. Only allowed for empty blocks. """
+        if len(digital_channels) > self._max_digital_channels:
+            raise ValueError('CompactPulseBlock supports at most {0:d} digital channels.'
+                             ''.format(self._max_digital_channels))
+        self._analog_channel_order = list(analog_channels)
+        self._digital_channel_order = list(digital_channels)
+        self._function_indices = np.empty((len(self._analog_channel_order), 0), dtype='int32')
+        self.refresh_parameters()
+        return
+
+    def _add_function(self, func):
+        """ Adds a (copy of a) sampling function to the function table and returns its index """
+        index = _get_function_index(func, self._functions, self._function_keys)
+        if self._functions[index] is func:
+            self._functions[index] = copy.deepcopy(func)
+        return index
+
+    def _get_element(self, index):
+        mask = int(self._digital_mask[index])
+        digital_high = OrderedDict((chnl, bool(mask >> bit & 1))
+                                   for bit, chnl in enumerate(self._digital_channel_order))
+        pulse_function = OrderedDict(
+            (chnl, copy.deepcopy(self._functions[self._function_indices[row, index]]))
+            for row, chnl in enumerate(self._analog_channel_order))
+        return PulseBlockElement(init_length_s=float(self._init_length_s[index]),
+                                 increment_s=float(self._increment_s[index]),
+                                 pulse_function=pulse_function,
+                                 digital_high=digital_high,
+                                 laser_on=bool(self._laser_on[index]))
+
+    def _elements_to_arrays(self, elements):
+        """
+        Converts PulseBlockElement instances into element table arrays after checking them for
+        consistency with the channel layout of this block.
+
+        @param iterable elements: PulseBlockElement instances
+
+        @return tuple: init_length_s, increment_s, laser_on, digital_mask and function_indices
+                       arrays of the elements
+        """
+        elements = list(elements)
+        for element in elements:
+            if not isinstance(element, PulseBlockElement):
+                raise TypeError('PulseBlock element list entries must be of type '
+                                'PulseBlockElement, not {0}'.format(type(element)))
+            if not self.channel_set:
+                self._set_channels(natural_sort(element.analog_channels),
+                                   natural_sort(element.digital_channels))
+            elif element.channel_set != self.channel_set:
+                raise ValueError('Usage of different sets of analog and digital channels in the '
+                                 'same PulseBlock is prohibited. Used channel sets are:\n{0}\n{1}'
+                                 ''.format(self.channel_set, element.channel_set))
+
+        init_length_s = np.array([elem.init_length_s for elem in elements], dtype='float64')
+        increment_s = np.array([elem.increment_s for elem in elements], dtype='float64')
+        laser_on = np.array([elem.laser_on for elem in elements], dtype=bool)
+        digital_mask = np.zeros(len(elements), dtype='uint64')
+        for bit, chnl in enumerate(self._digital_channel_order):
+            states = np.array([elem.digital_high[chnl] for elem in elements], dtype=bool)
+            digital_mask[states] |= np.uint64(1 << bit)
+        function_indices = np.array(
+            [[self._add_function(elem.pulse_function[chnl]) for elem in elements]
+             for chnl in self._analog_channel_order], dtype='int32').reshape(
+            (len(self._analog_channel_order), len(elements)))
+        return init_length_s, increment_s, laser_on, digital_mask, function_indices
+
+
 class PulseBlockEnsemble(object):
     """
     Represents a collection of PulseBlock objects which is called a PulseBlockEnsemble.
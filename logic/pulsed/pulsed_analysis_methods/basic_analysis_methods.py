@@ -56,35 +56,27 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         norm_start_bin = round(norm_start / bin_width)
         norm_end_bin = round(norm_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum and mean of the data in the normalization window
-            tmp_data = laser_arr[norm_start_bin:norm_end_bin]
-            reference_sum = np.sum(tmp_data)
-            reference_mean = (reference_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
-
-            # calculate the sum and mean of the data in the signal window
-            tmp_data = laser_arr[signal_start_bin:signal_end_bin]
-            signal_sum = np.sum(tmp_data)
-            signal_mean = (signal_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
-
-            # Calculate normalized signal while avoiding division by zero
-            if reference_mean > 0 and signal_mean >= 0:
-                signal_data[ii] = signal_mean / reference_mean
-            else:
-                signal_data[ii] = 0.0
-
-            # Calculate measurement error while avoiding division by zero
-            if reference_sum > 0 and signal_sum > 0:
-                # calculate with respect to gaussian error 'evolution'
-                error_data[ii] = signal_data[ii] * np.sqrt(1 / signal_sum + 1 / reference_sum)
-            else:
-                error_data[ii] = 0.0
-
+        # calculate the sums and means of the data in the normalization and signal window for all
+        # laser pulses at once
+        window_sums = self.get_window_sums(laser_data)
+        reference_sum, reference_mean = self._window_sum_and_mean(window_sums,
+                                                                  norm_start_bin,
+                                                                  norm_end_bin)
+        signal_sum, signal_mean = self._window_sum_and_mean(window_sums,
+                                                            signal_start_bin,
+                                                            signal_end_bin)
+
+        # Calculate normalized signal while avoiding division by zero
+        signal_data = np.zeros(num_of_lasers, dtype=float)
+        valid = (reference_mean > 0) & (signal_mean >= 0)
+        signal_data[valid] = signal_mean[valid] / reference_mean[valid]
+
+        # Calculate measurement error while avoiding division by zero
+        # (with respect to gaussian error 'evolution')
+        error_data = np.zeros(num_of_lasers, dtype=float)
+        valid = (reference_sum > 0) & (signal_sum > 0)
+        error_data[valid] = signal_data[valid] * np.sqrt(1 / signal_sum[valid] +
+                                                         1 / reference_sum[valid])
         return signal_data, error_data
 
     def analyse_sum(self, laser_data, signal_start=0.0, signal_end=200e-9):
@@ -106,24 +98,17 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         signal_start_bin = round(signal_start / bin_width)
         signal_end_bin = round(signal_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum of the data in the signal window
-            signal = laser_arr[:].sum()
-            signal_error = np.sqrt(signal)
-
-            # Avoid numpy C type variables overflow and NaN values
-            if signal < 0 or signal != signal:
-                signal_data[ii] = 0.0
-                error_data[ii] = 0.0
-            else:
-                signal_data[ii] = signal
-                error_data[ii] = signal_error
-
+        # calculate the sum of the data of each laser pulse (in float to avoid an overflow of the
+        # native counter dtype)
+        signal, _ = self.get_window_sums(laser_data).window_sum(0, laser_data.shape[1])
+        signal = signal.astype(np.float64)
+
+        # Avoid numpy C type variables overflow and NaN values
+        signal_data = np.zeros(num_of_lasers, dtype=float)
+        error_data = np.zeros(num_of_lasers, dtype=float)
+        valid = signal >= 0
+        signal_data[valid] = signal[valid]
+        error_data[valid] = np.sqrt(signal[valid])
         return signal_data, error_data
 
     def analyse_mean(self, laser_data, signal_start=0.0, signal_end=200e-9):
@@ -147,25 +132,19 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         signal_start_bin = round(signal_start / bin_width)
         signal_end_bin = round(signal_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the mean of the data in the signal window
-            signal = laser_arr[:].mean()
-            signal_sum = laser_arr[:].sum()
-            signal_error = np.sqrt(signal_sum)# / (signal_end_bin - signal_start_bin)
-
-            # Avoid numpy C type variables overflow and NaN values
-            if signal < 0 or signal != signal:
-                signal_data[ii] = 0.0
-                error_data[ii] = 0.0
-            else:
-                signal_data[ii] = signal
-                error_data[ii] = signal_error
-
+        # calculate the mean and sum of the data of each laser pulse
+        signal_sum, signal = self._window_sum_and_mean(self.get_window_sums(laser_data),
+                                                       0,
+                                                       laser_data.shape[1])
+        signal_sum = signal_sum.astype(np.float64)
+
+        # Avoid numpy C type variables overflow and NaN values
+        signal_data = np.zeros(num_of_lasers, dtype=float)
+        error_data = np.zeros(num_of_lasers, dtype=float)
+        valid = signal >= 0
+        signal_data[valid] = signal[valid]
+        with np.errstate(invalid='ignore'):
+            error_data[valid] = np.sqrt(signal_sum[valid])
         return signal_data, error_data
 
     def analyse_pass_through(self, laser_data):
@@ -215,25 +194,35 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         norm_start_bin = round(norm_start / bin_width)
         norm_end_bin = round(norm_end / bin_width)
 
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum and mean of the data in the normalization window
-            tmp_data = laser_arr[norm_start_bin:norm_end_bin]
-            reference_sum = np.sum(tmp_data)
-            reference_mean = (reference_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
-
-            # calculate the sum and mean of the data in the signal window
-            tmp_data = laser_arr[signal_start_bin:signal_end_bin]
-            signal_sum = np.sum(tmp_data)
-            signal_mean = (signal_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
+        # calculate the sums and means of the data in the normalization and signal window for all
+        # laser pulses at once
+        window_sums = self.get_window_sums(laser_data)
+        reference_sum, reference_mean = self._window_sum_and_mean(window_sums,
+                                                                  norm_start_bin,
+                                                                  norm_end_bin)
+        signal_sum, signal_mean = self._window_sum_and_mean(window_sums,
+                                                            signal_start_bin,
+                                                            signal_end_bin)
+
+        signal_data = signal_mean - reference_mean
+
+        # calculate with respect to gaussian error 'evolution'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error_data = signal_data * np.sqrt(1 / np.abs(signal_sum) + 1 / np.abs(reference_sum))
+        return signal_data, error_data
 
-            signal_data[ii] = signal_mean - reference_mean
+    @staticmethod
+    def _window_sum_and_mean(window_sums, start_bin, stop_bin):
+        """
+        Helper method to calculate the sum and mean over a time bin window for all laser pulses.
 
-            # calculate with respect to gaussian error 'evolution'
-            error_data[ii] = signal_data[ii] * np.sqrt(1 / abs(signal_sum) + 1 / abs(reference_sum))
+        @param object window_sums: window sum backend instance (see PulseAnalyzerBase)
+        @param int start_bin: first time bin of the window
+        @param int stop_bin: time bin after the last time bin of the window
 
-        return signal_data, error_data
+        @return (numpy.ndarray, numpy.ndarray): window sum and window mean (0 for empty windows)
+        """
+        window_sum, window_length = window_sums.window_sum(start_bin, stop_bin)
+        if window_length == 0:
+            return window_sum, np.zeros(len(window_sum), dtype=float)
+        return window_sum, window_sum / window_length
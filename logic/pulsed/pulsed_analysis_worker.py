@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi background worker polling the fast counter and analysing the acquired
+data of a pulsed measurement decoupled from the logic thread.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import threading
+import time
+from collections import deque
+
+from core.util.worker_statistics import WorkerStatistics
+
+
+class PulsedAnalysisWorker:
+    """
+    Two stage pipeline for pulsed measurements:
+    An acquisition thread polls the fast counter every <interval> seconds and puts the acquired
+    frames into a bounded queue. A processing thread takes the frames from the queue and
+    extracts/analyses them.
+
+    If the processing can not keep up with the acquisition the oldest queued frame is dropped since
+    a newer accumulated trace supersedes it. Differential frames (info_dict key "is_differential")
+    only contain the counts since the previous frame and are merged (summed) instead of dropped.
+
+    Latency statistics of all stages are available via the "statistics" property.
+    """
+
+    def __init__(self, acquire, process, interval, queue_size=1, log=None):
+        """
+        @param callable acquire: function without arguments returning a frame tuple
+                                 (numpy.ndarray count data, dict info_dict)
+        @param callable process: function taking a frame tuple as only argument
+        @param float interval: polling interval of the acquisition in s (<= 0: polling paused)
+        @param int queue_size: maximum number of frames waiting for processing
+        @param logger log: logger to report errors of the acquisition and processing with
+        """
+        self._acquire = acquire
+        self._process = process
+        self._interval = float(interval)
+        self._queue_size = max(1, int(queue_size))
+        self.log = log
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._wakeup_event = threading.Event()
+        self._acquisition_finished = False
+        self._acquisition_thread = None
+        self._processing_thread = None
+
+        self._statistics = WorkerStatistics(
+            stages=('acquisition', 'queue', 'processing', 'latency'),
+            counters=('frames_acquired', 'frames_processed', 'frames_dropped', 'frames_merged'))
+        return
+
+    @property
+    def is_running(self):
+        return self._acquisition_thread is not None and self._acquisition_thread.is_alive()
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @interval.setter
+    def interval(self, value):
+        self._interval = float(value)
+        # Apply new interval immediately
+        self._wakeup_event.set()
+
+    @property
+    def statistics(self):
+        """
+        Latency statistics of the pipeline stages in s (last, mean and max of the most recent
+        frames) for "acquisition" (duration of the fast counter read), "queue" (time waited for
+        processing), "processing" (duration of extraction and analysis) and "latency" (from the
+        start of the fast counter read to the end of the processing).
+        Also contains the number of frames acquired, processed, dropped and merged.
+
+        @return dict: statistics
+        """
+        return self._statistics.as_dict()
+
+    def reset_statistics(self):
+        self._statistics.reset()
+        return
+
+    def start(self):
+        """
+        Starts the acquisition and processing threads. Does nothing if already running.
+        """
+        if self.is_running:
+            return
+        # Wait for threads of a previous run that are still finishing
+        self.stop()
+        self._stop_event.clear()
+        self._wakeup_event.clear()
+        self._acquisition_finished = False
+        self._processing_thread = threading.Thread(target=self._processing_loop,
+                                                   name='PulsedAnalysisProcessing',
+                                                   daemon=True)
+        self._acquisition_thread = threading.Thread(target=self._acquisition_loop,
+                                                    name='PulsedAnalysisAcquisition',
+                                                    daemon=True)
+        self._processing_thread.start()
+        self._acquisition_thread.start()
+        return
+
+    def stop(self):
+        """
+        Stops the acquisition and waits until all queued frames have been processed.
+        Must not be called from within the process function.
+        """
+        self._stop_event.set()
+        self._wakeup_event.set()
+        # The processing thread finishes after the acquisition thread and the queued frames
+        for thread in (self._acquisition_thread, self._processing_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        self._acquisition_thread = None
+        self._processing_thread = None
+        return
+
+    def _acquisition_loop(self):
+        try:
+            while not self._stop_event.is_set():
+                if self._interval <= 0:
+                    self._wakeup_event.wait()
+                    self._wakeup_event.clear()
+                    continue
+                start = time.perf_counter()
+                try:
+                    frame = self._acquire()
+                except Exception:
+                    self._log_exception('Error while polling fast counter data.')
+                    frame = None
+                stop = time.perf_counter()
+                if frame is not None:
+                    self._enqueue(frame, start, stop)
+                # Wait for the rest of the interval (or until woken up by stop / new interval)
+                remaining = self._interval - (time.perf_counter() - start)
+                if remaining > 0 and self._wakeup_event.wait(remaining):
+                    self._wakeup_event.clear()
+        finally:
+            with self._condition:
+                self._acquisition_finished = True
+                self._condition.notify_all()
+        return
+
+    def _enqueue(self, frame, acquisition_start, acquisition_stop):
+        with self._condition:
+            self._statistics.increment('frames_acquired')
+            self._statistics.add_duration('acquisition', acquisition_stop - acquisition_start)
+            if len(self._queue) >= self._queue_size:
+                old_frame, old_start, _ = self._queue.popleft()
+                if self._is_differential(old_frame) and self._is_differential(frame):
+                    # Keep the counts of the older frame and the latency reference of its start
+                    frame = (old_frame[0] + frame[0], frame[1])
+                    acquisition_start = old_start
+                    self._statistics.increment('frames_merged')
+                else:
+                    self._statistics.increment('frames_dropped')
+            self._queue.append((frame, acquisition_start, acquisition_stop))
+            self._condition.notify_all()
+        return
+
+    def _processing_loop(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._acquisition_finished:
+                    self._condition.wait()
+                if not self._queue:
+                    # acquisition stopped and all frames processed
+                    break
+                frame, acquisition_start, acquisition_stop = self._queue.popleft()
+            start = time.perf_counter()
+            try:
+                self._process(frame)
+            except Exception:
+                self._log_exception('Error while processing fast counter data.')
+            stop = time.perf_counter()
+            self._statistics.increment('frames_processed')
+            self._statistics.add_duration('queue', start - acquisition_stop)
+            self._statistics.add_duration('processing', stop - start)
+            self._statistics.add_duration('latency', stop - acquisition_start)
+        return
+
+    def _log_exception(self, msg):
+        if self.log is not None:
+            self.log.exception(msg)
+        return
+
+    @staticmethod
+    def _is_differential(frame):
+        return isinstance(frame[1], dict) and bool(frame[1].get('is_differential'))
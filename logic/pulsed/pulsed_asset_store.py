@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi single-file storage for pulsed assets (PulseBlock, PulseBlockEnsemble
+and PulseSequence instances).
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from core.util.helpers import natural_sort
+from logic.pulsed.pulse_objects import PulseBlock, PulseBlockEnsemble, PulseSequence
+
+
+class PulsedAssetStore:
+    """
+    Single-file storage for PulseBlock, PulseBlockEnsemble and PulseSequence instances based on
+    SQLite.
+
+    Each asset is stored as pickled dict representation (see get_dict_representation) together with
+    its type and name. The asset names can be queried without loading the assets themselves.
+    Writes inside a "batch" context are committed all at once when leaving the outermost context.
+    """
+    asset_types = ('block', 'ensemble', 'sequence')
+
+    def __init__(self, file_path):
+        """
+        @param str file_path: path of the database file. Will be created if not present.
+        """
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS assets ('
+                                     'type TEXT NOT NULL, '
+                                     'name TEXT NOT NULL, '
+                                     'data BLOB NOT NULL, '
+                                     'PRIMARY KEY (type, name))')
+        return
+
+    def close(self):
+        """
+        Commits pending writes and closes the database file.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+        return
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager deferring the commit of all writes until the outermost batch is left.
+        """
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._connection.commit()
+
+    def _commit(self):
+        if self._batch_depth == 0:
+            self._connection.commit()
+        return
+
+    def get_names(self, asset_type):
+        """
+        Returns the naturally sorted names of all stored assets of a given type.
+
+        @param str asset_type: one of "block", "ensemble" or "sequence"
+        @return list: sorted asset names
+        """
+        with self._lock:
+            cursor = self._connection.execute('SELECT name FROM assets WHERE type=?',
+                                              (asset_type,))
+            return natural_sort(row[0] for row in cursor)
+
+    def load(self, asset_type, name):
+        """
+        Loads a single asset instance from the store.
+
+        @param str asset_type: one of "block", "ensemble" or "sequence"
+        @param str name: name of the asset
+
+        @return object: PulseBlock, PulseBlockEnsemble or PulseSequence instance. None if the asset
+                        is not present.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT data FROM assets WHERE type=? AND name=?',
+                                           (asset_type, name)).fetchone()
+        if row is None:
+            return None
+        asset_dict = pickle.loads(row[0])
+        if asset_type == 'block':
+            return PulseBlock.block_from_dict(asset_dict)
+        elif asset_type == 'ensemble':
+            return PulseBlockEnsemble.ensemble_from_dict(asset_dict)
+        return PulseSequence.sequence_from_dict(asset_dict)
+
+    def save(self, asset_type, asset):
+        """
+        Stores a single asset instance. Replaces an already stored asset with the same name.
+
+        @param str asset_type: one of "block", "ensemble" or "sequence"
+        @param object asset: PulseBlock, PulseBlockEnsemble or PulseSequence instance
+        """
+        asset_dict = asset.get_dict_representation()
+        if asset_type == 'sequence':
+            # Store sequence steps as plain dicts
+            asset_dict['ensemble_list'] = [dict(step) for step in asset_dict['ensemble_list']]
+        data = pickle.dumps(asset_dict, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO assets (type, name, data) VALUES (?, ?, ?)',
+                (asset_type, asset.name, sqlite3.Binary(data)))
+            self._commit()
+        return
+
+    def delete(self, asset_type, name):
+        """
+        Removes a single asset from the store.
+
+        @param str asset_type: one of "block", "ensemble" or "sequence"
+        @param str name: name of the asset
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM assets WHERE type=? AND name=?',
+                                     (asset_type, name))
+            self._commit()
+        return
+
+
+class LazyAssetDict(dict):
+    """
+    dict of asset names and asset instances. Instances are loaded via the loader function upon
+    first access. Iterating, membership tests and len() only need the asset names.
+    Assets that fail to load are removed from the dict.
+    """
+    _not_loaded = object()
+
+    def __init__(self, loader, names=None):
+        """
+        @param callable loader: function taking the asset name and returning the loaded asset
+                                instance (or None if loading failed)
+        @param iterable names: asset names available from the loader
+        """
+        super().__init__()
+        self._loader = loader
+        if names is not None:
+            for name in names:
+                super().__setitem__(name, self._not_loaded)
+        return
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if value is self._not_loaded:
+            value = self._loader(key)
+            if value is None:
+                super().__delitem__(key)
+                raise KeyError(key)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *args):
+        try:
+            value = self[key]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        super().__delitem__(key)
+        return value
+
+    def values(self):
+        return [value for key, value in self.items()]
+
+    def items(self):
+        items = list()
+        for key in list(self.keys()):
+            try:
+                items.append((key, self[key]))
+            except KeyError:
+                pass
+        return items
+
+    def copy(self):
+        return dict(self.items())
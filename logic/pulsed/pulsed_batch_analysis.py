@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi offline batch analysis of saved pulsed measurement raw data.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from core.util.helpers import natural_sort
+from logic.pulsed.pulse_analyzer import PulseAnalyzer
+from logic.pulsed.pulse_extractor import PulseExtractor
+from logic.pulsed.pulsed_data_file import FILE_EXTENSIONS, load_pulsed_data
+
+# Fields of the combined result table (one row per data point of each analysed file).
+# File paths are stored as python strings to not truncate long paths.
+RESULT_TABLE_DTYPE = [('file', object),
+                      ('controlled_variable', 'f8'),
+                      ('signal', 'f8'),
+                      ('error', 'f8'),
+                      ('signal_alt', 'f8'),
+                      ('error_alt', 'f8'),
+                      ('elapsed_sweeps', 'f8'),
+                      ('elapsed_time', 'f8')]
+
+# Analyzer instance of each worker process and the arguments it was created with
+# (see _analyse_file_in_worker)
+_worker_analyzer = None
+_worker_analyzer_kwargs = None
+
+
+class BatchMeasurementSettings:
+    """
+    Stand-in for PulsedMeasurementLogic providing PulseExtractor and PulseAnalyzer (and all
+    extractor/analyzer classes) with the settings of the saved measurement currently analysed.
+    """
+
+    def __init__(self, extraction_import_path=None, analysis_import_path=None,
+                 analysis_window_sum_backend='auto'):
+        self.extraction_import_path = extraction_import_path
+        self.analysis_import_path = analysis_import_path
+        self.analysis_window_sum_backend = analysis_window_sum_backend
+        self.extraction_parameters = None
+        self.analysis_parameters = None
+        self.fast_counter_settings = {'bin_width': 1e-9,
+                                      'record_length': 0.0,
+                                      'number_of_gates': 0,
+                                      'is_gated': False}
+        self.measurement_settings = {'invoke_settings': False,
+                                     'controlled_variable': np.empty(0, dtype=float),
+                                     'number_of_lasers': 0,
+                                     'laser_ignore_list': list(),
+                                     'alternating': False,
+                                     'units': ('s', ''),
+                                     'labels': ('Tau', 'Signal')}
+        self.sampling_information = dict()
+        self.log = logging.getLogger(__name__)
+
+
+class PulsedBatchAnalyzer:
+    """
+    Extracts and analyses the laser pulses of saved pulsed raw data files with PulseExtractor and
+    PulseAnalyzer. The extraction and analysis settings saved with each file are used unless they
+    are overridden by the settings given here.
+
+    Usable raw data files are the binary pulsed data files and snapshots (see PulsedDataFile) as
+    well as the raw timetrace files saved by PulsedMeasurementLogic as text or npz.
+    """
+
+    def __init__(self, extraction_settings=None, analysis_settings=None,
+                 extraction_import_path=None, analysis_import_path=None,
+                 analysis_window_sum_backend='auto'):
+        """
+        @param dict extraction_settings: extraction settings overriding the saved ones
+        @param dict analysis_settings: analysis settings overriding the saved ones
+        @param str extraction_import_path: additional path to import extraction methods from
+        @param str analysis_import_path: additional path to import analysis methods from
+        @param str analysis_window_sum_backend: window sum backend of the analysis methods
+        """
+        self.extraction_settings = extraction_settings.copy() if extraction_settings else dict()
+        self.analysis_settings = analysis_settings.copy() if analysis_settings else dict()
+        self._settings = BatchMeasurementSettings(
+            extraction_import_path=extraction_import_path,
+            analysis_import_path=analysis_import_path,
+            analysis_window_sum_backend=analysis_window_sum_backend)
+        # Extraction and analysis methods are only imported once for all analysed files
+        self._pulseextractor = PulseExtractor(pulsedmeasurementlogic=self._settings)
+        self._pulseanalyzer = PulseAnalyzer(pulsedmeasurementlogic=self._settings)
+        self._default_extraction_parameters = self._pulseextractor.full_settings_dict
+        self._default_analysis_parameters = self._pulseanalyzer.full_settings_dict
+        del self._default_extraction_parameters['method']
+        return
+
+    def analyse_file(self, file_path):
+        """
+        Loads the raw data of a saved pulsed measurement and extracts and analyses the laser pulses.
+
+        @param str file_path: path of the raw data file
+
+        @return dict: analysis result with keys "file", "controlled_variable", "signal", "error",
+                      "signal_alt", "error_alt" (NaN if not alternating), "elapsed_sweeps",
+                      "elapsed_time", "extraction_settings" and "analysis_settings"
+        """
+        raw_data, info = load_pulsed_raw_data(file_path)
+        self._settings.fast_counter_settings = info['fast_counter_settings']
+        self._settings.measurement_settings = info['measurement_settings']
+        self._settings.sampling_information = info['sampling_information']
+
+        # Start every file from the default parameters, so results do not depend on file order
+        extraction_settings = self._default_extraction_parameters.copy()
+        extraction_settings.update(info['extraction_settings'])
+        extraction_settings.update(self.extraction_settings)
+        if 'method' not in extraction_settings:
+            extraction_settings['method'] = natural_sort(
+                self._pulseextractor.extraction_methods)[0]
+        analysis_settings = self._default_analysis_parameters.copy()
+        analysis_settings.update(info['analysis_settings'])
+        analysis_settings.update(self.analysis_settings)
+        self._pulseextractor.extraction_settings = extraction_settings
+        self._pulseanalyzer.analysis_settings = analysis_settings
+
+        # Cached results (e.g. laser flank positions) are only valid for a single measurement
+        self._pulseextractor.clear_extraction_cache()
+        laser_data = self._pulseextractor.extract_laser_pulses(raw_data)['laser_counts_arr']
+        if laser_data.size == 0 or not laser_data.any():
+            raise ValueError('Laser pulse extraction failed for raw data file "{0}".'
+                             ''.format(file_path))
+        signal, error = self._pulseanalyzer.analyse_laser_pulses(laser_data)
+
+        # exclude laser pulses to ignore (negative indices are relative to the end)
+        ignore_list = info['measurement_settings'].get('laser_ignore_list', list())
+        if len(ignore_list) > 0:
+            ignore_list = np.unique(np.mod(ignore_list, len(signal)))
+            signal = np.delete(signal, ignore_list)
+            error = np.delete(error, ignore_list)
+
+        controlled_variable = np.asarray(
+            info['measurement_settings'].get('controlled_variable'), dtype=float)
+        alternating = info['measurement_settings'].get('alternating')
+        points = len(signal) // 2 if alternating else len(signal)
+        if len(controlled_variable) != points:
+            raise ValueError('Length of controlled variable ({0}) does not match number of readout '
+                             'pulses ({1}) in raw data file "{2}".'
+                             ''.format(len(controlled_variable), points, file_path))
+
+        result = dict()
+        result['file'] = file_path
+        result['controlled_variable'] = controlled_variable
+        if alternating:
+            result['signal'] = signal[::2]
+            result['error'] = error[::2]
+            result['signal_alt'] = signal[1::2]
+            result['error_alt'] = error[1::2]
+        else:
+            result['signal'] = signal
+            result['error'] = error
+            result['signal_alt'] = np.full(points, np.nan)
+            result['error_alt'] = np.full(points, np.nan)
+        result['elapsed_sweeps'] = info['elapsed_sweeps']
+        result['elapsed_time'] = info['elapsed_time']
+        result['extraction_settings'] = self._pulseextractor.extraction_settings
+        result['analysis_settings'] = self._pulseanalyzer.analysis_settings
+        return result
+
+
+def _analyse_file_in_worker(file_path, analyzer_kwargs):
+    """
+    Analyses a file in a worker process. The settings are passed with each file since the process
+    pool initializer is not available before Python 3.7. The PulsedBatchAnalyzer of the worker
+    process is only created again if the settings change (imports all methods only once).
+    """
+    global _worker_analyzer, _worker_analyzer_kwargs
+    if _worker_analyzer is None or _worker_analyzer_kwargs != analyzer_kwargs:
+        _worker_analyzer = PulsedBatchAnalyzer(**analyzer_kwargs)
+        _worker_analyzer_kwargs = analyzer_kwargs
+    return _worker_analyzer.analyse_file(file_path)
+
+
+def find_pulsed_raw_data_files(directory, recursive=False):
+    """
+    Returns all pulsed raw data files in a directory that can be batch analysed, i.e. binary pulsed
+    data files and snapshots (see PulsedDataFile) as well as raw timetrace text and npz files.
+
+    @param str directory: directory to search
+    @param bool recursive: also search all subdirectories
+
+    @return list: naturally sorted file paths
+    """
+    binary_extensions = tuple(FILE_EXTENSIONS.values())
+    file_paths = list()
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if ('pulsed_data' in name or 'pulsed_snapshot' in name) and \
+                    name.endswith(binary_extensions) and not name.endswith('.tmp.npz'):
+                file_paths.append(os.path.join(root, name))
+            elif 'raw_timetrace' in name and name.endswith(('.dat', '.npz')) and \
+                    not name.endswith('_params.dat'):
+                file_paths.append(os.path.join(root, name))
+        if not recursive:
+            break
+    return natural_sort(file_paths)
+
+
+def batch_analyse_pulsed_data(file_paths, extraction_settings=None, analysis_settings=None,
+                              max_workers=None, extraction_import_path=None,
+                              analysis_import_path=None, analysis_window_sum_backend='auto',
+                              recursive=False):
+    """
+    Re-analyses saved pulsed raw data files with the given extraction and analysis settings in a
+    process pool. Each worker process loads and analyses its files itself, so the raw data never
+    passes through the calling process.
+
+    @param file_paths: directory to analyse all raw data files in (see
+                       find_pulsed_raw_data_files) or list of file paths
+    @param dict extraction_settings: extraction settings overriding the saved ones (e.g.
+                                     {'method': 'conv_deriv', 'conv_std_dev': 10.0})
+    @param dict analysis_settings: analysis settings overriding the saved ones
+    @param int max_workers: number of worker processes (default: number of CPUs). With 0 all files
+                            are analysed in the calling process.
+    @param str extraction_import_path: additional path to import extraction methods from
+    @param str analysis_import_path: additional path to import analysis methods from
+    @param str analysis_window_sum_backend: window sum backend of the analysis methods
+    @param bool recursive: also analyse the files in all subdirectories of a directory
+
+    @return (numpy.ndarray, list, dict): combined result table (structured array with the fields
+                                         of RESULT_TABLE_DTYPE, sorted by file), list of the
+                                         results of each file (see
+                                         PulsedBatchAnalyzer.analyse_file) and dict of the files
+                                         that could not be analysed (file path: error message)
+    """
+    log = logging.getLogger(__name__)
+    if isinstance(file_paths, str):
+        file_paths = find_pulsed_raw_data_files(file_paths, recursive=recursive)
+    analyzer_kwargs = {'extraction_settings': extraction_settings,
+                       'analysis_settings': analysis_settings,
+                       'extraction_import_path': extraction_import_path,
+                       'analysis_import_path': analysis_import_path,
+                       'analysis_window_sum_backend': analysis_window_sum_backend}
+
+    results = [None] * len(file_paths)
+    failed = dict()
+    if max_workers == 0 or len(file_paths) < 2:
+        analyzer = PulsedBatchAnalyzer(**analyzer_kwargs)
+        for index, path in enumerate(file_paths):
+            try:
+                results[index] = analyzer.analyse_file(path)
+            except Exception as e:
+                failed[path] = '{0}: {1}'.format(type(e).__name__, e)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_analyse_file_in_worker, path, analyzer_kwargs): index
+                       for index, path in enumerate(file_paths)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    failed[file_paths[index]] = '{0}: {1}'.format(type(e).__name__, e)
+    for path, message in failed.items():
+        log.error('Batch analysis of pulsed raw data file "{0}" failed.\n{1}'.format(path, message))
+
+    results = [result for result in results if result is not None]
+    return combine_batch_results(results), results, failed
+
+
+def combine_batch_results(results):
+    """
+    Combines the results of several files (see PulsedBatchAnalyzer.analyse_file) into a single
+    table with one row per data point.
+
+    @param list results: analysis results of the files
+
+    @return numpy.ndarray: structured array with the fields of RESULT_TABLE_DTYPE
+    """
+    table = np.empty(sum(len(result['signal']) for result in results), dtype=RESULT_TABLE_DTYPE)
+    start = 0
+    for result in results:
+        stop = start + len(result['signal'])
+        for name in table.dtype.names:
+            table[name][start:stop] = result[name]
+        start = stop
+    return table
+
+
+def save_batch_results(table, file_path, delimiter='\t'):
+    """
+    Saves a combined result table (see combine_batch_results) as text file.
+
+    @param numpy.ndarray table: combined result table
+    @param str file_path: path of the text file
+    @param str delimiter: column delimiter
+    """
+    fmt = ['%s'] + ['%.15e'] * (len(table.dtype.names) - 1)
+    np.savetxt(file_path, table, fmt=fmt, delimiter=delimiter,
+               header=delimiter.join(table.dtype.names), comments='#')
+    return
+
+
+def load_pulsed_raw_data(file_path):
+    """
+    Loads the raw data of a saved pulsed measurement together with the settings needed to extract
+    and analyse it.
+
+    @param str file_path: path of a binary pulsed data file (see PulsedDataFile) or of a raw
+                          timetrace text or npz file saved by PulsedMeasurementLogic
+
+    @return (numpy.ndarray, dict): raw data (1D for ungated, 2D for gated counter) and dict with
+                                   the keys "fast_counter_settings", "measurement_settings",
+                                   "sampling_information", "extraction_settings",
+                                   "analysis_settings", "elapsed_sweeps" and "elapsed_time"
+    """
+    if 'raw_timetrace' in os.path.basename(file_path):
+        return _load_raw_timetrace(file_path)
+
+    data = load_pulsed_data(file_path)
+    if 'raw_data' not in data:
+        raise ValueError('No raw data found in pulsed data file "{0}".'.format(file_path))
+    metadata = data['metadata']
+    measurement_settings = dict(metadata.get('measurement_settings', dict()))
+    measurement_settings['controlled_variable'] = np.asarray(
+        measurement_settings.get('controlled_variable', list()), dtype=float)
+    info = dict()
+    info['fast_counter_settings'] = metadata.get('fast_counter_settings', dict())
+    info['measurement_settings'] = measurement_settings
+    info['sampling_information'] = metadata.get('sampling_information', dict())
+    info['extraction_settings'] = metadata.get('extraction_settings', dict())
+    info['analysis_settings'] = metadata.get('analysis_settings', dict())
+    info['elapsed_sweeps'] = _to_float(metadata.get('elapsed_sweeps'))
+    info['elapsed_time'] = _to_float(metadata.get('elapsed_time'))
+    raw_data = data['raw_data']
+    return raw_data.astype(np.result_type(raw_data.dtype, np.int64), copy=False), info
+
+
+def _load_raw_timetrace(file_path):
+    """
+    Loads a raw timetrace saved by PulsedMeasurementLogic.save_measurement_data with SaveLogic.
+    The measurement settings (including the laser ignore indices) are parsed from the file header.
+    Extraction and analysis settings are not saved with these files, so the defaults (or the batch
+    overrides) are used.
+    """
+    if file_path.endswith('.npz'):
+        with np.load(file_path) as file:
+            raw_data = file[file.files[0]]
+        header_path = file_path[:-4] + '_params.dat'
+    else:
+        raw_data = np.loadtxt(file_path, dtype='int64', comments='#')
+        header_path = file_path
+
+    parameters = dict()
+    with open(header_path, 'r') as file:
+        for line in file:
+            if not line.startswith('#'):
+                break
+            key, sep, value = line[1:].strip().partition(': ')
+            if sep:
+                parameters[key] = value
+
+    is_gated = parameters.get('gated counting') == 'True'
+    number_of_lasers = int(parameters.get('Number of laser pulses', 0))
+    # Laser ignore indices are not saved in files of older qudi versions
+    laser_ignore_list = [int(index) for index in re.findall(
+        r'[-+]?\d+', re.sub(r'np\.\w+\(', '', parameters.get('Laser ignore indices', '')))]
+    # Gated raw data is saved with one column per gate
+    if is_gated:
+        raw_data = raw_data.reshape(len(raw_data), -1).transpose()
+    # Strip numpy scalar representations like "np.float64(1.0)"
+    controlled_variable = re.sub(r'np\.\w+\(', '', parameters.get('Controlled variable', ''))
+    controlled_variable = np.array(
+        re.findall(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan|inf', controlled_variable),
+        dtype=float)
+
+    info = dict()
+    info['fast_counter_settings'] = {
+        'bin_width': float(parameters.get('bin width (s)', 1e-9)),
+        'record_length': float(parameters.get('record length (s)', 0)),
+        'number_of_gates': number_of_lasers if is_gated else 0,
+        'is_gated': is_gated}
+    info['measurement_settings'] = {
+        'invoke_settings': False,
+        'controlled_variable': controlled_variable,
+        'number_of_lasers': number_of_lasers,
+        'laser_ignore_list': laser_ignore_list,
+        'alternating': parameters.get('alternating') == 'True',
+        'units': ('s', ''),
+        'labels': ('Tau', 'Signal')}
+    info['sampling_information'] = dict()
+    info['extraction_settings'] = dict()
+    info['analysis_settings'] = dict()
+    info['elapsed_sweeps'] = _to_float(parameters.get('Measurement sweeps'))
+    info['elapsed_time'] = _to_float(parameters.get('Approx. measurement time (s)'))
+    return raw_data, info
+
+
+def _to_float(value):
+    """ Converts a header or metadata value to float (NaN if missing or not a number) """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
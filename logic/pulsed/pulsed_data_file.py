@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi binary file storage (HDF5 or NPZ) for pulsed measurement data.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import json
+import os
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from logic.save_backends import json_default
+
+
+FILE_EXTENSIONS = {'hdf5': '.h5', 'npz': '.npz'}
+
+
+def get_compact_dtype(arr):
+    """
+    Returns the smallest integer data type able to hold all values of an integer array.
+    Non-integer arrays keep their data type.
+
+    @param numpy.ndarray arr: data array
+
+    @return numpy.dtype: data type to store the array with
+    """
+    if arr.dtype.kind not in 'iu' or arr.size == 0:
+        return arr.dtype
+    return np.result_type(np.min_scalar_type(arr.min()), np.min_scalar_type(arr.max()))
+
+
+class PulsedDataFile:
+    """
+    Binary file (HDF5 or NPZ) holding the data arrays of a pulsed measurement (e.g. raw data,
+    laser pulses, signal and error) together with all measurement information as metadata.
+
+    Integer arrays are stored with the smallest sufficient integer data type and compressed.
+    Each call of "save" replaces the stored arrays and metadata and optionally appends a row to the
+    history datasets (e.g. signal and elapsed time of periodic snapshots during a measurement).
+    HDF5 files are updated in place (history datasets are chunked and appended). NPZ files are
+    rewritten completely and atomically replaced, so a crash never leaves a corrupt file behind.
+    """
+
+    def __init__(self, file_path, file_format='hdf5', compression_level=4):
+        """
+        @param str file_path: path of the file. The extension is added if missing.
+        @param str file_format: "hdf5" (needs h5py) or "npz"
+        @param int compression_level: gzip compression level (0-9) for HDF5 files
+        """
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError('Unknown pulsed data file format "{0}". Valid formats are {1}.'
+                             ''.format(file_format, tuple(FILE_EXTENSIONS)))
+        if file_format == 'hdf5' and h5py is None:
+            raise ImportError('Saving pulsed data as HDF5 file requires the package "h5py".')
+        if not file_path.endswith(FILE_EXTENSIONS[file_format]):
+            file_path += FILE_EXTENSIONS[file_format]
+        self.file_path = file_path
+        self.file_format = file_format
+        self.compression_level = compression_level
+        # History rows kept in memory for NPZ files
+        self._history = dict()
+
+    def save(self, arrays, metadata=None, history=None):
+        """
+        Writes data arrays and metadata to the file (replacing previously stored ones).
+
+        @param dict arrays: data arrays to store (name: numpy.ndarray)
+        @param dict metadata: measurement information. Must be JSON serializable apart from numpy
+                              arrays and scalars.
+        @param dict history: optional data to append as a new row to the history datasets
+                             (name: scalar or numpy.ndarray of constant shape)
+        """
+        metadata_str = json.dumps(metadata if metadata is not None else dict(),
+                                  default=json_default)
+        arrays = {name: np.asarray(arr) for name, arr in arrays.items()}
+        if self.file_format == 'hdf5':
+            self._save_hdf5(arrays, metadata_str, history)
+        else:
+            self._save_npz(arrays, metadata_str, history)
+        return
+
+    def _save_hdf5(self, arrays, metadata_str, history):
+        with h5py.File(self.file_path, 'a') as file:
+            file.attrs['metadata'] = metadata_str
+            for name, arr in arrays.items():
+                dtype = get_compact_dtype(arr)
+                if name in file:
+                    dataset = file[name]
+                    # Overwrite in place if possible since HDF5 does not reclaim deleted space
+                    if dataset.shape == arr.shape and np.can_cast(dtype, dataset.dtype):
+                        dataset[...] = arr
+                        continue
+                    del file[name]
+                if arr.ndim == 0 or arr.size == 0:
+                    file.create_dataset(name, data=arr)
+                else:
+                    file.create_dataset(name,
+                                        data=arr.astype(dtype, copy=False),
+                                        compression='gzip',
+                                        compression_opts=self.compression_level,
+                                        shuffle=True)
+            if history:
+                group = file.require_group('history')
+                for name, value in history.items():
+                    value = np.asarray(value)
+                    if name in group and group[name].shape[1:] != value.shape:
+                        # Shape changed, start new history
+                        del group[name]
+                    if name not in group:
+                        group.create_dataset(name,
+                                             shape=(0,) + value.shape,
+                                             maxshape=(None,) + value.shape,
+                                             dtype=value.dtype,
+                                             chunks=True,
+                                             compression='gzip',
+                                             compression_opts=self.compression_level)
+                    dataset = group[name]
+                    dataset.resize(dataset.shape[0] + 1, axis=0)
+                    dataset[-1] = value
+        return
+
+    def _save_npz(self, arrays, metadata_str, history):
+        if history:
+            for name, value in history.items():
+                value = np.asarray(value)
+                rows = self._history.setdefault(name, list())
+                if rows and rows[-1].shape != value.shape:
+                    rows.clear()
+                rows.append(value)
+        data = {name: arr.astype(get_compact_dtype(arr), copy=False)
+                for name, arr in arrays.items()}
+        data.update({'history/' + name: np.array(rows) for name, rows in self._history.items()})
+        data['metadata'] = np.array(metadata_str)
+        # Write to temporary file first and replace afterwards to never leave a corrupt file
+        tmp_path = self.file_path[:-4] + '.tmp.npz'
+        np.savez_compressed(tmp_path, **data)
+        os.replace(tmp_path, self.file_path)
+        return
+
+
+def load_pulsed_data(file_path):
+    """
+    Loads a pulsed data file written by PulsedDataFile.
+
+    @param str file_path: path of the HDF5 (.h5) or NPZ (.npz) file
+
+    @return dict: data arrays (name: numpy.ndarray) with additional keys "metadata" (dict) and
+                  "history" (dict of arrays with one row per appended history entry)
+    """
+    data = dict()
+    history = dict()
+    if file_path.endswith(FILE_EXTENSIONS['npz']):
+        with np.load(file_path) as file:
+            for name in file.files:
+                if name == 'metadata':
+                    data['metadata'] = json.loads(str(file[name]))
+                elif name.startswith('history/'):
+                    history[name[8:]] = file[name]
+                else:
+                    data[name] = file[name]
+    else:
+        if h5py is None:
+            raise ImportError('Loading pulsed data from HDF5 file requires the package "h5py".')
+        with h5py.File(file_path, 'r') as file:
+            data['metadata'] = json.loads(file.attrs.get('metadata', '{}'))
+            for name, item in file.items():
+                if name == 'history':
+                    history = {key: dataset[()] for key, dataset in item.items()}
+                else:
+                    data[name] = item[()]
+    data.setdefault('metadata', dict())
+    data['history'] = history
+    return data
@@ -23,6 +23,7 @@ from qtpy import QtCore
 from collections import OrderedDict
 import numpy as np
 import copy
+import os
 import time
 import datetime
 import matplotlib.pyplot as plt
@@ -37,6 +38,9 @@ from core.util.math import compute_ft
 from logic.generic_logic import GenericLogic
 from logic.pulsed.pulse_extractor import PulseExtractor
 from logic.pulsed.pulse_analyzer import PulseAnalyzer
+from logic.pulsed.pulsed_analysis_worker import PulsedAnalysisWorker
+from logic.pulsed.pulsed_data_file import PulsedDataFile, load_pulsed_data, h5py
+from logic.pulsed.raw_data_stash import RawDataStash, add_raw_data
 import pulsestreamer as ps
 
 class PulsedMeasurementLogic(GenericLogic):
@@ -55,8 +59,32 @@ class PulsedMeasurementLogic(GenericLogic):
     # Optional additional paths to import from
     extraction_import_path = ConfigOption(name='additional_extraction_path', default=None)
     analysis_import_path = ConfigOption(name='additional_analysis_path', default=None)
+    # Window sum backend used by analysis methods ('auto', 'cumsum' or 'direct')
+    analysis_window_sum_backend = ConfigOption(name='analysis_window_sum_backend',
+                                               default='auto',
+                                               missing='nothing')
     # Optional file type descriptor for saving raw data to file
     _raw_data_save_type = ConfigOption(name='raw_data_save_type', default='text')
+    # Only extract the counts acquired since the last analysis and add them to the accumulated
+    # raw data and laser pulses. Only used with fast counters returning differential data and
+    # extraction methods with fixed laser windows (otherwise the complete trace is extracted).
+    _incremental_accumulation = ConfigOption(name='incremental_accumulation',
+                                             default=False,
+                                             missing='nothing')
+    # Poll the fast counter and analyse the data in background threads instead of a QTimer in
+    # the logic thread. Frames waiting for analysis beyond analysis_queue_size are dropped.
+    _use_analysis_worker = ConfigOption(name='use_analysis_worker', default=False, missing='nothing')
+    _analysis_queue_size = ConfigOption(name='analysis_queue_size', default=1, missing='nothing')
+    # Optional binary file format ('hdf5' or 'npz') to save all measurement data into a single file
+    # instead of text files for laser pulses and raw data
+    _binary_save_format = ConfigOption(name='binary_save_format', default=None, missing='nothing')
+    # Interval in s for binary snapshots of the running measurement (0 to disable)
+    _snapshot_interval = ConfigOption(name='snapshot_interval', default=0, missing='nothing')
+    # Maximum memory in bytes for stashed raw data. Least recently used stashes exceeding it are
+    # moved to memory mapped files in the data directory (None for unlimited memory).
+    _raw_data_stash_memory = ConfigOption(name='raw_data_stash_memory',
+                                          default=None,
+                                          missing='nothing')
 
     # status variables
     # ext. microwave settings
@@ -125,6 +153,8 @@ class PulsedMeasurementLogic(GenericLogic):
 
         # timer for measurement
         self.__analysis_timer = None
+        # background worker for measurement (replaces timer if used)
+        self._analysis_worker = None
         self.__start_time = 0
         self.__elapsed_time = 0
         self.__elapsed_sweeps = 0
@@ -137,11 +167,22 @@ class PulsedMeasurementLogic(GenericLogic):
         self.signal_alt_data = np.empty((2, 0), dtype=float)
         self.measurement_error = np.empty((2, 0), dtype=float)
         self.laser_data = np.zeros((10, 20), dtype='int64')
+        # signal data and settings the current signal_alt_data has been computed from
+        self._alt_data_source = None
         self.raw_data = np.zeros((10, 20), dtype='int64')
 
-        self._saved_raw_data = OrderedDict()  # temporary saved raw data
+        self._saved_raw_data = RawDataStash()  # temporary saved raw data
         self._recalled_raw_data_tag = None  # the currently recalled raw data dict key
 
+        # binary snapshots of the running measurement
+        self._snapshot_file = None
+        self._last_snapshot_time = 0
+        self._snapshot_lock = Mutex()  # serializes writing of snapshot files
+
+        # incremental accumulation state
+        self._accumulation_started = False  # raw_data holds accumulated counts of this measurement
+        self._laser_data_accumulated = False  # laser_data holds accumulated laser pulses
+
         # Paused measurement flag
         self.__is_paused = False
         self._time_of_pause = None
@@ -170,6 +211,12 @@ class PulsedMeasurementLogic(GenericLogic):
         self.__analysis_timer.setInterval(round(1000. * self.__timer_interval))
         self.__analysis_timer.timeout.connect(self._pulsed_analysis_loop,
                                               QtCore.Qt.QueuedConnection)
+        if self._use_analysis_worker:
+            self._analysis_worker = PulsedAnalysisWorker(acquire=self._get_fast_counter_data,
+                                                         process=self._pulsed_analysis_loop,
+                                                         interval=self.__timer_interval,
+                                                         queue_size=self._analysis_queue_size,
+                                                         log=self.log)
 
         # Fitting
         self.fc = self.fitlogic().make_fit_container('pulsed', '1d')
@@ -209,10 +256,24 @@ class PulsedMeasurementLogic(GenericLogic):
 
         # recalled saved raw data dict key
         self._recalled_raw_data_tag = None
+        # memory budget of stashed raw data
+        self._saved_raw_data.memory_budget = self._raw_data_stash_memory
+        self._saved_raw_data.spill_dir = os.path.join(
+            self.savelogic().get_path_for_module('PulsedMeasurement'), 'raw_data_stash')
+
+        # Check binary file format
+        if self._binary_save_format not in (None, 'hdf5', 'npz'):
+            self.log.error('Unknown binary_save_format "{0}". Valid formats are "hdf5" and "npz". '
+                           'Saving text files instead.'.format(self._binary_save_format))
+            self._binary_save_format = None
+        elif self._binary_save_format == 'hdf5' and h5py is None:
+            self.log.warning('Package "h5py" not found. Saving pulsed data as npz file instead of '
+                             'hdf5.')
+            self._binary_save_format = 'npz'
 
         # Connect internal signals
-        self.sigStartTimer.connect(self.__analysis_timer.start, QtCore.Qt.QueuedConnection)
-        self.sigStopTimer.connect(self.__analysis_timer.stop, QtCore.Qt.QueuedConnection)
+        self.sigStartTimer.connect(self._start_analysis_timer, QtCore.Qt.QueuedConnection)
+        self.sigStopTimer.connect(self._stop_analysis_timer, QtCore.Qt.QueuedConnection)
         self.sigStartSequence.connect(self.do_camera_seq_loop, QtCore.Qt.QueuedConnection)
         return
 
@@ -229,6 +290,12 @@ class PulsedMeasurementLogic(GenericLogic):
         self.extraction_parameters = self._pulseextractor.full_settings_dict
         self.analysis_parameters = self._pulseanalyzer.full_settings_dict
 
+        # Stashed raw data is not kept after deactivation. Removes spill files.
+        self._saved_raw_data.clear()
+
+        if self._analysis_worker is not None:
+            self._analysis_worker.stop()
+            self._analysis_worker = None
         self.__analysis_timer.timeout.disconnect()
         self.sigStartTimer.disconnect()
         self.sigStopTimer.disconnect()
@@ -659,6 +726,19 @@ class PulsedMeasurementLogic(GenericLogic):
             self.sigAnalysisSettingsUpdated.emit(self.analysis_settings)
         return
 
+    def scan_analysis_settings(self, settings_list):
+        """
+        Analyses the current laser data with several analysis settings without changing the current
+        analysis settings, e.g. to scan the signal and normalization windows.
+
+        @param list settings_list: list of analysis settings dicts. Parameters missing in a dict are
+                                   taken from the current settings.
+
+        @return list: list of (signal data, error data) tuples, one for each settings dict
+        """
+        with self._threadlock:
+            return self._pulseanalyzer.scan_analysis_settings(self.laser_data, settings_list)
+
     @QtCore.Slot(dict)
     def set_extraction_settings(self, settings_dict=None, **kwargs):
         """
@@ -785,6 +865,16 @@ class PulsedMeasurementLogic(GenericLogic):
 
                 # initialize data arrays
                 self._initialize_data_arrays()
+                # laser flank positions etc. cached by the extraction methods are outdated
+                self._pulseextractor.clear_extraction_cache()
+                # new snapshot file for this measurement
+                with self._snapshot_lock:
+                    self._snapshot_file = None
+                self._last_snapshot_time = time.time()
+                # reset incremental accumulation
+                self._accumulation_started = False
+                self._laser_data_accumulated = False
+                self._pulseanalyzer.stop_running_window_sums()
 
                 # recall stashed raw data
                 if stashed_raw_data_tag in self._saved_raw_data:
@@ -811,6 +901,8 @@ class PulsedMeasurementLogic(GenericLogic):
 
                 # Set starting time and start timer (if present)
                 self.__start_time = time.time()
+                if self._analysis_worker is not None:
+                    self._analysis_worker.reset_statistics()
                 self.sigStartTimer.emit()
 
                 # Set measurement paused flag
@@ -843,11 +935,15 @@ class PulsedMeasurementLogic(GenericLogic):
         """
         # Get raw data and analyze it a last time just before stopping the measurement.
         self._stop_requested = True
+        # Let the background worker finish the analysis of already acquired data
+        if self._analysis_worker is not None:
+            self._analysis_worker.stop()
         try:
             self._pulsed_analysis_loop()
         except:
             self.log.debug('Pulsed analysis loop failed')
 
+        final_snapshot = None
         with self._threadlock:
             if self.module_state() == 'locked':
                 # stopping the timer
@@ -862,6 +958,10 @@ class PulsedMeasurementLogic(GenericLogic):
                 if self.__use_ext_microwave:
                     self.microwave_off()
 
+                # final snapshot (written after releasing the lock)
+                if self._snapshot_file is not None:
+                    final_snapshot = self._collect_snapshot()
+
                 # stash raw data if requested
                 if stash_raw_data_tag:
                     self._saved_raw_data[stash_raw_data_tag] = (self.raw_data.copy(),
@@ -874,6 +974,9 @@ class PulsedMeasurementLogic(GenericLogic):
 
                 self.module_state.unlock()
                 self.sigMeasurementStatusUpdated.emit(False, False)
+
+        if final_snapshot is not None:
+            self._write_snapshot(*final_snapshot, close=True)
         return
 
     @QtCore.Slot(bool)
@@ -894,10 +997,15 @@ class PulsedMeasurementLogic(GenericLogic):
         """
         Pauses the measurement
         """
+        # Stop the background worker before touching the hardware. It has to be stopped outside of
+        # the lock since it waits for the analysis of already acquired data.
+        if self._analysis_worker is not None:
+            self._analysis_worker.stop()
+
         with self._threadlock:
             if self.module_state() == 'locked':
                 # pausing the timer
-                if self.__analysis_timer.isActive():
+                if self._is_analysis_timer_active():
                     # stopping the timer
                     self.sigStopTimer.emit()
 
@@ -929,7 +1037,7 @@ class PulsedMeasurementLogic(GenericLogic):
                 # self.fast_counter_continue()
                 
                 # un-pausing the timer
-                if not self.__analysis_timer.isActive():
+                if not self._is_analysis_timer_active():
                     self.sigStartTimer.emit()
 
                 # Set measurement paused flag
@@ -956,6 +1064,8 @@ class PulsedMeasurementLogic(GenericLogic):
             self.__timer_interval = interval
             if self.__timer_interval > 0:
                 self.__analysis_timer.setInterval(int(1000. * self.__timer_interval))
+                if self._analysis_worker is not None:
+                    self._analysis_worker.interval = self.__timer_interval
                 if self.module_state() == 'locked' and not self.__is_paused:
                     self.sigStartTimer.emit()
             else:
@@ -965,6 +1075,38 @@ class PulsedMeasurementLogic(GenericLogic):
                                       self.__timer_interval)
         return
 
+    @property
+    def analysis_worker_statistics(self):
+        """
+        Latency statistics of the background analysis worker (see PulsedAnalysisWorker.statistics).
+
+        @return dict: statistics (empty if the background worker is not used)
+        """
+        if self._analysis_worker is None:
+            return dict()
+        return self._analysis_worker.statistics
+
+    @QtCore.Slot()
+    def _start_analysis_timer(self):
+        if self._analysis_worker is not None:
+            self._analysis_worker.start()
+        else:
+            self.__analysis_timer.start()
+        return
+
+    @QtCore.Slot()
+    def _stop_analysis_timer(self):
+        if self._analysis_worker is not None:
+            self._analysis_worker.stop()
+        else:
+            self.__analysis_timer.stop()
+        return
+
+    def _is_analysis_timer_active(self):
+        if self._analysis_worker is not None:
+            return self._analysis_worker.is_running
+        return self.__analysis_timer.isActive()
+
     @QtCore.Slot(str)
     def set_alternative_data_type(self, alt_data_type):
         """
@@ -1127,15 +1269,22 @@ class PulsedMeasurementLogic(GenericLogic):
                                                                         self.__fast_counter_gates))
         return
 
-    def _pulsed_analysis_loop(self):
+    def _pulsed_analysis_loop(self, fc_frame=None):
         """ Acquires laser pulses from fast counter,
             calculates fluorescence signal and creates plots.
+
+        @param tuple fc_frame: optional fast counter data already acquired by the background worker
+                               (see _get_fast_counter_data). Polled from the fast counter if None.
         """
+        snapshot = None
         with self._threadlock:
             if self.module_state() == 'locked':
                 # Update elapsed time
 
-                self._extract_laser_pulses()
+                if self._incremental_accumulation:
+                    self._accumulate_laser_pulses(fc_frame)
+                else:
+                    self._extract_laser_pulses(fc_frame)
 
                 tmp_signal, tmp_error = self._analyze_laser_pulses()
 
@@ -1171,28 +1320,117 @@ class PulsedMeasurementLogic(GenericLogic):
                 # Compute alternative data array from signal
                 self._compute_alt_data()
 
+                # Collect binary snapshot of the measurement if due
+                if 0 < self._snapshot_interval <= time.time() - self._last_snapshot_time:
+                    snapshot = self._collect_snapshot()
+
             # emit signals
             self.sigTimerUpdated.emit(self.__elapsed_time, self.__elapsed_sweeps,
                                       self.__timer_interval)
             self.sigMeasurementDataUpdated.emit()
-            return
 
-    def _extract_laser_pulses(self):
+        # Write the snapshot outside of the lock to not block the measurement control
+        if snapshot is not None:
+            self._write_snapshot(*snapshot)
+        return
+
+    def _extract_laser_pulses(self, fc_frame=None):
         # Get counter raw data (including recalled raw data from previous measurement)
-        fc_data, info_dict = self._get_raw_data()
+        fc_data, info_dict = self._get_raw_data(fc_frame)
         self.raw_data = fc_data
         self.__elapsed_sweeps = info_dict['elapsed_sweeps']
         self.__elapsed_time = info_dict['elapsed_time']
 
         # extract laser pulses from raw data
         return_dict = self._pulseextractor.extract_laser_pulses(self.raw_data)
-        self.laser_data = return_dict['laser_counts_arr']
+        laser_data = return_dict['laser_counts_arr']
+        # Extraction methods may return views of the raw data (e.g. gated_conv_deriv). Publish a
+        # copy in that case since readers of laser_data (GUI, saving) must not see it change.
+        if np.may_share_memory(laser_data, self.raw_data):
+            laser_data = np.array(laser_data, copy=True)
+        self.laser_data = laser_data
+        self._pulseanalyzer.stop_running_window_sums()
+        return
+
+    def _accumulate_laser_pulses(self, fc_frame=None):
+        """
+        Incremental counterpart of _extract_laser_pulses for fast counters returning differential
+        data (only the counts acquired since the last call, see "is_differential" in
+        _get_fast_counter_data).
+        The counts are added in place to the accumulated raw data. Recalled raw data is added once
+        at the first call. The laser pulses of the counts are only extracted and added to the
+        accumulated laser pulses if the last extraction reported fixed laser windows (e.g. pass
+        through or cached flank positions). Otherwise the laser pulses are extracted from the
+        complete accumulated raw data.
+        The window sums of the analysis (e.g. signal and normalization window of each laser pulse)
+        are accumulated the same way (see PulseAnalyzer.add_laser_increment), so the analysis of
+        the accumulated laser pulses does not need to sum over all of them again.
+        For fast counters returning the complete trace the laser pulses are always extracted from
+        the complete trace (see _extract_laser_pulses).
+
+        @param tuple fc_frame: optional fast counter data (see _get_fast_counter_data)
+        """
+        fc_data, info_dict = self._get_fast_counter_data() if fc_frame is None else fc_frame
+        if not info_dict['is_differential']:
+            self._extract_laser_pulses((fc_data, info_dict))
+            return
+
+        # Add recalled raw data from previous measurements (only once)
+        recalled = self._saved_raw_data.get(self._recalled_raw_data_tag)
+        if recalled is not None:
+            info_dict['elapsed_sweeps'] += recalled[1]['elapsed_sweeps']
+            info_dict['elapsed_time'] += recalled[1]['elapsed_time']
+        self.__elapsed_sweeps = info_dict['elapsed_sweeps']
+        self.__elapsed_time = info_dict['elapsed_time']
+
+        if not self._accumulation_started:
+            self.raw_data = fc_data.astype(np.result_type(fc_data.dtype, np.int64))
+            if recalled is not None:
+                if recalled[0].shape == self.raw_data.shape:
+                    self.raw_data += recalled[0]
+                else:
+                    self.log.warning('Recalled raw data has not the same shape as current data.'
+                                     '\nDid NOT add recalled raw data to current time trace.')
+            self._accumulation_started = True
+            self._laser_data_accumulated = False
+        elif fc_data.shape != self.raw_data.shape:
+            self.log.warning('Shape of fast counter data changed during measurement.\n'
+                             'Restarting incremental accumulation.')
+            self._accumulation_started = False
+            self._accumulate_laser_pulses((fc_data, info_dict))
+            return
+        elif fc_data.any():
+            self.raw_data += fc_data
+        else:
+            return
+
+        if self._laser_data_accumulated:
+            return_dict = self._pulseextractor.extract_laser_pulses(fc_data)
+            laser_increment = return_dict['laser_counts_arr']
+            if return_dict.get('fixed_laser_windows', False) and \
+                    laser_increment.shape == self.laser_data.shape:
+                # Publish a new array since laser_data may be read from other threads
+                laser_data = self.laser_data + laser_increment
+                self._pulseanalyzer.add_laser_increment(laser_increment, laser_data)
+                self.laser_data = laser_data
+                return
+
+        return_dict = self._pulseextractor.extract_laser_pulses(self.raw_data)
+        laser_data = return_dict['laser_counts_arr']
+        # Copy since extraction methods may return views of the raw data
+        self.laser_data = laser_data.astype(np.result_type(laser_data.dtype, self.raw_data.dtype))
+        self._laser_data_accumulated = bool(return_dict.get('fixed_laser_windows', False)
+                                            and self.laser_data.any())
+        if self._laser_data_accumulated:
+            self._pulseanalyzer.start_running_window_sums(self.laser_data)
+        else:
+            self._pulseanalyzer.stop_running_window_sums()
         return
 
     def _analyze_laser_pulses(self):
         # analyze pulses and get data points for signal array. Also check if extraction
-        # worked (non-zero array returned).
-        if self.laser_data.any():
+        # worked (non-zero array returned). Accumulated laser pulses are known to be non-zero.
+        if self._laser_data_accumulated or self.laser_data.any():
             tmp_signal, tmp_error = self._pulseanalyzer.analyse_laser_pulses(
                 self.laser_data)
             # print('Analyzed data: ', tmp_signal)
@@ -1202,53 +1440,76 @@ class PulsedMeasurementLogic(GenericLogic):
             print('laser data any failed - pulse extraction failed')
         return tmp_signal, tmp_error
 
-    def _get_raw_data(self):
+    def _get_raw_data(self, fc_frame=None):
         """
         Get the raw count data from the fast counting hardware and perform sanity checks.
         Also add recalled raw data to the newly received data.
+
+        @param tuple fc_frame: optional fast counter data (see _get_fast_counter_data) to use
+                               instead of polling the fast counter
         @return tuple(numpy.ndarray, info_dict): The count data (1D for ungated, 2D for gated counter) and
                                                  info_dict with keys 'elapsed_sweeps' and 'elapsed_time'
         """
         # get raw data from fast counter
-        fc_data = self.fastcounter().get_data_trace()
-        if type(fc_data) == tuple and len(fc_data) == 2:  # if the hardware implement the new version of the interface
-            fc_data, info_dict = fc_data
-        else:
-            info_dict = {'elapsed_sweeps': None, 'elapsed_time': None}
-        fc_data = netobtain(fc_data)
-
-        if isinstance(info_dict, dict) and info_dict.get('elapsed_sweeps') is not None:
-            elapsed_sweeps = info_dict['elapsed_sweeps']
-        else:
-            elapsed_sweeps = -1
-
-        if isinstance(info_dict, dict) and info_dict.get('elapsed_time') is not None:
-            elapsed_time = info_dict['elapsed_time']
-        else:
-            elapsed_time = time.time() - self.__start_time
+        fc_data, info_dict = self._get_fast_counter_data() if fc_frame is None else fc_frame
+        elapsed_sweeps = info_dict['elapsed_sweeps']
+        elapsed_time = info_dict['elapsed_time']
 
         # add old raw data from previous measurements if necessary
-        if self._saved_raw_data.get(self._recalled_raw_data_tag) is not None:
+        recalled = self._saved_raw_data.get(self._recalled_raw_data_tag)
+        if recalled is not None:
             # self.log.info('Found old saved raw data with tag "{0}".'
             #               ''.format(self._recalled_raw_data_tag))
-            elapsed_sweeps += self._saved_raw_data[self._recalled_raw_data_tag][1]['elapsed_sweeps']
-            elapsed_time += self._saved_raw_data[self._recalled_raw_data_tag][1]['elapsed_time']
+            elapsed_sweeps += recalled[1]['elapsed_sweeps']
+            elapsed_time += recalled[1]['elapsed_time']
             if not fc_data.any():
                 self.log.warning('Only zeros received from fast counter!\n'
                                  'Using recalled raw data only.')
-                fc_data = self._saved_raw_data[self._recalled_raw_data_tag][0]
-            elif self._saved_raw_data[self._recalled_raw_data_tag][0].shape == fc_data.shape:
+                fc_data = recalled[0]
+            elif recalled[0].shape == fc_data.shape:
                 self.log.debug('Recalled raw data has the same shape as current data.')
-                fc_data = self._saved_raw_data[self._recalled_raw_data_tag][0] + fc_data
+                # add chunk-wise (recalled raw data can be memory mapped)
+                fc_data = add_raw_data(fc_data, recalled[0])
             else:
                 self.log.warning('Recalled raw data has not the same shape as current data.'
                                  '\nDid NOT add recalled raw data to current time trace.')
         elif not fc_data.any():
+            # fc_data only contains zeros already, so it is used as it is (native dtype, no copy)
             self.log.warning('Only zeros received from fast counter!')
-            fc_data = np.zeros(fc_data.shape, dtype='int64')
 
         return fc_data, {'elapsed_sweeps': elapsed_sweeps, 'elapsed_time': elapsed_time}
 
+    def _get_fast_counter_data(self):
+        """
+        Get the count data from the fast counting hardware.
+
+        @return tuple(numpy.ndarray, info_dict): The count data (1D for ungated, 2D for gated counter)
+                                                 and info_dict with keys 'elapsed_sweeps',
+                                                 'elapsed_time' and 'is_differential'
+        """
+        fc_data = self.fastcounter().get_data_trace()
+        if type(fc_data) == tuple and len(fc_data) == 2:  # if the hardware implement the new version of the interface
+            fc_data, info_dict = fc_data
+        else:
+            info_dict = {'elapsed_sweeps': None, 'elapsed_time': None}
+        fc_data = netobtain(fc_data)
+        if not isinstance(info_dict, dict):
+            info_dict = dict()
+
+        if info_dict.get('elapsed_sweeps') is not None:
+            elapsed_sweeps = info_dict['elapsed_sweeps']
+        else:
+            elapsed_sweeps = -1
+
+        if info_dict.get('elapsed_time') is not None:
+            elapsed_time = info_dict['elapsed_time']
+        else:
+            elapsed_time = time.time() - self.__start_time
+
+        return fc_data, {'elapsed_sweeps': elapsed_sweeps,
+                         'elapsed_time': elapsed_time,
+                         'is_differential': bool(info_dict.get('is_differential', False))}
+
     def _initialize_data_arrays(self):
         """
         Initializing the signal, error, laser and raw data arrays.
@@ -1261,6 +1522,7 @@ class PulsedMeasurementLogic(GenericLogic):
 
         self.signal_alt_data = np.zeros((signal_dim, len(self._controlled_variable)), dtype=float)
         self.signal_alt_data[0] = self._controlled_variable
+        self._alt_data_source = None
 
         self.measurement_error = np.zeros((signal_dim, len(self._controlled_variable)), dtype=float)
         self.measurement_error[0] = self._controlled_variable
@@ -1297,10 +1559,21 @@ class PulsedMeasurementLogic(GenericLogic):
         filepath = self.savelogic().get_path_for_module('PulsedMeasurement')
         timestamp = datetime.datetime.now()
 
+        #####################################################################
+        ####     Save all data to a single binary file (if configured)   ####
+        #####################################################################
+        if self._binary_save_format:
+            filelabel = 'pulsed_data' if not tag else tag + '_pulsed_data'
+            filename = timestamp.strftime('%Y%m%d-%H%M-%S') + '_' + filelabel
+            data_file = PulsedDataFile(os.path.join(filepath, filename),
+                                       file_format=self._binary_save_format)
+            data_file.save(self._get_binary_data_arrays(with_laser_pulses=save_laser_pulses),
+                           metadata=self._get_binary_metadata(timestamp))
+
         #####################################################################
         ####                Save extracted laser pulses                  ####
         #####################################################################
-        if save_laser_pulses:
+        if save_laser_pulses and not self._binary_save_format:
             if tag:
                 filelabel = tag + '_laser_pulses'
             else:
@@ -1599,6 +1872,9 @@ class PulsedMeasurementLogic(GenericLogic):
         #####################################################################
         ####                Save raw data timetrace                      ####
         #####################################################################
+        if self._binary_save_format:
+            # raw data already contained in binary file
+            return filepath
         filelabel = 'raw_timetrace' if not tag else tag + '_raw_timetrace'
 
         # prepare the data in a dict or in an OrderedDict:
@@ -1611,6 +1887,7 @@ class PulsedMeasurementLogic(GenericLogic):
         parameters['record length (s)'] = self.__fast_counter_record_length
         parameters['gated counting'] = self.fast_counter_settings['is_gated']
         parameters['Number of laser pulses'] = self._number_of_lasers
+        parameters['Laser ignore indices'] = list(self._laser_ignore_list)
         parameters['alternating'] = self._alternating
         parameters['Controlled variable'] = list(self.signal_data[0])
         parameters['Approx. measurement time (s)'] = self.__elapsed_time
@@ -1623,31 +1900,151 @@ class PulsedMeasurementLogic(GenericLogic):
                                    delimiter='\t')
         return filepath
 
+    def _get_binary_data_arrays(self, with_laser_pulses=True):
+        """
+        Collects all measurement data arrays to save in a binary file (see PulsedDataFile).
+
+        @param bool with_laser_pulses: include the extracted laser pulses
+
+        @return dict: data arrays
+        """
+        arrays = OrderedDict()
+        arrays['raw_data'] = self.raw_data
+        if with_laser_pulses:
+            arrays['laser_data'] = self.laser_data
+        arrays['signal_data'] = self.signal_data
+        arrays['measurement_error'] = self.measurement_error
+        arrays['signal_alt_data'] = self.signal_alt_data
+        return arrays
+
+    def _get_binary_metadata(self, timestamp):
+        """
+        Collects all measurement information to save in a binary file (see PulsedDataFile).
+
+        @param datetime.datetime timestamp: time of saving
+
+        @return dict: measurement information
+        """
+        metadata = OrderedDict()
+        metadata['timestamp'] = timestamp.isoformat()
+        metadata['elapsed_time'] = self.__elapsed_time
+        metadata['elapsed_sweeps'] = self.__elapsed_sweeps
+        metadata['bin_width'] = self.__fast_counter_binwidth
+        metadata['record_length'] = self.__fast_counter_record_length
+        metadata['alternative_data_type'] = self._alternative_data_type
+        metadata['measurement_settings'] = self.measurement_settings
+        metadata['fast_counter_settings'] = self.fast_counter_settings
+        metadata['ext_microwave_settings'] = self.ext_microwave_settings
+        metadata['extraction_settings'] = self.extraction_settings
+        metadata['analysis_settings'] = self.analysis_settings
+        metadata['measurement_information'] = self._measurement_information
+        metadata['sampling_information'] = self.sampling_information
+        return metadata
+
+    def _collect_snapshot(self):
+        """
+        Collects copies of the current measurement data for a binary snapshot (see
+        _write_snapshot). Must be called while holding the threadlock.
+
+        @return tuple: data arrays, metadata and history row of the snapshot
+        """
+        self._last_snapshot_time = time.time()
+        timestamp = datetime.datetime.now()
+        # Copy since the data arrays are modified in place during the measurement
+        arrays = OrderedDict((name, np.array(arr, copy=True))
+                             for name, arr in self._get_binary_data_arrays().items())
+        history = OrderedDict()
+        history['elapsed_time'] = self.__elapsed_time
+        history['elapsed_sweeps'] = self.__elapsed_sweeps
+        history['signal_data'] = arrays['signal_data'][1:]
+        history['measurement_error'] = arrays['measurement_error'][1:]
+        return arrays, self._get_binary_metadata(timestamp), history, timestamp
+
+    def _write_snapshot(self, arrays, metadata, history, timestamp, close=False):
+        """
+        Saves a binary snapshot of the running measurement. The snapshot file of a measurement holds
+        the current data arrays and appends the signal of each snapshot to its history, so a crash
+        does not lose the accumulated data (see stash_raw_data_from_file).
+        Does not need the threadlock since compressing the data can take a while.
+
+        @param dict arrays: data arrays (see _collect_snapshot)
+        @param dict metadata: measurement information
+        @param dict history: history row to append
+        @param datetime.datetime timestamp: time of the snapshot
+        @param bool close: start a new snapshot file with the next snapshot (end of measurement)
+        """
+        with self._snapshot_lock:
+            try:
+                if self._snapshot_file is None:
+                    filepath = self.savelogic().get_path_for_module('PulsedMeasurement')
+                    filename = timestamp.strftime('%Y%m%d-%H%M-%S') + '_pulsed_snapshot'
+                    self._snapshot_file = PulsedDataFile(
+                        os.path.join(filepath, filename),
+                        file_format=self._binary_save_format if self._binary_save_format else 'npz')
+                self._snapshot_file.save(arrays, metadata=metadata, history=history)
+            except Exception:
+                self.log.exception('Saving snapshot of pulsed measurement failed.')
+            if close:
+                self._snapshot_file = None
+        return
+
+    def stash_raw_data_from_file(self, file_path, tag):
+        """
+        Loads the raw data of a binary pulsed data file or snapshot (see PulsedDataFile) into the
+        raw data stash. Starting a measurement with this stash tag continues the accumulation.
+
+        @param str file_path: path of the HDF5 or NPZ file
+        @param str tag: stash tag for the loaded raw data
+
+        @return bool: success of loading the raw data
+        """
+        try:
+            data = load_pulsed_data(file_path)
+        except Exception:
+            self.log.exception('Loading pulsed data file "{0}" failed.'.format(file_path))
+            return False
+        if 'raw_data' not in data:
+            self.log.error('No raw data found in pulsed data file "{0}".'.format(file_path))
+            return False
+        metadata = data['metadata']
+        elapsed_sweeps = metadata.get('elapsed_sweeps')
+        elapsed_time = metadata.get('elapsed_time')
+        with self._threadlock:
+            self._saved_raw_data[tag] = (
+                data['raw_data'].astype(np.result_type(data['raw_data'].dtype, np.int64)),
+                {'elapsed_sweeps': elapsed_sweeps if elapsed_sweeps is not None else 0,
+                 'elapsed_time': elapsed_time if elapsed_time is not None else 0})
+        return True
+
     def _compute_alt_data(self):
         """
         Performing transformations on the measurement data (e.g. fourier transform).
+        The transformation is skipped if neither the signal data nor the settings changed since the
+        last computation.
         """
+        settings = (self._alternative_data_type, self.zeropad, self.window, self.base_corr,
+                    self.psd)
+        source = self._alt_data_source
+        if source is not None and source[0] == settings and \
+                np.array_equal(source[1], self.signal_data):
+            return
+        self._alt_data_source = (settings, self.signal_data.copy())
+
         if self._alternative_data_type == 'Delta' and len(self.signal_data) == 3:
             self.signal_alt_data = np.empty((2, self.signal_data.shape[1]), dtype=float)
             self.signal_alt_data[0] = self.signal_data[0]
             self.signal_alt_data[1] = self.signal_data[1] - self.signal_data[2]
         elif self._alternative_data_type == 'FFT' and self.signal_data.shape[1] >= 2:
+            # transform all signal rows at once
             fft_x, fft_y = compute_ft(x_val=self.signal_data[0],
-                                      y_val=self.signal_data[1],
+                                      y_val=self.signal_data[1:],
                                       zeropad_num=self.zeropad,
                                       window=self.window,
                                       base_corr=self.base_corr,
                                       psd=self.psd)
             self.signal_alt_data = np.empty((len(self.signal_data), len(fft_x)), dtype=float)
             self.signal_alt_data[0] = fft_x
-            self.signal_alt_data[1] = fft_y
-            for dim in range(2, len(self.signal_data)):
-                dummy, self.signal_alt_data[dim] = compute_ft(x_val=self.signal_data[0],
-                                                              y_val=self.signal_data[dim],
-                                                              zeropad_num=self.zeropad,
-                                                              window=self.window,
-                                                              base_corr=self.base_corr,
-                                                              psd=self.psd)
+            self.signal_alt_data[1:] = fft_y
         else:
             self.signal_alt_data = np.zeros(self.signal_data.shape, dtype=float)
             self.signal_alt_data[0] = self.signal_data[0]
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi store for stashed raw data of pulsed measurements.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import uuid
+import numpy as np
+from collections import OrderedDict
+
+
+def add_raw_data(count_data, stashed_data, chunk_size=2**22):
+    """
+    Adds stashed raw data to count data chunk by chunk. Memory mapped stashed data is thereby read
+    chunk-wise and no temporary full size arrays are created besides the returned sum.
+    The input arrays are not altered.
+
+    @param numpy.ndarray count_data: count data from the fast counter
+    @param numpy.ndarray stashed_data: stashed raw data of the same shape (can be memory mapped)
+    @param int chunk_size: number of elements to add at once
+
+    @return numpy.ndarray: sum of both arrays
+    """
+    result = np.empty(count_data.shape, dtype=np.result_type(count_data.dtype, stashed_data.dtype))
+    result_flat = result.reshape(-1)
+    count_flat = np.ravel(count_data)
+    stashed_flat = np.ravel(stashed_data)
+    for start in range(0, result_flat.size, chunk_size):
+        stop = start + chunk_size
+        np.add(count_flat[start:stop], stashed_flat[start:stop], out=result_flat[start:stop])
+    return result
+
+
+class RawDataStash:
+    """
+    Dictionary-like store for stashed raw data of pulsed measurements mapping a tag to a tuple
+    (numpy.ndarray raw data, dict info).
+
+    Raw data arrays are kept in memory up to the given memory budget (in bytes). If the budget is
+    exceeded the least recently used arrays are spilled to .npy files in the spill directory and
+    replaced by read-only memory maps, so recalling a spilled stash is transparent.
+    Spill files are deleted when the stash entry is removed or replaced and upon clear().
+    """
+    _chunk_size = 2**22
+
+    def __init__(self, memory_budget=None, spill_dir=None):
+        """
+        @param int memory_budget: maximum number of bytes of raw data to keep in memory
+                                  (None for unlimited)
+        @param str spill_dir: directory for the spill files. Created upon first spill. No spilling
+                              if None.
+        """
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._entries = OrderedDict()  # tag: (raw data, info dict), least recently used first
+        self._spill_files = dict()  # tag: spill file path
+
+    @property
+    def memory_usage(self):
+        """
+        Number of bytes of raw data held in memory (excluding spilled raw data).
+        """
+        return sum(data.nbytes for tag, (data, info) in self._entries.items()
+                   if tag not in self._spill_files)
+
+    def is_spilled(self, tag):
+        return tag in self._spill_files
+
+    def __contains__(self, tag):
+        return tag in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def keys(self):
+        return list(self._entries)
+
+    def __getitem__(self, tag):
+        entry = self._entries[tag]
+        self._entries.move_to_end(tag)
+        return entry
+
+    def get(self, tag, default=None):
+        if tag not in self._entries:
+            return default
+        return self[tag]
+
+    def __setitem__(self, tag, value):
+        data, info = value
+        if tag in self._entries:
+            del self[tag]
+        self._entries[tag] = (np.asarray(data), info)
+        self._enforce_budget()
+
+    def __delitem__(self, tag):
+        del self._entries[tag]
+        self._remove_spill_file(tag)
+
+    def pop(self, tag, *args):
+        if tag not in self._entries and args:
+            return args[0]
+        entry = self._entries[tag]
+        if tag in self._spill_files:
+            # Load spilled data into memory since the spill file is removed
+            entry = (np.array(entry[0]), entry[1])
+        del self[tag]
+        return entry
+
+    def clear(self):
+        for tag in list(self._entries):
+            del self[tag]
+
+    def _enforce_budget(self):
+        if self.memory_budget is None or self.spill_dir is None:
+            return
+        usage = self.memory_usage
+        for tag in list(self._entries):
+            if usage <= self.memory_budget:
+                break
+            if tag in self._spill_files:
+                continue
+            usage -= self._entries[tag][0].nbytes
+            self._spill(tag)
+        return
+
+    def _spill(self, tag):
+        data, info = self._entries[tag]
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, 'raw_data_stash_{0}.npy'.format(uuid.uuid4().hex))
+        spill_map = np.lib.format.open_memmap(path, mode='w+', dtype=data.dtype, shape=data.shape)
+        spill_flat = spill_map.reshape(-1)
+        data_flat = np.ravel(data)
+        for start in range(0, data_flat.size, self._chunk_size):
+            spill_flat[start:start + self._chunk_size] = data_flat[start:start + self._chunk_size]
+        spill_map.flush()
+        del spill_map, spill_flat
+        self._spill_files[tag] = path
+        self._entries[tag] = (np.load(path, mmap_mode='r'), info)
+        return
+
+    def _remove_spill_file(self, tag):
+        path = self._spill_files.pop(tag, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                # File still memory mapped elsewhere (Windows). Leave it in the spill directory.
+                pass
+        return
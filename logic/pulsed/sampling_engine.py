@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi helper class for vectorized sampling of PulseBlockEnsembles.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import queue
+import threading
+import numpy as np
+try:
+    # Only available in Python >= 3.8
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from core.util.helpers import natural_sort
+from logic.pulsed.sampling_functions import SamplingFunctions
+
+
+class EnsembleSampler:
+    """
+    Sampling plan for a single PulseBlockEnsemble.
+
+    The whole ensemble (all blocks incl. repetitions) is planned once upon creation. Each
+    PulseBlockElement is represented by its start bin, its length in bins, the state of each
+    digital channel and an index into a table of distinct sampling functions per analog channel.
+    Sampling functions are considered identical if they are of the same SamplingBase subclass and
+    share the same parameters.
+
+    Arbitrary sample windows (chunks) of the ensemble can then be rendered with sample_chunk.
+    Each distinct sampling function is compiled into a cached evaluator (see
+    SamplingFunctions.compile), so segments sharing function, length and start time (e.g. all
+    elements outside of the rotating frame) are only evaluated once. Otherwise all elements inside
+    a chunk sharing the same sampling function are evaluated by a single call to "get_samples" (if
+    the sampling function is pointwise, i.e. each sample only depends on its own point in time).
+    Digital channels are filled by a single run-length expansion per channel.
+
+    The resulting samples are identical to sampling each element on its own unless phase rotation
+    is enabled for sinusoidal functions (identical up to floating point rounding).
+    """
+
+    def __init__(self, block_list, elements_length_bins, sample_rate, analog_norm,
+                 digital_channels, rotating_frame=True, offset_bin=0, phase_rotation=False):
+        """
+        @param list block_list: list of tuples (PulseBlock instance, repetitions) in the order of
+                                the PulseBlockEnsemble
+        @param numpy.ndarray elements_length_bins: Length in bins of each element incl. repetitions
+                                                   as returned by analyze_block_ensemble
+        @param float sample_rate: The sample rate in samples/s
+        @param dict analog_norm: dict with keys being analog channel descriptors and values being
+                                 the normalization factor (half of the pp-amplitude) for samples
+        @param set digital_channels: set of digital channel descriptors
+        @param bool rotating_frame: Flag indicating if the phase is preserved across elements
+        @param int offset_bin: Time bin offset of the first sample
+        @param bool phase_rotation: Flag indicating if sinusoidal functions are evaluated by phase
+                                    rotation of cached sine/cosine tables
+        """
+        self.sample_rate = float(sample_rate)
+        self.analog_norm = dict(analog_norm)
+        self.analog_channels = set(analog_norm)
+        self.digital_channels = set(digital_channels)
+        self.rotating_frame = bool(rotating_frame)
+        self.offset_bin = int(offset_bin)
+        self.phase_rotation = bool(phase_rotation)
+
+        self.elements_length_bins = np.asarray(elements_length_bins, dtype='int64')
+        self.elements_end_bins = np.cumsum(self.elements_length_bins)
+        self.elements_start_bins = self.elements_end_bins - self.elements_length_bins
+        self.number_of_samples = int(self.elements_end_bins[-1]) if len(
+            self.elements_end_bins) > 0 else 0
+
+        # Table of distinct sampling functions and the per-element index into it (per channel)
+        self.functions = list()
+        self.function_indices = dict()
+        # Per-element digital channel states
+        self.digital_states = dict()
+        self._plan_elements(block_list)
+        # Compiled evaluators of the sampling functions (created upon first use)
+        self._evaluators = dict()
+
+        if self.function_indices:
+            number_of_elements = len(next(iter(self.function_indices.values())))
+        elif self.digital_states:
+            number_of_elements = len(next(iter(self.digital_states.values())))
+        else:
+            number_of_elements = len(self.elements_length_bins)
+        if number_of_elements != len(self.elements_length_bins):
+            raise ValueError('Number of planned PulseBlockElements ({0:d}) does not match the '
+                             'number of element lengths ({1:d}).'
+                             ''.format(number_of_elements, len(self.elements_length_bins)))
+        return
+
+    @staticmethod
+    def _function_key(func):
+        """ Helper returning a hashable key identifying a sampling function by type and params """
+        key = func.get_hashable_key()
+        if key is None:
+            return type(func), id(func)
+        return key
+
+    def _get_evaluator(self, func_index):
+        """ Helper returning the compiled evaluator for an entry of the sampling function table """
+        evaluator = self._evaluators.get(func_index)
+        if evaluator is None:
+            evaluator = SamplingFunctions.compile(self.functions[func_index],
+                                                  self.sample_rate,
+                                                  self.phase_rotation)
+            self._evaluators[func_index] = evaluator
+        return evaluator
+
+    def _plan_elements(self, block_list):
+        """
+        Builds the per-element function indices and digital states for all blocks from their
+        element tables. Repetitions are created by tiling the resulting arrays.
+
+        @param list block_list: list of tuples (PulseBlock instance, repetitions)
+        """
+        key_to_index = dict()
+        func_indices = {chnl: list() for chnl in self.analog_channels}
+        digital_states = {chnl: list() for chnl in self.digital_channels}
+
+        for block, reps in block_list:
+            # Function indices and digital states are taken from the memoized element table of the
+            # block. Only the (few) distinct functions of each block need to be mapped onto the
+            # global function table.
+            block_table = block.get_element_table()
+            global_indices = np.empty(len(block_table['functions']), dtype='int64')
+            for local_index, func in enumerate(block_table['functions']):
+                key = self._function_key(func)
+                func_index = key_to_index.get(key)
+                if func_index is None:
+                    func_index = len(self.functions)
+                    key_to_index[key] = func_index
+                    self.functions.append(func)
+                global_indices[local_index] = func_index
+            block_func_indices = {chnl: global_indices[block_table['function_indices'][chnl]]
+                                  for chnl in self.analog_channels}
+            block_digital_states = {chnl: block_table['digital_high'][chnl]
+                                    for chnl in self.digital_channels}
+
+            for chnl, indices in block_func_indices.items():
+                func_indices[chnl].append(np.tile(indices, reps + 1))
+            for chnl, states in block_digital_states.items():
+                digital_states[chnl].append(np.tile(states, reps + 1))
+
+        for chnl, index_list in func_indices.items():
+            self.function_indices[chnl] = np.concatenate(index_list) if index_list else np.empty(
+                0, dtype='int64')
+        for chnl, state_list in digital_states.items():
+            self.digital_states[chnl] = np.concatenate(state_list) if state_list else np.empty(
+                0, dtype=bool)
+        return
+
+    def get_segments(self, start_bin, stop_bin):
+        """
+        Determines all element segments overlapping with the sample window [start_bin, stop_bin).
+
+        @param int start_bin: first sample of the window (incl.)
+        @param int stop_bin: last sample of the window (excl.)
+
+        @return tuple: (element index slice,
+                        mask of non-empty segments within slice,
+                        segment lengths,
+                        segment write positions relative to start_bin,
+                        segment time bin offsets)
+        """
+        first = np.searchsorted(self.elements_end_bins, start_bin, side='right')
+        last = np.searchsorted(self.elements_start_bins, stop_bin, side='left')
+        element_slice = slice(first, last)
+
+        seg_start = np.maximum(self.elements_start_bins[element_slice], start_bin)
+        seg_stop = np.minimum(self.elements_end_bins[element_slice], stop_bin)
+        seg_length = seg_stop - seg_start
+        mask = seg_length > 0
+        seg_start = seg_start[mask]
+        seg_length = seg_length[mask]
+        write_pos = seg_start - start_bin
+        # Within the rotating frame the time of each segment starts at its absolute position.
+        # Otherwise each element is sampled starting from the offset bin. Elements split across
+        # chunk borders continue at their position relative to the element start.
+        if self.rotating_frame:
+            time_bins = seg_start + self.offset_bin
+        else:
+            elem_start = self.elements_start_bins[element_slice][mask]
+            time_bins = seg_start - elem_start + self.offset_bin
+        return element_slice, mask, seg_length, write_pos, time_bins
+
+    def sample_chunk(self, start_bin, analog_samples, digital_samples, length=None):
+        """
+        Renders the samples [start_bin, start_bin + length) of the ensemble into the given,
+        preallocated sample arrays (starting at index 0 of each array).
+
+        @param int start_bin: first sample of the ensemble to render
+        @param dict analog_samples: dict of preallocated float32 arrays for each analog channel
+        @param dict digital_samples: dict of preallocated bool arrays for each digital channel
+        @param int length: optional, number of samples to render. Defaults to the length of the
+                           sample arrays.
+
+        @return int: number of samples rendered
+        """
+        if length is None:
+            arrays = list(analog_samples.values()) + list(digital_samples.values())
+            length = len(arrays[0]) if arrays else 0
+        length = min(int(length), self.number_of_samples - start_bin)
+        if length <= 0:
+            return 0
+        stop_bin = start_bin + length
+
+        element_slice, mask, seg_length, write_pos, time_bins = self.get_segments(start_bin,
+                                                                                  stop_bin)
+
+        # Digital channels: single run-length expansion per channel
+        for chnl, states in self.digital_states.items():
+            digital_samples[chnl][:length] = np.repeat(states[element_slice][mask], seg_length)
+
+        # Analog channels: one (cached) evaluation per distinct sampling function
+        for chnl, func_indices in self.function_indices.items():
+            chunk_indices = func_indices[element_slice][mask]
+            norm = self.analog_norm[chnl]
+            for func_index in np.unique(chunk_indices):
+                evaluator = self._get_evaluator(func_index)
+                selection = np.flatnonzero(chunk_indices == func_index)
+                kwargs = {'target': analog_samples[chnl],
+                          'norm': norm,
+                          'lengths': seg_length[selection],
+                          'write_pos': write_pos[selection],
+                          'time_bins': time_bins[selection]}
+                if evaluator.phase_rotation:
+                    self._sample_rotated(evaluator=evaluator, **kwargs)
+                elif evaluator.is_pointwise and self.rotating_frame and len(selection) > 1:
+                    # All segments start at different times, nothing to gain from caching
+                    self._sample_batch(func=evaluator.function, **kwargs)
+                else:
+                    self._sample_cached(evaluator=evaluator, **kwargs)
+        return length
+
+    @staticmethod
+    def _write_segments(target, samples, length, write_pos):
+        """
+        Writes the same (or per segment) samples into several segments of equal length.
+
+        @param numpy.ndarray target: The array to write the samples to
+        @param numpy.ndarray samples: 1D samples for all or 2D samples for each segment
+        @param int length: length of each segment in bins
+        @param numpy.ndarray write_pos: position of each segment in the target array
+        """
+        if len(write_pos) == 1:
+            pos = int(write_pos[0])
+            target[pos:pos + length] = samples if samples.ndim == 1 else samples[0]
+        else:
+            target[np.add.outer(write_pos, np.arange(length, dtype='int64'))] = samples
+        return
+
+    def _sample_cached(self, evaluator, target, norm, lengths, write_pos, time_bins):
+        """
+        Evaluates each distinct (start time, length) segment once using the cached evaluator and
+        writes the normalized samples into all matching segments of the target array.
+        Within the rotating frame the start time is the absolute time bin of a segment, so the
+        segments never repeat and are not stored in the sample cache (they would only evict
+        reusable samples).
+
+        @param CompiledSamplingFunction evaluator: The evaluator of the sampling function
+        @param numpy.ndarray target: The array to write the samples to
+        @param float norm: normalization factor for the samples
+        @param numpy.ndarray lengths: length of each segment in bins
+        @param numpy.ndarray write_pos: position of each segment in the target array
+        @param numpy.ndarray time_bins: time bin of the first sample of each segment
+        """
+        segments, inverse = np.unique(np.stack((time_bins, lengths)), axis=1, return_inverse=True)
+        inverse = inverse.ravel()
+        for index, (time_bin, seg_len) in enumerate(segments.T):
+            samples = evaluator.get_samples(time_bin, seg_len,
+                                            use_cache=not self.rotating_frame) / norm
+            self._write_segments(target, samples, int(seg_len), write_pos[inverse == index])
+        return
+
+    def _sample_rotated(self, evaluator, target, norm, lengths, write_pos, time_bins):
+        """
+        Evaluates all segments of the same length at once by phase rotation and writes the
+        normalized samples into the target array.
+
+        @param CompiledSamplingFunction evaluator: The evaluator of the sampling function
+        @param numpy.ndarray target: The array to write the samples to
+        @param float norm: normalization factor for the samples
+        @param numpy.ndarray lengths: length of each segment in bins
+        @param numpy.ndarray write_pos: position of each segment in the target array
+        @param numpy.ndarray time_bins: time bin of the first sample of each segment
+        """
+        for seg_len in np.unique(lengths):
+            selection = lengths == seg_len
+            # Sine/cosine tables too large to be cached are not worth it
+            if 16 * seg_len > SamplingFunctions.sample_cache_size // 4:
+                self._sample_cached(evaluator=evaluator,
+                                    target=target,
+                                    norm=norm,
+                                    lengths=lengths[selection],
+                                    write_pos=write_pos[selection],
+                                    time_bins=time_bins[selection])
+                continue
+            samples = evaluator.get_rotated_samples(time_bins[selection], seg_len) / norm
+            self._write_segments(target, samples, int(seg_len), write_pos[selection])
+        return
+
+    def _sample_batch(self, func, target, norm, lengths, write_pos, time_bins):
+        """
+        Evaluates a sampling function for several segments at once and writes the normalized
+        samples into the target array.
+
+        @param SamplingBase func: The sampling function instance to evaluate
+        @param numpy.ndarray target: The array to write the samples to
+        @param float norm: normalization factor for the samples
+        @param numpy.ndarray lengths: length of each segment in bins
+        @param numpy.ndarray write_pos: position of each segment in the target array
+        @param numpy.ndarray time_bins: time bin of the first sample of each segment
+        """
+        if len(lengths) == 1:
+            seg_len = int(lengths[0])
+            pos = int(write_pos[0])
+            time_arr = (int(time_bins[0]) + np.arange(seg_len, dtype='float64')) / self.sample_rate
+            target[pos:pos + seg_len] = func.get_samples(time_arr) / norm
+            return
+
+        total_length = int(np.sum(lengths))
+        # position of each sample within its own segment
+        local_index = np.arange(total_length, dtype='int64') - np.repeat(
+            np.cumsum(lengths) - lengths, lengths)
+        time_arr = (np.repeat(time_bins, lengths) + local_index).astype('float64') / self.sample_rate
+        target[np.repeat(write_pos, lengths) + local_index] = func.get_samples(time_arr) / norm
+        return
+
+
+class ChunkPipeline:
+    """
+    Iterator over consecutive sample chunks of an EnsembleSampler.
+
+    The chunks are rendered into a pool of preallocated sample buffers. If more than one buffer is
+    given, a worker thread renders chunk N+1 into the next free buffer while chunk N is being
+    consumed (e.g. written to the pulse generator). Otherwise the chunks are rendered on demand in
+    the calling thread.
+
+    Each iteration yields a tuple (analog_samples, digital_samples) of dicts holding arrays with the
+    exact length of the current chunk (views into the buffers). The arrays of a chunk must not be
+    used anymore after requesting the next chunk since the buffer is handed back to the worker.
+    """
+
+    def __init__(self, sampler, buffers, chunk_length):
+        """
+        @param EnsembleSampler sampler: The sampler to render the chunks with
+        @param list buffers: list of tuples (analog_samples, digital_samples) each being a dict of
+                             preallocated sample arrays for each channel with at least chunk_length
+                             entries
+        @param int chunk_length: number of samples per chunk (the last chunk can be shorter)
+        """
+        self.sampler = sampler
+        self.buffers = list(buffers)
+        self.chunk_length = int(chunk_length)
+        self.number_of_chunks = -(-sampler.number_of_samples // self.chunk_length) if \
+            self.chunk_length > 0 else 0
+        return
+
+    def _get_chunk_views(self, buffer, start_bin):
+        length = min(self.chunk_length, self.sampler.number_of_samples - start_bin)
+        analog_samples = {chnl: arr[:length] for chnl, arr in buffer[0].items()}
+        digital_samples = {chnl: arr[:length] for chnl, arr in buffer[1].items()}
+        return analog_samples, digital_samples, length
+
+    def __iter__(self):
+        if len(self.buffers) < 2 or self.number_of_chunks < 2:
+            return self._iter_serial()
+        return self._iter_threaded()
+
+    def _iter_serial(self):
+        start_bin = 0
+        for chunk in range(self.number_of_chunks):
+            analog_samples, digital_samples, length = self._get_chunk_views(self.buffers[0],
+                                                                            start_bin)
+            self.sampler.sample_chunk(start_bin=start_bin,
+                                      analog_samples=analog_samples,
+                                      digital_samples=digital_samples,
+                                      length=length)
+            start_bin += length
+            yield analog_samples, digital_samples
+
+    def _iter_threaded(self):
+        free_buffers = queue.Queue()
+        for buffer in self.buffers:
+            free_buffers.put(buffer)
+        rendered_chunks = queue.Queue()
+        stop_event = threading.Event()
+
+        def render_chunks():
+            try:
+                start_bin = 0
+                for chunk in range(self.number_of_chunks):
+                    buffer = free_buffers.get()
+                    if buffer is None or stop_event.is_set():
+                        break
+                    analog_samples, digital_samples, length = self._get_chunk_views(buffer,
+                                                                                    start_bin)
+                    self.sampler.sample_chunk(start_bin=start_bin,
+                                              analog_samples=analog_samples,
+                                              digital_samples=digital_samples,
+                                              length=length)
+                    start_bin += length
+                    rendered_chunks.put((analog_samples, digital_samples, buffer))
+            except Exception as e:
+                rendered_chunks.put(e)
+            return
+
+        worker = threading.Thread(target=render_chunks, name='ChunkPipeline', daemon=True)
+        worker.start()
+        try:
+            for chunk in range(self.number_of_chunks):
+                item = rendered_chunks.get()
+                if isinstance(item, Exception):
+                    raise item
+                analog_samples, digital_samples, buffer = item
+                yield analog_samples, digital_samples
+                free_buffers.put(buffer)
+        finally:
+            stop_event.set()
+            free_buffers.put(None)
+            worker.join()
+
+
+def get_sample_buffer_size(sampler):
+    """
+    Calculates the size in bytes needed to hold all samples of an EnsembleSampler in a single
+    buffer (see get_sample_arrays).
+
+    @param EnsembleSampler sampler: The sampler instance
+    @return int: buffer size in bytes
+    """
+    bytes_per_sample = 4 * len(sampler.analog_channels) + len(sampler.digital_channels)
+    return bytes_per_sample * sampler.number_of_samples
+
+
+def get_sample_arrays(buffer, sampler):
+    """
+    Creates the analog (float32) and digital (bool) sample arrays of all channels of an
+    EnsembleSampler as views into a single buffer (e.g. shared memory).
+    Analog channels are placed first followed by the digital channels (both in natural order).
+
+    @param buffer: Object exposing the buffer interface (e.g. SharedMemory.buf)
+    @param EnsembleSampler sampler: The sampler instance
+
+    @return (dict, dict): analog sample arrays, digital sample arrays
+    """
+    number_of_samples = sampler.number_of_samples
+    offset = 0
+    analog_samples = dict()
+    digital_samples = dict()
+    for chnl in natural_sort(sampler.analog_channels):
+        analog_samples[chnl] = np.ndarray(number_of_samples, dtype='float32', buffer=buffer,
+                                          offset=offset)
+        offset += 4 * number_of_samples
+    for chnl in natural_sort(sampler.digital_channels):
+        digital_samples[chnl] = np.ndarray(number_of_samples, dtype=bool, buffer=buffer,
+                                           offset=offset)
+        offset += number_of_samples
+    return analog_samples, digital_samples
+
+
+def init_sampling_worker(path_list):
+    """
+    Initializer for worker processes sampling PulseBlockEnsembles. Imports the sampling functions
+    from the same paths as the SequenceGeneratorLogic did.
+
+    @param list path_list: list of paths to import sampling function definitions from
+    """
+    SamplingFunctions.import_sampling_functions(path_list)
+    return
+
+
+def sample_to_shared_memory(sampler, shm_name):
+    """
+    Worker function rendering all samples of an EnsembleSampler into a named shared memory block.
+    The layout of the shared memory is given by get_sample_arrays.
+
+    @param EnsembleSampler sampler: The sampler instance
+    @param str shm_name: Name of the shared memory block to write into
+
+    @return int: number of samples rendered
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        analog_samples, digital_samples = get_sample_arrays(shm.buf, sampler)
+        rendered_samples = sampler.sample_chunk(start_bin=0,
+                                                analog_samples=analog_samples,
+                                                digital_samples=digital_samples,
+                                                length=sampler.number_of_samples)
+        # Release views into the shared memory before closing it
+        del analog_samples, digital_samples
+    finally:
+        shm.close()
+    return rendered_samples
@@ -29,6 +29,8 @@ class Idle(SamplingBase):
     """
     Object representing an idle element (zero voltage)
     """
+    is_pointwise = True
+
     def __init__(self):
         pass
 
@@ -42,6 +44,8 @@ class DC(SamplingBase):
     """
     Object representing an DC element (constant voltage)
     """
+    is_pointwise = True
+
     params = OrderedDict()
     params['voltage'] = {'unit': 'V', 'init': 0.0, 'min': -np.inf, 'max': +np.inf, 'type': float}
 
@@ -66,6 +70,9 @@ class Sin(SamplingBase):
     """
     Object representing a sine wave element
     """
+    is_pointwise = True
+    sine_combination = 'sum'
+
     params = OrderedDict()
     params['amplitude'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -96,11 +103,17 @@ class Sin(SamplingBase):
         samples_arr = self._get_sine(time_array, self.amplitude, self.frequency, phase_rad)
         return samples_arr
 
+    def get_sine_components(self):
+        return [(self.amplitude, self.frequency, np.pi * self.phase / 180)]
+
 
 class DoubleSinSum(SamplingBase):
     """
     Object representing a double sine wave element (Superposition of two sine waves; NOT normalized)
     """
+    is_pointwise = True
+    sine_combination = 'sum'
+
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -154,11 +167,18 @@ class DoubleSinSum(SamplingBase):
         samples_arr += self._get_sine(time_array, self.amplitude_2, self.frequency_2, phase_rad)
         return samples_arr
 
+    def get_sine_components(self):
+        return [(self.amplitude_1, self.frequency_1, np.pi * self.phase_1 / 180),
+                (self.amplitude_2, self.frequency_2, np.pi * self.phase_2 / 180)]
+
 
 class DoubleSinProduct(SamplingBase):
     """
     Object representing a double sine wave element (Product of two sine waves; NOT normalized)
     """
+    is_pointwise = True
+    sine_combination = 'product'
+
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -212,12 +232,19 @@ class DoubleSinProduct(SamplingBase):
         samples_arr *= self._get_sine(time_array, self.amplitude_2, self.frequency_2, phase_rad)
         return samples_arr
 
+    def get_sine_components(self):
+        return [(self.amplitude_1, self.frequency_1, np.pi * self.phase_1 / 180),
+                (self.amplitude_2, self.frequency_2, np.pi * self.phase_2 / 180)]
+
 
 class TripleSinSum(SamplingBase):
     """
     Object representing a linear combination of three sines
     (Superposition of three sine waves; NOT normalized)
     """
+    is_pointwise = True
+    sine_combination = 'sum'
+
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -292,12 +319,20 @@ class TripleSinSum(SamplingBase):
         samples_arr += self._get_sine(time_array, self.amplitude_3, self.frequency_3, phase_rad)
         return samples_arr
 
+    def get_sine_components(self):
+        return [(self.amplitude_1, self.frequency_1, np.pi * self.phase_1 / 180),
+                (self.amplitude_2, self.frequency_2, np.pi * self.phase_2 / 180),
+                (self.amplitude_3, self.frequency_3, np.pi * self.phase_3 / 180)]
+
 
 class TripleSinProduct(SamplingBase):
     """
     Object representing a wave element composed of the product of three sines
     (Product of three sine waves; NOT normalized)
     """
+    is_pointwise = True
+    sine_combination = 'product'
+
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -372,6 +407,11 @@ class TripleSinProduct(SamplingBase):
         samples_arr *= self._get_sine(time_array, self.amplitude_3, self.frequency_3, phase_rad)
         return samples_arr
 
+    def get_sine_components(self):
+        return [(self.amplitude_1, self.frequency_1, np.pi * self.phase_1 / 180),
+                (self.amplitude_2, self.frequency_2, np.pi * self.phase_2 / 180),
+                (self.amplitude_3, self.frequency_3, np.pi * self.phase_3 / 180)]
+
 
 class Chirp(SamplingBase):
     """
@@ -471,24 +511,17 @@ class AllenEberlyChirp(SamplingBase):
         # conversion for AWG to actually output the specified voltage
         amp_conv = 2 * self.amplitude  # amplitude, corrected from parabola pulse estimation
 
-        # define a sech function as it is not included in the numpy package
-        def sech(current_time):
-            return 1 / np.cosh(current_time)
-
-        # define a function to calculate the Rabi frequency as a function of time
-        def rabi_sech_envelope(current_time):
-            return amp_conv * sech((current_time - t_start - (pulse_duration / 2)) / tau_run)
-
-        # define a function to calculate the phase Phi(t) for the specific pulse parameters
-        def phi_tanh_chirp(current_time):
-            return (2 * np.pi * freq_range_max / 2) * tau_run * np.log(
-                np.cosh((current_time - t_start - (pulse_duration / 2)) / tau_run) *
-                sech(pulse_duration / (2 * tau_run)))
+        # Rabi frequency follows a sech envelope and the phase Phi(t) a log(cosh) shape around
+        # the pulse center. Both share the same cosh, so it is only evaluated once.
+        cosh_arr = np.cosh((time_array - t_start - (pulse_duration / 2)) / tau_run)
+        rabi_sech_envelope = amp_conv * (1 / cosh_arr)
+        phi_tanh_chirp = (2 * np.pi * freq_range_max / 2) * tau_run * np.log(
+            cosh_arr * (1 / np.cosh(pulse_duration / (2 * tau_run))))
 
         # calculate the samples array
-        samples_arr = rabi_sech_envelope(time_array) * \
+        samples_arr = rabi_sech_envelope * \
                       np.cos(phase_rad + 2 * np.pi * freq_center * (time_array - t_start) +
-                             phi_tanh_chirp(time_array))
+                             phi_tanh_chirp)
         return samples_arr
 
 # FIXME: Not implemented yet!
@@ -26,6 +26,8 @@ import sys
 import inspect
 import copy
 import logging
+import threading
+import numpy as np
 from collections import OrderedDict
 
 
@@ -35,6 +37,14 @@ class SamplingBase:
     """
     params = OrderedDict()
     log = logging.getLogger(__name__)
+    # Flag indicating that each sample only depends on its own point in time (and not e.g. on the
+    # first/last entry of the time array). Pointwise functions can be evaluated for several
+    # PulseBlockElements in a single call.
+    is_pointwise = False
+    # Sinusoidal functions can be evaluated by phase rotation of cached sine/cosine tables (see
+    # CompiledSamplingFunction). They have to implement get_sine_components and specify how the
+    # components are combined ('sum' or 'product').
+    sine_combination = None
 
     def __repr__(self):
         kwargs = []
@@ -75,6 +85,129 @@ class SamplingBase:
             dict_repr['params'][param] = getattr(self, param)
         return dict_repr
 
+    def get_hashable_key(self):
+        """
+        Returns a hashable key identifying this sampling function by type and parameter values.
+
+        @return tuple: (class, param values...) or None if a parameter value is not hashable
+        """
+        key = tuple([type(self)] + [getattr(self, param) for param in self.params])
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get_sine_components(self):
+        """
+        Returns the sine components of sinusoidal sampling functions, i.e.
+        amplitude * sin(2*pi*frequency*t + phase) for each (amplitude, frequency, phase) tuple.
+        The components are combined according to the class attribute "sine_combination".
+
+        @return list: list of tuples (amplitude, frequency, phase in rad) or None if the function
+                      is not sinusoidal
+        """
+        return None
+
+
+class CompiledSamplingFunction:
+    """
+    Cached evaluator of a sampling function instance for a fixed sample rate.
+    Create instances with SamplingFunctions.compile.
+
+    The samples of a segment only depend on the function (type and parameters), the sample rate,
+    the segment length and the time bin of its first sample. Evaluated segments are stored in the
+    sample cache of SamplingFunctions and are looked up instead of being recomputed.
+
+    Sinusoidal functions can optionally be evaluated by phase rotation:
+        sin(w*(t0 + t) + phi) = sin(w*t) * cos(w*t0 + phi) + cos(w*t) * sin(w*t0 + phi)
+    The sine/cosine tables only depend on the frequency and segment length and are cached. The
+    start time of a segment only enters via two scalars, so all segments of the same length (e.g.
+    all pi pulses of an XY8 train) share a single table. The result agrees with the direct
+    evaluation up to floating point rounding.
+    """
+
+    def __init__(self, function, sample_rate, phase_rotation=False):
+        """
+        @param SamplingBase function: The sampling function instance to compile
+        @param float sample_rate: The sample rate in samples/s
+        @param bool phase_rotation: Flag indicating if phase rotation should be used for
+                                    sinusoidal functions
+        """
+        self.function = function
+        self.sample_rate = float(sample_rate)
+        self.is_pointwise = function.is_pointwise
+        self._key = function.get_hashable_key()
+        self._sine_components = None
+        self._sine_combination = function.sine_combination
+        if phase_rotation and function.is_pointwise and self._key is not None:
+            self._sine_components = function.get_sine_components()
+        return
+
+    @property
+    def phase_rotation(self):
+        return self._sine_components is not None
+
+    def get_samples(self, time_bin, length, use_cache=True):
+        """
+        Returns the samples of a segment. The returned array must not be altered.
+
+        @param int time_bin: time bin of the first sample of the segment
+        @param int length: number of samples in the segment
+        @param bool use_cache: look up and store the samples in the sample cache. Should be False
+                               for segments that are not going to repeat.
+
+        @return numpy.ndarray: float64 samples (read-only)
+        """
+        time_bin = int(time_bin)
+        length = int(length)
+        if self._key is None or not use_cache:
+            return self._evaluate(time_bin, length)
+        cache_key = (self._key, self.sample_rate, time_bin, length)
+        samples = SamplingFunctions.get_cached(cache_key)
+        if samples is None:
+            samples = SamplingFunctions.add_to_cache(cache_key, self._evaluate(time_bin, length))
+        return samples
+
+    def get_rotated_samples(self, time_bins, length):
+        """
+        Returns the samples of several segments of the same length by phase rotation.
+        Can only be used if phase_rotation is True.
+
+        @param numpy.ndarray time_bins: time bin of the first sample of each segment
+        @param int length: number of samples in each segment
+
+        @return numpy.ndarray: 2D float64 array of shape (len(time_bins), length)
+        """
+        start_times = np.asarray(time_bins, dtype='float64') / self.sample_rate
+        samples = None
+        for amplitude, frequency, phase in self._sine_components:
+            tables = self._get_sine_tables(frequency, int(length))
+            start_phase = 2 * np.pi * frequency * start_times + phase
+            component = np.multiply.outer(amplitude * np.cos(start_phase), tables[0])
+            component += np.multiply.outer(amplitude * np.sin(start_phase), tables[1])
+            if samples is None:
+                samples = component
+            elif self._sine_combination == 'product':
+                samples *= component
+            else:
+                samples += component
+        return samples
+
+    def _evaluate(self, time_bin, length):
+        time_arr = (time_bin + np.arange(length, dtype='float64')) / self.sample_rate
+        return np.asarray(self.function.get_samples(time_arr), dtype='float64')
+
+    def _get_sine_tables(self, frequency, length):
+        """ Returns the cached array [sin(w*t), cos(w*t)] for t = arange(length) / sample_rate """
+        cache_key = ('sine_tables', frequency, self.sample_rate, length)
+        tables = SamplingFunctions.get_cached(cache_key)
+        if tables is None:
+            arg = 2 * np.pi * frequency * (np.arange(length, dtype='float64') / self.sample_rate)
+            tables = SamplingFunctions.add_to_cache(cache_key, np.array((np.sin(arg),
+                                                                         np.cos(arg))))
+        return tables
+
 
 class SamplingFunctions:
     """
@@ -82,6 +215,76 @@ class SamplingFunctions:
     """
     parameters = dict()
 
+    # Size limit in bytes of the cache holding evaluated segments of compiled sampling functions
+    sample_cache_size = 128 * 1024 ** 2
+    _sample_cache = OrderedDict()
+    _sample_cache_bytes = 0
+    _sample_cache_lock = threading.Lock()
+
+    @staticmethod
+    def compile(function, sample_rate, phase_rotation=False):
+        """
+        Turns a sampling function instance into a cached evaluator for the given sample rate.
+
+        @param SamplingBase function: The sampling function instance to compile
+        @param float sample_rate: The sample rate in samples/s
+        @param bool phase_rotation: Flag indicating if sinusoidal functions should be evaluated by
+                                    phase rotation of cached sine/cosine tables
+
+        @return CompiledSamplingFunction: The evaluator instance
+        """
+        return CompiledSamplingFunction(function, sample_rate, phase_rotation)
+
+    @classmethod
+    def get_cached(cls, key):
+        """
+        Looks up an array in the sample cache.
+
+        @param tuple key: The cache key
+        @return numpy.ndarray: The cached (read-only) array or None if not present
+        """
+        with cls._sample_cache_lock:
+            arr = cls._sample_cache.get(key)
+            if arr is not None:
+                cls._sample_cache.move_to_end(key)
+            return arr
+
+    @classmethod
+    def add_to_cache(cls, key, arr):
+        """
+        Stores an array in the sample cache. The least recently used arrays are dropped if the
+        cache exceeds sample_cache_size. Arrays larger than a quarter of the cache size are not
+        stored.
+
+        @param tuple key: The cache key
+        @param numpy.ndarray arr: The array to store. Will be flagged as read-only.
+
+        @return numpy.ndarray: The array passed
+        """
+        arr.flags.writeable = False
+        if arr.nbytes > cls.sample_cache_size // 4:
+            return arr
+        with cls._sample_cache_lock:
+            old_arr = cls._sample_cache.pop(key, None)
+            if old_arr is not None:
+                cls._sample_cache_bytes -= old_arr.nbytes
+            cls._sample_cache[key] = arr
+            cls._sample_cache_bytes += arr.nbytes
+            while cls._sample_cache_bytes > cls.sample_cache_size:
+                _, dropped = cls._sample_cache.popitem(last=False)
+                cls._sample_cache_bytes -= dropped.nbytes
+        return arr
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Empties the sample cache.
+        """
+        with cls._sample_cache_lock:
+            cls._sample_cache.clear()
+            cls._sample_cache_bytes = 0
+        return
+
     @classmethod
     def import_sampling_functions(cls, path_list):
         param_dict = dict()
@@ -117,6 +320,8 @@ class SamplingFunctions:
                 delattr(cls, func)
 
         cls.parameters = param_dict
+        # Cached samples refer to the previous class definitions
+        cls.clear_cache()
         return
 
     @staticmethod
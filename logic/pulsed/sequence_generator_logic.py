@@ -23,9 +23,19 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 import numpy as np
 import os
 import pickle
+import json
+import hashlib
 import time
 import copy
 import traceback
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+try:
+    # Only available in Python >= 3.8
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
 
 from qtpy import QtCore
 from collections import OrderedDict
@@ -39,6 +49,10 @@ from logic.generic_logic import GenericLogic
 from logic.pulsed.pulse_objects import PulseBlock, PulseBlockEnsemble, PulseSequence
 from logic.pulsed.pulse_objects import PulseObjectGenerator, PulseBlockElement
 from logic.pulsed.sampling_functions import SamplingFunctions
+from logic.pulsed.pulsed_asset_store import PulsedAssetStore, LazyAssetDict
+from logic.pulsed.sampling_engine import EnsembleSampler, ChunkPipeline, get_sample_arrays
+from logic.pulsed.sampling_engine import get_sample_buffer_size, init_sampling_worker
+from logic.pulsed.sampling_engine import sample_to_shared_memory
 from interface.pulser_interface import SequenceOption
 
 
@@ -65,6 +79,15 @@ class SequenceGeneratorLogic(GenericLogic):
                                        default=os.path.join(get_home_dir(), 'saved_pulsed_assets'),
                                        missing='warn')
     _overhead_bytes = ConfigOption(name='overhead_bytes', default=0, missing='nothing')
+    # Number of worker processes used to sample the PulseBlockEnsembles of a PulseSequence in
+    # parallel. Values < 2 disable parallel sampling.
+    _sampling_processes = ConfigOption(name='sampling_processes', default=0, missing='nothing')
+    # Evaluate sinusoidal sampling functions by phase rotation of cached sine/cosine tables.
+    # Faster for many equal pulses within the rotating frame but not bit-identical to the direct
+    # evaluation (deviation on the order of floating point rounding).
+    _sampling_phase_rotation = ConfigOption(name='sampling_phase_rotation',
+                                            default=False,
+                                            missing='nothing')
     # Optional additional paths to import from
     _additional_methods_import_path = ConfigOption(name='additional_predefined_methods_path',
                                                    default=None,
@@ -132,12 +155,20 @@ class SequenceGeneratorLogic(GenericLogic):
 
         # Get instance of PulseObjectGenerator which takes care of collecting all predefined methods
         self._pog = None
+        # List of paths sampling functions have been imported from (needed by worker processes)
+        self._sampling_functions_path_list = list()
 
         # The created pulse objects (PulseBlock, PulseBlockEnsemble, PulseSequence) are saved in
         # these dictionaries. The keys are the names.
         self._saved_pulse_blocks = OrderedDict()
         self._saved_pulse_block_ensembles = OrderedDict()
         self._saved_pulse_sequences = OrderedDict()
+        # Single-file storage of all pulse objects
+        self._asset_store = None
+        # Waveforms/sequences present on the device upon activation. Used to invalidate the
+        # sampling information of pulse objects when they are loaded from the asset store.
+        self._waveforms_on_activation = set()
+        self._sequences_on_activation = set()
         return
 
     def on_activate(self):
@@ -183,11 +214,24 @@ class SequenceGeneratorLogic(GenericLogic):
                 self.log.error('ConfigOption additional_sampling_functions_path needs to either be a string or '
                                'a list of strings.')
         SamplingFunctions.import_sampling_functions(sf_path_list)
+        self._sampling_functions_path_list = sf_path_list
+
+        # Parallel sampling needs shared memory (Python >= 3.8) and worker process initializers
+        # (Python >= 3.7)
+        if self._sampling_processes > 1 and (shared_memory is None or sys.version_info < (3, 8)):
+            self.log.warning('ConfigOption "sampling_processes" requires Python 3.8 or newer. '
+                             'Falling back to serial sampling.')
+            self._sampling_processes = 0
 
         # Read back settings from device and update instance variables accordingly
         self._read_settings_from_device()
 
-        # Update saved blocks/ensembles/sequences from serialized files
+        # Open the asset store and import pulse objects from old pickle files (only once)
+        self._asset_store = PulsedAssetStore(
+            os.path.join(self._assets_storage_dir, 'pulsed_assets.sqlite'))
+        self._import_pickled_assets()
+
+        # Update saved blocks/ensembles/sequences from asset store
         self._saved_pulse_blocks = OrderedDict()
         self._saved_pulse_block_ensembles = OrderedDict()
         self._saved_pulse_sequences = OrderedDict()
@@ -204,6 +248,9 @@ class SequenceGeneratorLogic(GenericLogic):
     def on_deactivate(self):
         """ Deinitialisation performed during deactivation of the module.
         """
+        if self._asset_store is not None:
+            self._asset_store.close()
+            self._asset_store = None
         return
 
     # @_saved_pulse_blocks.constructor
@@ -733,9 +780,7 @@ class SequenceGeneratorLogic(GenericLogic):
             del (self._saved_pulse_blocks[name])
 
         # Delete from disk
-        filepath = os.path.join(self._assets_storage_dir, '{0}.block'.format(name))
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        self._asset_store.delete('block', name)
 
         self.sigBlockDictUpdated.emit(self.saved_pulse_blocks)
         return
@@ -763,34 +808,40 @@ class SequenceGeneratorLogic(GenericLogic):
                 self.log.debug('{0!s}'.format(traceback.format_exc()))
         return block
 
-    def _update_blocks_from_file(self):
-        """
-        Update the saved_pulse_blocks dict by de-serializing stored file.
+    def _load_block_from_store(self, block_name):
         """
-        # Get all files in asset directory ending on ".block" and extract a sorted list of
-        # PulseBlock names
-        with os.scandir(self._assets_storage_dir) as scan:
-            names = natural_sort(f.name[:-6] for f in scan if f.is_file and f.name.endswith('.block'))
+        Loads a PulseBlock instance from the asset store.
 
-        # Load all blocks from file
-        for block_name in names:
-            block = self._load_block_from_file(block_name)
-            if block is not None:
-                self._saved_pulse_blocks[block_name] = block
+        @param str block_name: The name of the PulseBlock instance to load
+        @return PulseBlock: The loaded PulseBlock instance (None if loading failed)
+        """
+        try:
+            return self._asset_store.load('block', block_name)
+        except Exception:
+            self.log.error('Failed to load PulseBlock "{0}" from asset store.\n'
+                           'For better debugging I dumped the traceback to debug.'
+                           ''.format(block_name))
+            self.log.debug('{0!s}'.format(traceback.format_exc()))
+        return None
 
+    def _update_blocks_from_file(self):
+        """
+        Update the saved_pulse_blocks dict from the asset store. The PulseBlock instances are only
+        loaded upon first access.
+        """
+        self._saved_pulse_blocks = LazyAssetDict(self._load_block_from_store,
+                                                 self._asset_store.get_names('block'))
         self.sigBlockDictUpdated.emit(self._saved_pulse_blocks)
         return
 
     def _save_block_to_file(self, block):
         """
-        Saves a single PulseBlock instance to file by serialization using pickle.
+        Saves a single PulseBlock instance to the asset store.
 
         @param PulseBlock block: The PulseBlock instance to be saved
         """
-        filename = '{0}.block'.format(block.name)
         try:
-            with open(os.path.join(self._assets_storage_dir, filename), 'wb') as file:
-                pickle.dump(block, file)
+            self._asset_store.save('block', block)
         except:
             self.log.error('Failed to serialize PulseBlock "{0}" to file.'.format(block.name))
         return
@@ -799,8 +850,9 @@ class SequenceGeneratorLogic(GenericLogic):
         """
         Saves the saved_pulse_blocks dict items to files.
         """
-        for block in self._saved_pulse_blocks.values():
-            self._save_block_to_file(block)
+        with self._asset_store.batch():
+            for block in self._saved_pulse_blocks.values():
+                self._save_block_to_file(block)
         return
 
     def save_ensemble(self, ensemble):
@@ -840,9 +892,7 @@ class SequenceGeneratorLogic(GenericLogic):
             del self._saved_pulse_block_ensembles[name]
 
         # Delete from disk
-        filepath = os.path.join(self._assets_storage_dir, '{0}.ensemble'.format(name))
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        self._asset_store.delete('ensemble', name)
 
         self.sigEnsembleDictUpdated.emit(self.saved_pulse_block_ensembles)
         return
@@ -866,42 +916,50 @@ class SequenceGeneratorLogic(GenericLogic):
                 os.remove(filepath)
         return ensemble
 
-    def _update_ensembles_from_file(self):
+    def _load_ensemble_from_store(self, ensemble_name):
         """
-        Update the saved_pulse_block_ensembles dict from temporary file.
+        Loads a PulseBlockEnsemble instance from the asset store. Outdated sampling information
+        (waveforms not present on the device upon activation) is removed.
+
+        @param str ensemble_name: The name of the PulseBlockEnsemble instance to load
+        @return PulseBlockEnsemble: The loaded PulseBlockEnsemble instance (None if loading failed)
         """
-        # Get all files in asset directory ending on ".ensemble" and extract a sorted list of
-        # PulseBlockEnsemble names
-        with os.scandir(self._assets_storage_dir) as scan:
-            names = natural_sort(f.name[:-9] for f in scan if f.is_file and f.name.endswith('.ensemble'))
+        try:
+            ensemble = self._asset_store.load('ensemble', ensemble_name)
+        except Exception:
+            self.log.error('Failed to load PulseBlockEnsemble "{0}" from asset store.\n'
+                           'For better debugging I dumped the traceback to debug.'
+                           ''.format(ensemble_name))
+            self.log.debug('{0!s}'.format(traceback.format_exc()))
+            return None
+        if ensemble is not None and ensemble.sampling_information.get('waveforms'):
+            waveform_set = set(ensemble.sampling_information['waveforms'])
+            if not self._waveforms_on_activation.issuperset(waveform_set):
+                ensemble.sampling_information = dict()
+        return ensemble
 
+    def _update_ensembles_from_file(self):
+        """
+        Update the saved_pulse_block_ensembles dict from the asset store. The PulseBlockEnsemble
+        instances are only loaded upon first access.
+        """
         # Get all waveforms currently stored on pulser hardware in order to delete outdated
         # sampling_information dicts
-        sampled_waveforms = set(self.sampled_waveforms)
-
-        # Load all ensembles from file
-        for ensemble_name in names:
-            ensemble = self._load_ensemble_from_file(ensemble_name)
-            if ensemble is not None:
-                if ensemble.sampling_information.get('waveforms'):
-                    waveform_set = set(ensemble.sampling_information['waveforms'])
-                    if not sampled_waveforms.issuperset(waveform_set):
-                        ensemble.sampling_information = dict()
-                self._saved_pulse_block_ensembles[ensemble_name] = ensemble
+        self._waveforms_on_activation = set(self.sampled_waveforms)
 
+        self._saved_pulse_block_ensembles = LazyAssetDict(self._load_ensemble_from_store,
+                                                          self._asset_store.get_names('ensemble'))
         self.sigEnsembleDictUpdated.emit(self.saved_pulse_block_ensembles)
         return
 
     def _save_ensemble_to_file(self, ensemble):
         """
-        Saves a single PulseBlockEnsemble instance to file by serialization using pickle.
+        Saves a single PulseBlockEnsemble instance to the asset store.
 
         @param PulseBlockEnsemble ensemble: The PulseBlockEnsemble instance to be saved
         """
-        filename = '{0}.ensemble'.format(ensemble.name)
         try:
-            with open(os.path.join(self._assets_storage_dir, filename), 'wb') as file:
-                pickle.dump(ensemble, file)
+            self._asset_store.save('ensemble', ensemble)
         except:
             self.log.error('Failed to serialize PulseBlockEnsemble "{0}" to file.'
                            ''.format(ensemble.name))
@@ -911,8 +969,9 @@ class SequenceGeneratorLogic(GenericLogic):
         """
         Saves the saved_pulse_block_ensembles dict items to files.
         """
-        for ensemble in self.saved_pulse_block_ensembles.values():
-            self._save_ensemble_to_file(ensemble)
+        with self._asset_store.batch():
+            for ensemble in self.saved_pulse_block_ensembles.values():
+                self._save_ensemble_to_file(ensemble)
         return
 
     def save_sequence(self, sequence):
@@ -957,9 +1016,7 @@ class SequenceGeneratorLogic(GenericLogic):
             del self._saved_pulse_sequences[name]
 
         # Delete from disk
-        filepath = os.path.join(self._assets_storage_dir, '{0}.sequence'.format(name))
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        self._asset_store.delete('sequence', name)
 
         self.sigSequenceDictUpdated.emit(self.saved_pulse_sequences)
         return
@@ -1028,45 +1085,54 @@ class SequenceGeneratorLogic(GenericLogic):
             self._save_sequence_to_file(sequence)
         return sequence
 
-    def _update_sequences_from_file(self):
+    def _load_sequence_from_store(self, sequence_name):
         """
-        Update the saved_pulse_sequences dict from files.
+        Loads a PulseSequence instance from the asset store. Outdated sampling information
+        (sequence or waveforms not present on the device upon activation) is removed.
+
+        @param str sequence_name: The name of the PulseSequence instance to load
+        @return PulseSequence: The loaded PulseSequence instance (None if loading failed)
         """
-        # Get all files in asset directory ending on ".sequence" and extract a sorted list of
-        # PulseSequence names
-        with os.scandir(self._assets_storage_dir) as scan:
-            names = natural_sort(f.name[:-9] for f in scan if f.is_file and f.name.endswith('.sequence'))
+        try:
+            sequence = self._asset_store.load('sequence', sequence_name)
+        except Exception:
+            self.log.error('Failed to load PulseSequence "{0}" from asset store.\n'
+                           'For better debugging I dumped the traceback to debug.'
+                           ''.format(sequence_name))
+            self.log.debug('{0!s}'.format(traceback.format_exc()))
+            return None
+        if sequence is not None:
+            if sequence.name not in self._sequences_on_activation:
+                sequence.sampling_information = dict()
+            elif sequence.sampling_information:
+                waveform_set = set(sequence.sampling_information['waveforms'])
+                if not self._waveforms_on_activation.issuperset(waveform_set):
+                    sequence.sampling_information = dict()
+        return sequence
 
+    def _update_sequences_from_file(self):
+        """
+        Update the saved_pulse_sequences dict from the asset store. The PulseSequence instances
+        are only loaded upon first access.
+        """
         # Get all waveforms and sequences currently stored on pulser hardware in order to delete
         # outdated sampling_information dicts
-        sampled_waveforms = set(self.sampled_waveforms)
-        sampled_sequences = set(self.sampled_sequences)
-
-        # Load all sequences from file
-        for sequence_name in names:
-            sequence = self._load_sequence_from_file(sequence_name)
-            if sequence is not None:
-                if sequence.name not in sampled_sequences:
-                    sequence.sampling_information = dict()
-                elif sequence.sampling_information:
-                    waveform_set = set(sequence.sampling_information['waveforms'])
-                    if not sampled_waveforms.issuperset(waveform_set):
-                        sequence.sampling_information = dict()
-                self._saved_pulse_sequences[sequence_name] = sequence
+        self._waveforms_on_activation = set(self.sampled_waveforms)
+        self._sequences_on_activation = set(self.sampled_sequences)
 
+        self._saved_pulse_sequences = LazyAssetDict(self._load_sequence_from_store,
+                                                    self._asset_store.get_names('sequence'))
         self.sigSequenceDictUpdated.emit(self.saved_pulse_sequences)
         return
 
     def _save_sequence_to_file(self, sequence):
         """
-        Saves a single PulseSequence instance to file by serialization using pickle.
+        Saves a single PulseSequence instance to the asset store.
 
         @param PulseSequence sequence: The PulseSequence instance to be saved
         """
-        filename = '{0}.sequence'.format(sequence.name)
         try:
-            with open(os.path.join(self._assets_storage_dir, filename), 'wb') as file:
-                pickle.dump(sequence, file)
+            self._asset_store.save('sequence', sequence)
         except:
             self.log.error('Failed to serialize PulseSequence "{0}" to file.'.format(sequence.name))
         return
@@ -1075,8 +1141,46 @@ class SequenceGeneratorLogic(GenericLogic):
         """
         Saves the saved_pulse_sequences dict items to files.
         """
-        for sequence in self.saved_pulse_sequences.values():
-            self._save_sequence_to_file(sequence)
+        with self._asset_store.batch():
+            for sequence in self.saved_pulse_sequences.values():
+                self._save_sequence_to_file(sequence)
+        return
+
+    def _import_pickled_assets(self):
+        """
+        Imports PulseBlock, PulseBlockEnsemble and PulseSequence instances serialized into separate
+        pickle files (.block, .ensemble, .sequence) by older versions into the asset store.
+        Imported files are moved into the subdirectory "imported_pickle_files" of the asset
+        storage directory, so each file is only imported once.
+        """
+        file_types = (('block', '.block', self._load_block_from_file),
+                      ('ensemble', '.ensemble', self._load_ensemble_from_file),
+                      ('sequence', '.sequence', self._load_sequence_from_file))
+        with os.scandir(self._assets_storage_dir) as scan:
+            filenames = [f.name for f in scan if f.is_file() and f.name.endswith(
+                tuple(ext for asset_type, ext, loader in file_types))]
+        if not filenames:
+            return
+
+        import_dir = os.path.join(self._assets_storage_dir, 'imported_pickle_files')
+        if not os.path.exists(import_dir):
+            os.makedirs(import_dir)
+
+        imported = 0
+        with self._asset_store.batch():
+            for asset_type, ext, loader in file_types:
+                names = natural_sort(f[:-len(ext)] for f in filenames if f.endswith(ext))
+                for name in names:
+                    asset = loader(name)
+                    if asset is None:
+                        continue
+                    self._asset_store.save(asset_type, asset)
+                    imported += 1
+                    os.replace(os.path.join(self._assets_storage_dir, name + ext),
+                               os.path.join(import_dir, name + ext))
+        self.log.info('Imported {0:d} pulse objects from pickle files into asset store "{1}". '
+                      'Moved the original files to "{2}".'
+                      ''.format(imported, self._asset_store.file_path, import_dir))
         return
 
     def generate_predefined_sequence(self, predefined_sequence_name, kwargs_dict):
@@ -1110,28 +1214,189 @@ class SequenceGeneratorLogic(GenericLogic):
             self.sigPredefinedSequenceGenerated.emit(None, False)
             return
 
-        # Save objects
-        for block in blocks:
-            self.save_block(block)
-        for ensemble in ensembles:
-            ensemble.sampling_information = dict()
-            self.save_ensemble(ensemble)
-
-        if self.pulse_generator_constraints.sequence_option == SequenceOption.FORCED and len(sequences) < 1:
-            self.log.info('Adding default sequence for: {0:s}'.format(predefined_sequence_name))
-            self._add_default_sequence(ensembles, sequences)
-            if len(sequences) > 0:
-                self.log.debug('New default PulseSequence is: {0:s} length {1:d}'
-                               ''.format(sequences[0].name, len(sequences)))
-
-        for sequence in sequences:
-            sequence.sampling_information = dict()
-            self.save_sequence(sequence)
+        # Save objects (written to the asset store all at once)
+        with self._asset_store.batch():
+            for block in blocks:
+                self.save_block(block)
+            for ensemble in ensembles:
+                ensemble.sampling_information = dict()
+                # Keep the waveform of an identical, already sampled PulseBlockEnsemble
+                self._reuse_sampled_ensemble(ensemble)
+                self.save_ensemble(ensemble)
+
+            if self.pulse_generator_constraints.sequence_option == SequenceOption.FORCED and len(sequences) < 1:
+                self.log.info('Adding default sequence for: {0:s}'.format(predefined_sequence_name))
+                self._add_default_sequence(ensembles, sequences)
+                if len(sequences) > 0:
+                    self.log.debug('New default PulseSequence is: {0:s} length {1:d}'
+                                   ''.format(sequences[0].name, len(sequences)))
+
+            for sequence in sequences:
+                sequence.sampling_information = dict()
+                self.save_sequence(sequence)
 
         created_name = gen_params.get('name') if 'name' not in kwargs_dict else kwargs_dict['name']
         self.sigPredefinedSequenceGenerated.emit(created_name, len(sequences) > 0)
         return
 
+    def _reuse_sampled_ensemble(self, ensemble):
+        """
+        Checks if a saved PulseBlockEnsemble by the same name has already been sampled from
+        identical content with identical pulse generator settings and if the associated waveforms
+        are still present on the device. If so, the sampling information (and the block list incl.
+        a possible idle extension block) of the saved ensemble is transferred to the given ensemble
+        so it does not need to be sampled again.
+
+        @param PulseBlockEnsemble ensemble: The (freshly generated) PulseBlockEnsemble instance
+        @return bool: True if the sampled waveform can be reused, False otherwise
+        """
+        old_ensemble = self._saved_pulse_block_ensembles.get(ensemble.name)
+        if old_ensemble is None or not old_ensemble.sampling_information.get('waveform_hash'):
+            return False
+        if any(name not in self._saved_pulse_blocks for name, reps in ensemble.block_list):
+            return False
+        if old_ensemble.sampling_information['waveform_hash'] != self._get_waveform_hash(ensemble):
+            return False
+        if not self._waveforms_present(old_ensemble.sampling_information.get('waveforms')):
+            return False
+        measurement_information = ensemble.measurement_information
+        ensemble.block_list = list(old_ensemble.block_list)
+        ensemble.measurement_information = measurement_information
+        ensemble.sampling_information = old_ensemble.sampling_information
+        self.log.debug('PulseBlockEnsemble "{0}" unchanged. Reusing sampled waveforms.'
+                       ''.format(ensemble.name))
+        return True
+
+    def _waveforms_present(self, waveforms):
+        """
+        Checks if all given waveform names are present on the pulse generator device.
+
+        @param list waveforms: list of waveform names
+        @return bool: True if all waveforms are present on the device (and list is not empty)
+        """
+        if not waveforms:
+            return False
+        return set(self.sampled_waveforms).issuperset(waveforms)
+
+    def _analyze_ensemble_for_sampling(self, ensemble):
+        """
+        Analyzes a PulseBlockEnsemble prior to sampling. If the number of samples does not match
+        the waveform length granularity of the pulse generator, the ensemble is extended by an
+        idle block.
+
+        @param PulseBlockEnsemble ensemble: The PulseBlockEnsemble instance to analyze
+        @return dict: ensemble_info dict as returned by analyze_block_ensemble
+        """
+        # get important parameters from the ensemble
+        ensemble_info = self.analyze_block_ensemble(ensemble)
+
+        # Make sure the length of the channel is a multiple of the step size.
+        # This is done by appending an idle block
+        granularity = self.pulse_generator_constraints.waveform_length.step
+        self.log.debug('length: {0}, mod {1}'.format(
+            ensemble_info['number_of_samples'], ensemble_info['number_of_samples'] % granularity))
+        if ensemble_info['number_of_samples'] % granularity != 0:
+            self.log.warn('Length {0} does not fulfil step constraint {1}.'.format(
+                ensemble_info['number_of_samples'], granularity))
+            # TODO: take care of rounding errors!
+            extension_samples = granularity - ensemble_info['number_of_samples'] % granularity
+            target_total_samples = ensemble_info['number_of_samples'] + extension_samples
+            extension_seconds = (target_total_samples / self.__sample_rate) - ensemble_info[
+                'ideal_length']
+
+            pb_element = PulseBlockElement(
+                init_length_s=extension_seconds,
+                increment_s=0,
+                pulse_function={chnl: SamplingFunctions.Idle() for chnl in self.analog_channels},
+                digital_high={chnl: False for chnl in self.digital_channels})
+            idle_extension = PulseBlock('idle_extension', element_list=[pb_element])
+            temp_measurement_info = copy.deepcopy(ensemble.measurement_information)
+            ensemble.append((idle_extension.name, 0))
+            ensemble.measurement_information = temp_measurement_info
+
+            self.save_block(idle_extension)
+            self.save_ensemble(ensemble)
+
+            # get important parameters from the ensemble
+            ensemble_info = self.analyze_block_ensemble(ensemble)
+            if ensemble_info['number_of_samples'] != target_total_samples:
+                self.log.error('Expanding the PulseBlockEnsemble to match the waveform granularity '
+                               'has failed.\nTarget number of samples was {0:d}.\nfinal number of '
+                               'samples is {1:d}.\nThis is probably due to a rounding error in '
+                               'SequenceGeneratorLogic.sample_pulse_block_ensemble.'
+                               ''.format(target_total_samples, ensemble_info['number_of_samples']))
+            else:
+                self.log.warn('Extending waveform {0} by {2} bins. New length {1}.'.format(
+                    ensemble.name, ensemble_info['number_of_samples'], extension_samples))
+        return ensemble_info
+
+    def _get_ensemble_sampler(self, ensemble, ensemble_info, offset_bin=0):
+        """
+        Creates the EnsembleSampler instance planning the sampling of a PulseBlockEnsemble.
+
+        @param PulseBlockEnsemble ensemble: The PulseBlockEnsemble instance to sample
+        @param dict ensemble_info: ensemble_info dict as returned by analyze_block_ensemble
+        @param int offset_bin: The time bin offset of the first sample (rotating frame)
+
+        @return EnsembleSampler: The sampler instance for this ensemble
+        """
+        return EnsembleSampler(
+            block_list=[(self.get_block(name), reps) for name, reps in ensemble.block_list],
+            elements_length_bins=ensemble_info['elements_length_bins'],
+            sample_rate=self.__sample_rate,
+            analog_norm={chnl: self.__analog_levels[0][chnl] / 2 for chnl in
+                         ensemble_info['analog_channels']},
+            digital_channels=ensemble_info['digital_channels'],
+            rotating_frame=ensemble.rotating_frame,
+            offset_bin=offset_bin,
+            phase_rotation=self._sampling_phase_rotation)
+
+    def _get_waveform_hash(self, ensemble, offset_bin=0):
+        """
+        Calculates a hash of everything that determines the samples of a PulseBlockEnsemble, i.e.
+        the ensemble itself, all referenced PulseBlocks, the pulse generator settings and the
+        laser/gate channel used to analyze the ensemble.
+        A trailing idle block added to match the waveform granularity is ignored since it is fully
+        determined by the remaining ensemble and the pulse generator settings.
+
+        @param PulseBlockEnsemble ensemble: The PulseBlockEnsemble instance to hash
+        @param int offset_bin: The time bin offset used for sampling (rotating frame)
+
+        @return str: hex digest of the hash
+        """
+        block_list = list(ensemble.block_list)
+        while block_list and block_list[-1][0] == 'idle_extension':
+            block_list.pop()
+
+        settings = self.pulse_generator_settings
+        hash_content = dict()
+        hash_content['name'] = ensemble.name
+        hash_content['rotating_frame'] = ensemble.rotating_frame
+        hash_content['offset_bin'] = int(offset_bin) if ensemble.rotating_frame else 0
+        hash_content['block_list'] = block_list
+        hash_content['blocks'] = {name: self._saved_pulse_blocks[name].get_dict_representation()
+                                  for name, reps in block_list}
+        hash_content['pulse_generator_settings'] = settings
+        hash_content['laser_channel'] = self.generation_parameters['gate_channel'] if \
+            self.generation_parameters['gate_channel'] else \
+            self.generation_parameters['laser_channel']
+        hash_content['granularity'] = self.pulse_generator_constraints.waveform_length.step
+        hash_content['phase_rotation'] = bool(self._sampling_phase_rotation)
+
+        def _encode(obj):
+            if isinstance(obj, (set, frozenset)):
+                return natural_sort(obj)
+            if isinstance(obj, np.generic):
+                return obj.item()
+            if isinstance(obj, np.ndarray):
+                # repr of large arrays is abbreviated. Hash the raw data instead.
+                return [str(obj.dtype), list(obj.shape),
+                        hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()]
+            return repr(obj)
+
+        serialized = json.dumps(hash_content, sort_keys=True, default=_encode)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
     def _add_default_sequence(self, ensembles, sequences):
         if not isinstance(ensembles, (list, tuple)) or len(ensembles) < 1:
             self.log.error('It is not possible to create a default sequence, '
@@ -1258,6 +1523,9 @@ class SequenceGeneratorLogic(GenericLogic):
         laser_channel = self.generation_parameters['gate_channel'] if self.generation_parameters[
             'gate_channel'] else self.generation_parameters['laser_channel']
 
+        # Get the stored PulseBlock instances
+        block_list = [(self.get_block(block_name), reps) for block_name, reps in ensemble]
+
         # memorize the digital channel state of the previous element
         tmp_digital_high = dict()
         # memorize the laser_on flag of the previous element (in case of non-digital laser channel)
@@ -1267,11 +1535,11 @@ class SequenceGeneratorLogic(GenericLogic):
         analog_channels = set()
         # check for active channels and initialize tmp_digital_high/tmp_laser_on with the state of
         # the very last element in the ensemble
-        if len(ensemble) > 0:
-            block = self.get_block(ensemble[0][0])
+        if len(block_list) > 0:
+            block = block_list[0][0]
             digital_channels = block.digital_channels
             analog_channels = block.analog_channels
-            block = self.get_block(ensemble[-1][0])
+            block = block_list[-1][0]
             if len(block) > 0:
                 tmp_digital_high = block[-1].digital_high.copy()
                 tmp_laser_on = block[-1].laser_on
@@ -1279,73 +1547,73 @@ class SequenceGeneratorLogic(GenericLogic):
                 tmp_digital_high = {chnl: False for chnl in digital_channels}
                 tmp_laser_on = False
 
-        # dicts containing the bins where the digital channels are rising/falling
-        digital_rising_bins = {chnl: list() for chnl in digital_channels}
-        digital_falling_bins = {chnl: list() for chnl in digital_channels}
-        laser_rising_bins = list()
-        laser_falling_bins = list()
+        # Expand the memoized element tables of all blocks arithmetically by their repetitions.
+        # The element durations (incl. length increments per repetition) are accumulated in the
+        # same order as they occur in the waveform later on.
+        element_durations = list()
+        element_laser_on = list()
+        element_digital_high = {chnl: list() for chnl in digital_channels}
+        for block, reps in block_list:
+            if len(block) == 0:
+                continue
+            table = block.get_element_table()
+            rep_no = np.arange(reps + 1, dtype='float64')
+            element_durations.append(
+                (table['init_length_s'] + np.multiply.outer(rep_no, table['increment_s'])).ravel())
+            element_laser_on.append(np.tile(table['laser_on'], reps + 1))
+            for chnl in digital_channels:
+                element_digital_high[chnl].append(np.tile(table['digital_high'][chnl], reps + 1))
+
+        if element_durations:
+            # Ideal end time of each element and the nearest possible match in discrete bins
+            element_end_times = np.cumsum(np.concatenate(element_durations))
+            element_end_bins = np.rint(element_end_times * self.__sample_rate).astype('int64')
+            current_end_time = element_end_times[-1]
+        else:
+            element_end_bins = np.empty(0, dtype='int64')
+            current_end_time = 0.0
 
         # Array to store the length in bins for all elements including repetitions in the order
         # they are occuring in the waveform later on.
-        elements_length_bins = list()
-
-        # variables to keep track of the current timeframe
-        current_end_time = 0.0
-        current_start_bin = 0
-
-        # Loop through all blocks in the ensemble
-        for block_name, reps in ensemble:
-            # Get the stored PulseBlock instance
-            block = self.get_block(block_name)
-
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the Block_Elements inside the current block
-                for element in block:
-                    # save bin position if a transition from low to high or vice versa has occurred
-                    # in a digital channel
-                    if tmp_digital_high != element.digital_high:
-                        for chnl, state in element.digital_high.items():
-                            if not tmp_digital_high[chnl] and state:
-                                digital_rising_bins[chnl].append(current_start_bin)
-                            elif tmp_digital_high[chnl] and not state:
-                                digital_falling_bins[chnl].append(current_start_bin)
-                        tmp_digital_high = element.digital_high.copy()
-
-                    if not laser_channel.startswith('d') and tmp_laser_on != element.laser_on:
-                        if not tmp_laser_on and element.laser_on:
-                            laser_rising_bins.append(current_start_bin)
-                        else:
-                            laser_falling_bins.append(current_start_bin)
-                        tmp_laser_on = element.laser_on
-
-                    # Calculate length of the current element with current repetition count in sec
-                    # and add this to the ideal end time for the sequence up until this point.
-                    current_end_time += element.init_length_s + rep_no * element.increment_s
-
-                    # Nearest possible match including the discretization in bins
-                    current_end_bin = int(np.rint(current_end_time * self.__sample_rate))
-
-                    # append current element length in discrete bins to temporary array
-                    elements_length_bins.append(current_end_bin - current_start_bin)
-
-                    # advance bin offset for next element
-                    current_start_bin = current_end_bin
-
-        elements_length_bins = np.array(elements_length_bins, dtype='int64')
-
-        # convert rising/falling indices to numpy.ndarrays. Remove duplicates.
+        elements_length_bins = np.diff(np.concatenate(([0], element_end_bins)))
+        elements_start_bins = element_end_bins - elements_length_bins
+
+        # Element start bins are sorted unless there are elements with negative length
+        start_bins_sorted = np.all(elements_length_bins >= 0)
+
+        def _get_transition_bins(states, previous_state):
+            # Sorted start bins of all elements changing the state (low-to-high, high-to-low)
+            previous_states = np.empty_like(states)
+            if len(states) > 0:
+                previous_states[0] = previous_state
+                previous_states[1:] = states[:-1]
+            transition_bins = list()
+            for transitions in (states & ~previous_states, previous_states & ~states):
+                bins = elements_start_bins[transitions]
+                if start_bins_sorted:
+                    bins = bins[np.diff(np.concatenate(([-1], bins))) != 0]
+                else:
+                    bins = np.unique(bins)
+                transition_bins.append(bins)
+            return tuple(transition_bins)
+
+        # dicts containing the bins where the digital channels are rising/falling (duplicates
+        # removed)
+        digital_rising_bins = dict()
+        digital_falling_bins = dict()
         for chnl in digital_channels:
-            digital_rising_bins[chnl] = sorted(set(digital_rising_bins[chnl]))
-            digital_falling_bins[chnl] = sorted(set(digital_falling_bins[chnl]))
-            digital_rising_bins[chnl] = np.array(digital_rising_bins[chnl], dtype='int64')
-            digital_falling_bins[chnl] = np.array(digital_falling_bins[chnl], dtype='int64')
+            states = np.concatenate(element_digital_high[chnl]) if element_digital_high[
+                chnl] else np.empty(0, dtype=bool)
+            digital_rising_bins[chnl], digital_falling_bins[chnl] = _get_transition_bins(
+                states, bool(tmp_digital_high[chnl]))
         if laser_channel.startswith('d'):
             laser_rising_bins = digital_rising_bins[laser_channel]
             laser_falling_bins = digital_falling_bins[laser_channel]
         else:
-            laser_rising_bins = np.array(sorted(set(laser_rising_bins)), dtype='int64')
-            laser_falling_bins = np.array(sorted(set(laser_falling_bins)), dtype='int64')
+            states = np.concatenate(element_laser_on) if element_laser_on else np.empty(0,
+                                                                                        dtype=bool)
+            laser_rising_bins, laser_falling_bins = _get_transition_bins(states,
+                                                                         bool(tmp_laser_on))
 
         return_dict = dict()
         return_dict['number_of_samples'] = np.sum(elements_length_bins)
@@ -1439,6 +1707,7 @@ class SequenceGeneratorLogic(GenericLogic):
         digital_rising_bins = {chnl: list() for chnl in digital_channels}
         digital_falling_bins = {chnl: list() for chnl in digital_channels}
         ensemble_name_set = set()
+        ensemble_info_dicts = dict()
         # Initialize the last channel state of the first sequence step as last channel state in the
         # entire sequence.
         step_last_digital_state = last_digital_channel_state
@@ -1448,8 +1717,11 @@ class SequenceGeneratorLogic(GenericLogic):
             is_finite = seq_step.repetitions >= 0
             # Get the PulseBlockEnsemble instance associated with this sequence step
             ensemble = self.get_ensemble(seq_step.ensemble)
-            # Get information about the current PulseBlockEnsemble instance
-            info_dict = self.analyze_block_ensemble(ensemble=ensemble)
+            # Get information about the current PulseBlockEnsemble instance. Each ensemble is
+            # only analyzed once, even if it is used in several sequence steps.
+            if ensemble.name not in ensemble_info_dicts:
+                ensemble_info_dicts[ensemble.name] = self.analyze_block_ensemble(ensemble=ensemble)
+            info_dict = ensemble_info_dicts[ensemble.name]
             # Set tmp helper variables
             ensemble_name_set.add(ensemble.name)
             reps = seq_step.repetitions + 1
@@ -1480,44 +1752,32 @@ class SequenceGeneratorLogic(GenericLogic):
                     # Append rising/falling bin arrays for each step to a list in order to merge
                     # them all later on into a single array. This is more efficient than having
                     # an intermediate array.
-                    # Pay special attention to transitions from one sequence step to another.
-                    for iteration in range(reps):
-                        bin_offset = iteration * ens_bins + starting_bin
-                        rising_bins = info_dict['digital_rising_bins'][chnl] + bin_offset
-                        falling_bins = info_dict['digital_falling_bins'][chnl] + bin_offset
-                        if iteration == 0 and prev_step_digital_state[chnl] != step_last_digital_state[chnl]:
-                            if prev_step_digital_state[chnl] and not step_first_digital_state[chnl]:
-                                falling_bins = np.append(bin_offset, falling_bins)
-                            elif not prev_step_digital_state[chnl] and step_first_digital_state[chnl]:
-                                rising_bins = np.append(bin_offset, rising_bins)
-                            elif prev_step_digital_state[chnl] == step_first_digital_state[chnl]:
-                                if step_last_digital_state[chnl]:
-                                    falling_bins = falling_bins[1:]
-                                else:
-                                    rising_bins = rising_bins[1:]
-
-                        digital_rising_bins[chnl].append(rising_bins)
-                        digital_falling_bins[chnl].append(falling_bins)
+                    rising_bins, falling_bins = self._get_step_transition_bins(
+                        rising_bins=info_dict['digital_rising_bins'][chnl],
+                        falling_bins=info_dict['digital_falling_bins'][chnl],
+                        starting_bin=starting_bin,
+                        ensemble_bins=ens_bins,
+                        repetitions=reps,
+                        prev_step_state=prev_step_digital_state[chnl],
+                        step_first_state=step_first_digital_state[chnl],
+                        step_last_state=step_last_digital_state[chnl])
+                    digital_rising_bins[chnl].append(rising_bins)
+                    digital_falling_bins[chnl].append(falling_bins)
 
                 # Append laser_bins arrays with bin offsets for each repetition analogous to the
                 # digital channels above.
                 if not laser_channel.startswith('d'):
-                    for iteration in range(reps):
-                        bin_offset = iteration * ens_bins + starting_bin
-                        rising_bins = info_dict['laser_rising_bins'] + bin_offset
-                        falling_bins = info_dict['laser_falling_bins'] + bin_offset
-                        if iteration == 0 and prev_step_laser_on_state != step_last_laser_on_state:
-                            if prev_step_laser_on_state and not step_first_laser_on_state:
-                                falling_bins = np.append(bin_offset, falling_bins)
-                            elif not prev_step_laser_on_state and step_first_laser_on_state:
-                                rising_bins = np.append(bin_offset, rising_bins)
-                            elif prev_step_laser_on_state == step_first_laser_on_state:
-                                if step_last_laser_on_state:
-                                    falling_bins = falling_bins[1:]
-                                else:
-                                    rising_bins = rising_bins[1:]
-                        laser_rising_bins.append(rising_bins)
-                        laser_falling_bins.append(falling_bins)
+                    rising_bins, falling_bins = self._get_step_transition_bins(
+                        rising_bins=info_dict['laser_rising_bins'],
+                        falling_bins=info_dict['laser_falling_bins'],
+                        starting_bin=starting_bin,
+                        ensemble_bins=ens_bins,
+                        repetitions=reps,
+                        prev_step_state=prev_step_laser_on_state,
+                        step_first_state=step_first_laser_on_state,
+                        step_last_state=step_last_laser_on_state)
+                    laser_rising_bins.append(rising_bins)
+                    laser_falling_bins.append(falling_bins)
 
                 # Increment the current starting bin offset for the next sequence step
                 starting_bin += ens_bins * reps
@@ -1579,6 +1839,51 @@ class SequenceGeneratorLogic(GenericLogic):
 
         return return_dict
 
+    @staticmethod
+    def _get_step_transition_bins(rising_bins, falling_bins, starting_bin, ensemble_bins,
+                                  repetitions, prev_step_state, step_first_state, step_last_state):
+        """
+        Expands the rising/falling bins of a PulseBlockEnsemble to all repetitions of a sequence
+        step. This results in rising and falling bins representing the real-time signal with all
+        repetitions taken into account. Pays special attention to the transition from the
+        previous sequence step to the first repetition.
+
+        @param numpy.ndarray rising_bins: rising bins of the ensemble
+        @param numpy.ndarray falling_bins: falling bins of the ensemble
+        @param int starting_bin: bin offset of the sequence step
+        @param int ensemble_bins: number of bins of the ensemble
+        @param int repetitions: number of times the ensemble is played in this step
+        @param bool prev_step_state: channel state at the end of the previous step
+        @param bool step_first_state: channel state of the first element of the ensemble
+        @param bool step_last_state: channel state of the last element of the ensemble
+
+        @return (numpy.ndarray, numpy.ndarray): rising bins, falling bins (not sorted)
+        """
+        if repetitions < 1:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+
+        # First repetition
+        first_rising_bins = rising_bins + starting_bin
+        first_falling_bins = falling_bins + starting_bin
+        if prev_step_state != step_last_state:
+            if prev_step_state and not step_first_state:
+                first_falling_bins = np.append(starting_bin, first_falling_bins)
+            elif not prev_step_state and step_first_state:
+                first_rising_bins = np.append(starting_bin, first_rising_bins)
+            elif prev_step_state == step_first_state:
+                if step_last_state:
+                    first_falling_bins = first_falling_bins[1:]
+                else:
+                    first_rising_bins = first_rising_bins[1:]
+
+        # All following repetitions are just shifted by the ensemble length
+        bin_offsets = starting_bin + ensemble_bins * np.arange(1, repetitions, dtype='int64')
+        rising_bins = np.concatenate(
+            (first_rising_bins, np.add.outer(bin_offsets, rising_bins).ravel()))
+        falling_bins = np.concatenate(
+            (first_falling_bins, np.add.outer(bin_offsets, falling_bins).ravel()))
+        return rising_bins.astype('int64'), falling_bins.astype('int64')
+
     def _sampling_ensemble_sanity_check(self, ensemble):
         blocks_missing = set()
         channel_activation_mismatch = False
@@ -1647,9 +1952,10 @@ class SequenceGeneratorLogic(GenericLogic):
 
         This method is creating the actual samples (voltages and logic states) for each time step
         of the analog and digital channels specified in the PulseBlockEnsemble.
-        Therefore it iterates through all blocks, repetitions and elements of the ensemble and
-        calculates the exact voltages (float64) according to the specified math_function. The
-        samples are later on stored inside a float32 array.
+        Therefore the whole ensemble (all blocks, repetitions and elements) is planned once by an
+        EnsembleSampler instance which calculates the exact voltages (float64) according to the
+        specified math_function. All elements sharing the same sampling function are evaluated
+        together. The samples are later on stored inside a float32 array.
         So each element is calculated with high precision (float64) and then down-converted to
         float32 to be stored.
 
@@ -1660,7 +1966,9 @@ class SequenceGeneratorLogic(GenericLogic):
 
         The chunkwise write mode is used to save memory usage at the expense of time.
         In other words: The whole sample arrays are never created at any time. This results in more
-        function calls and general overhead causing much longer time to complete.
+        function calls and general overhead causing much longer time to complete. To compensate
+        for that, the next chunk is sampled in a background thread while the current chunk is
+        written to the device (the memory overhead is split between both chunk buffers).
 
         In addition the pulse_block_ensemble gets analyzed and important parameters used during
         sampling get stored in the ensemble object "sampling_information" attribute.
@@ -1690,53 +1998,33 @@ class SequenceGeneratorLogic(GenericLogic):
         # Set the waveform name (excluding the device specific channel naming suffix, i.e. '_ch1')
         waveform_name = name_tag if name_tag else ensemble.name
 
+        # Skip sampling if the very same waveform has already been sampled and is still present
+        # on the device.
+        waveform_hash = self._get_waveform_hash(ensemble, offset_bin)
+        if waveform_name == ensemble.name and \
+                ensemble.sampling_information.get('waveform_hash') == waveform_hash and \
+                self._waveforms_present(ensemble.sampling_information.get('waveforms')):
+            self.log.info('PulseBlockEnsemble "{0}" has not changed since last sampling. Reusing '
+                          'waveforms already present on the device.'.format(ensemble.name))
+            ensemble_info = ensemble.sampling_information.copy()
+            del ensemble_info['pulse_generator_settings']
+            del ensemble_info['waveform_hash']
+            if ensemble.rotating_frame:
+                offset_bin += ensemble_info['number_of_samples']
+            if not self.__sequence_generation_in_progress:
+                self.module_state.unlock()
+            self.sigSampleEnsembleComplete.emit(ensemble)
+            return offset_bin, list(ensemble_info['waveforms']), ensemble_info
+
         # check for old waveforms associated with the ensemble and delete them from pulse generator.
         self._delete_waveform_by_nametag(waveform_name)
 
         # Take current time
         start_time = time.time()
 
-        # get important parameters from the ensemble
-        ensemble_info = self.analyze_block_ensemble(ensemble)
-
-        # Make sure the length of the channel is a multiple of the step size.
-        # This is done by appending an idle block
-        granularity = self.pulse_generator_constraints.waveform_length.step
-        self.log.debug('length: {0}, mod {1}'.format(
-            ensemble_info['number_of_samples'], ensemble_info['number_of_samples'] % granularity))
-        if ensemble_info['number_of_samples'] % granularity != 0:
-            self.log.warn('Length {0} does not fulfil step constraint {1}.'.format(
-                ensemble_info['number_of_samples'], granularity))
-            # TODO: take care of rounding errors!
-            extension_samples = granularity - ensemble_info['number_of_samples'] % granularity
-            target_total_samples = ensemble_info['number_of_samples'] + extension_samples
-            extension_seconds = (target_total_samples / self.__sample_rate) - ensemble_info[
-                'ideal_length']
-
-            pb_element = PulseBlockElement(
-                init_length_s=extension_seconds,
-                increment_s=0,
-                pulse_function={chnl: SamplingFunctions.Idle() for chnl in self.analog_channels},
-                digital_high={chnl: False for chnl in self.digital_channels})
-            idle_extension = PulseBlock('idle_extension', element_list=[pb_element])
-            temp_measurement_info = copy.deepcopy(ensemble.measurement_information)
-            ensemble.append((idle_extension.name, 0))
-            ensemble.measurement_information = temp_measurement_info
-
-            self.save_block(idle_extension)
-            self.save_ensemble(ensemble)
-
-            # get important parameters from the ensemble
-            ensemble_info = self.analyze_block_ensemble(ensemble)
-            if ensemble_info['number_of_samples'] != target_total_samples:
-                self.log.error('Expanding the PulseBlockEnsemble to match the waveform granularity '
-                               'has failed.\nTarget number of samples was {0:d}.\nfinal number of '
-                               'samples is {1:d}.\nThis is probably due to a rounding error in '
-                               'SequenceGeneratorLogic.sample_pulse_block_ensemble.'
-                               ''.format(target_total_samples, ensemble_info['number_of_samples']))
-            else:
-                self.log.warn('Extending waveform {0} by {2} bins. New length {1}.'.format(
-                    ensemble.name, ensemble_info['number_of_samples'], extension_samples))
+        # get important parameters from the ensemble (extend it to match the waveform granularity
+        # if necessary)
+        ensemble_info = self._analyze_ensemble_for_sampling(ensemble)
 
         # Calculate the byte size per sample.
         # One analog sample per channel is 4 bytes (np.float32) and one digital sample per channel
@@ -1748,19 +2036,27 @@ class SequenceGeneratorLogic(GenericLogic):
         bytes_per_ensemble = bytes_per_sample * ensemble_info['number_of_samples']
 
         # Determine the size of the sample arrays to be written as a whole.
+        # If the ensemble needs to be written in several chunks, two sets of sample arrays are
+        # used (each with half of the memory overhead) in order to sample the next chunk while the
+        # current one is written to the device.
         if bytes_per_ensemble <= self._overhead_bytes or self._overhead_bytes == 0:
             array_length = ensemble_info['number_of_samples']
+            number_of_buffers = 1
         else:
-            array_length = self._overhead_bytes // bytes_per_sample
+            number_of_buffers = 2
+            array_length = max(self._overhead_bytes // (number_of_buffers * bytes_per_sample), 1)
 
         # Allocate the sample arrays that are used for a single write command
-        analog_samples = dict()
-        digital_samples = dict()
+        sample_buffers = list()
         try:
-            for chnl in ensemble_info['analog_channels']:
-                analog_samples[chnl] = np.empty(array_length, dtype='float32')
-            for chnl in ensemble_info['digital_channels']:
-                digital_samples[chnl] = np.empty(array_length, dtype=bool)
+            for buffer_no in range(number_of_buffers):
+                analog_samples = dict()
+                digital_samples = dict()
+                for chnl in ensemble_info['analog_channels']:
+                    analog_samples[chnl] = np.empty(array_length, dtype='float32')
+                for chnl in ensemble_info['digital_channels']:
+                    digital_samples[chnl] = np.empty(array_length, dtype=bool)
+                sample_buffers.append((analog_samples, digital_samples))
         except MemoryError:
             self.log.error('Sampling of PulseBlockEnsemble "{0}" failed due to a MemoryError.\n'
                            'The sample array needed is too large to allocate in memory.\n'
@@ -1771,105 +2067,59 @@ class SequenceGeneratorLogic(GenericLogic):
             self.sigSampleEnsembleComplete.emit(None)
             return -1, list(), dict()
 
+        # Plan the sampling of the entire ensemble. Elements sharing the same sampling function
+        # are evaluated together and digital channels are filled by run-length expansion.
+        sampler = self._get_ensemble_sampler(ensemble, ensemble_info, offset_bin)
+
         # integer to keep track of the sampls already processed
         processed_samples = 0
-        # Index to keep track of the samples written into the preallocated samples array
-        array_write_index = 0
-        # Keep track of the number of elements already written
-        element_count = 0
         # set of written waveform names on the device
         written_waveforms = set()
-        # Iterate over all blocks within the PulseBlockEnsemble object
-        for block_name, reps in ensemble.block_list:
-            block = self.get_block(block_name)
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the PulseBlockElement instances inside the current block
-                for element in block.element_list:
-                    digital_high = element.digital_high
-                    pulse_function = element.pulse_function
-                    element_length_bins = ensemble_info['elements_length_bins'][element_count]
-
-                    # Indicator on how many samples of this element have been written already
-                    element_samples_written = 0
-
-                    while element_samples_written != element_length_bins:
-                        samples_to_add = min(array_length - array_write_index,
-                                             element_length_bins - element_samples_written)
-                        # create floating point time array for the current element inside rotating
-                        # frame if analog samples are to be calculated.
-                        if pulse_function:
-                            time_arr = (offset_bin + np.arange(
-                                samples_to_add, dtype='float64')) / self.__sample_rate
-
-                        # Calculate respective part of the sample arrays
-                        for chnl in digital_high:
-                            digital_samples[chnl][array_write_index:array_write_index + samples_to_add] = digital_high[
-                                chnl]
-                        for chnl in pulse_function:
-                            analog_samples[chnl][array_write_index:array_write_index + samples_to_add] = pulse_function[
-                                                                                                             chnl].get_samples(
-                                time_arr) / (self.__analog_levels[0][chnl] / 2)
-
-                        # Free memory
-                        if pulse_function:
-                            del time_arr
-
-                        element_samples_written += samples_to_add
-                        array_write_index += samples_to_add
-                        processed_samples += samples_to_add
-                        # if the rotating frame should be preserved (default) increment the offset
-                        # counter for the time array.
-                        if ensemble.rotating_frame:
-                            offset_bin += samples_to_add
-
-                        # Check if the temporary sample array is full and write to the device if so.
-                        if array_write_index == array_length:
-                            # Set first/last chunk flags
-                            is_first_chunk = array_write_index == processed_samples
-                            is_last_chunk = processed_samples == ensemble_info['number_of_samples']
-                            written_samples, wfm_list = self.pulsegenerator().write_waveform(
-                                name=waveform_name,
-                                analog_samples=analog_samples,
-                                digital_samples=digital_samples,
-                                is_first_chunk=is_first_chunk,
-                                is_last_chunk=is_last_chunk,
-                                total_number_of_samples=ensemble_info['number_of_samples'])
-
-                            # Update written waveforms set
-                            written_waveforms.update(wfm_list)
-
-                            # check if write process was successful
-                            if written_samples != array_length:
-                                self.log.error('Sampling of block "{0}" in ensemble "{1}" failed. '
-                                               'Write to device was unsuccessful.\nThe number of '
-                                               'actually written samples ({2:d}) does not match '
-                                               'the number of samples staged to write ({3:d}).'
-                                               ''.format(block_name, ensemble.name, written_samples,
-                                                         array_length))
-                                if not self.__sequence_generation_in_progress:
-                                    self.module_state.unlock()
-                                self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
-                                self.sigSampleEnsembleComplete.emit(None)
-                                return -1, list(), dict()
-
-                            # Reset array write start pointer
-                            array_write_index = 0
-
-                            # check if the temporary write array needs to be truncated for the next
-                            # part. (because it is the last part of the ensemble to write which can
-                            # be shorter than the previous chunks)
-                            if array_length > ensemble_info['number_of_samples'] - processed_samples:
-                                array_length = ensemble_info['number_of_samples'] - processed_samples
-                                analog_samples = dict()
-                                digital_samples = dict()
-                                for chnl in ensemble_info['analog_channels']:
-                                    analog_samples[chnl] = np.empty(array_length, dtype='float32')
-                                for chnl in ensemble_info['digital_channels']:
-                                    digital_samples[chnl] = np.empty(array_length, dtype=bool)
-
-                    # Increment element index
-                    element_count += 1
+        # Sample and write the ensemble chunk by chunk. The next chunk is sampled in the background
+        # while the current one is written (if more than one sample buffer is available).
+        chunks = iter(ChunkPipeline(sampler=sampler,
+                                    buffers=sample_buffers,
+                                    chunk_length=array_length))
+        try:
+            for analog_samples, digital_samples in chunks:
+                # The last chunk can be shorter than the previous chunks
+                chunk_length = min(array_length,
+                                   ensemble_info['number_of_samples'] - processed_samples)
+                processed_samples += chunk_length
+
+                # Set first/last chunk flags
+                is_first_chunk = chunk_length == processed_samples
+                is_last_chunk = processed_samples == ensemble_info['number_of_samples']
+                written_samples, wfm_list = self.pulsegenerator().write_waveform(
+                    name=waveform_name,
+                    analog_samples=analog_samples,
+                    digital_samples=digital_samples,
+                    is_first_chunk=is_first_chunk,
+                    is_last_chunk=is_last_chunk,
+                    total_number_of_samples=ensemble_info['number_of_samples'])
+
+                # Update written waveforms set
+                written_waveforms.update(wfm_list)
+
+                # check if write process was successful
+                if written_samples != chunk_length:
+                    self.log.error('Sampling of PulseBlockEnsemble "{0}" failed. Write to device '
+                                   'was unsuccessful.\nThe number of actually written samples '
+                                   '({1:d}) does not match the number of samples staged to write '
+                                   '({2:d}).'.format(ensemble.name, written_samples, chunk_length))
+                    if not self.__sequence_generation_in_progress:
+                        self.module_state.unlock()
+                    self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+                    self.sigSampleEnsembleComplete.emit(None)
+                    return -1, list(), dict()
+        finally:
+            # Stop sampling in the background if the write process has been aborted
+            chunks.close()
+
+        # if the rotating frame should be preserved (default) increment the offset counter for the
+        # next ensemble.
+        if ensemble.rotating_frame:
+            offset_bin += processed_samples
 
         # Save sampling related parameters to the sampling_information container within the
         # PulseBlockEnsemble.
@@ -1880,6 +2130,7 @@ class SequenceGeneratorLogic(GenericLogic):
             ensemble.sampling_information.update(ensemble_info)
             ensemble.sampling_information['pulse_generator_settings'] = self.pulse_generator_settings
             ensemble.sampling_information['waveforms'] = natural_sort(written_waveforms)
+            ensemble.sampling_information['waveform_hash'] = waveform_hash
             self.save_ensemble(ensemble)
 
         self.log.info('Time needed for sampling and writing PulseBlockEnsemble {0} to device: {1} sec'
@@ -1958,6 +2209,21 @@ class SequenceGeneratorLogic(GenericLogic):
         #           (('waveform3', 'waveform4'), seq_param_dict2)]
         sequence_param_dict_list = list()
 
+        # Sample all distinct PulseBlockEnsembles in parallel worker processes if requested.
+        # This is only possible without rotating frame since otherwise each ensemble depends on
+        # the offset of its predecessor. The loop below will find them already sampled.
+        if self._sampling_processes > 1 and not sequence.rotating_frame:
+            ensembles_to_sample = OrderedDict()
+            for seq_step in sequence:
+                ensemble = self.get_ensemble(seq_step.ensemble)
+                if ensemble.name in ensembles_to_sample:
+                    continue
+                if not ensemble.sampling_information or ensemble.sampling_information[
+                        'pulse_generator_settings'] != self.pulse_generator_settings:
+                    ensembles_to_sample[ensemble.name] = ensemble
+            if len(ensembles_to_sample) > 1:
+                self._sample_ensembles_parallel(list(ensembles_to_sample.values()))
+
         # if all the Pulse_Block_Ensembles should be in the rotating frame, then each ensemble
         # will be created in general with a different offset_bin. Therefore, in order to keep track
         # of the sampled Pulse_Block_Ensembles one has to introduce a running number as an
@@ -2038,6 +2304,111 @@ class SequenceGeneratorLogic(GenericLogic):
         self.sigSampleSequenceComplete.emit(sequence)
         return
 
+    def _sample_ensembles_parallel(self, ensembles):
+        """
+        Samples several PulseBlockEnsembles (without rotating frame) concurrently in a pool of
+        worker processes. Each ensemble is sampled as a whole into a shared memory buffer. The
+        resulting waveforms are written to the pulse generator from this thread in the order of
+        the given list as soon as the respective samples are available.
+
+        Ensembles too large for the configured overhead_bytes, already present on the device or
+        failing to sample in a worker process are skipped and left to serial sampling.
+
+        @param list ensembles: list of PulseBlockEnsemble instances to sample
+
+        @return set: names of the successfully sampled PulseBlockEnsembles
+        """
+        sampled_ensembles = set()
+        start_time = time.time()
+
+        # Prepare all ensembles in this thread (analysis and granularity extension)
+        jobs = list()
+        for ensemble in ensembles:
+            if self._sampling_ensemble_sanity_check(ensemble) < 0:
+                continue
+            waveform_hash = self._get_waveform_hash(ensemble)
+            if ensemble.sampling_information.get('waveform_hash') == waveform_hash and \
+                    self._waveforms_present(ensemble.sampling_information.get('waveforms')):
+                continue
+            self._delete_waveform_by_nametag(ensemble.name)
+            ensemble_info = self._analyze_ensemble_for_sampling(ensemble)
+            sampler = self._get_ensemble_sampler(ensemble, ensemble_info)
+            buffer_size = get_sample_buffer_size(sampler)
+            if buffer_size == 0 or 0 < self._overhead_bytes < buffer_size:
+                continue
+            jobs.append((ensemble, ensemble_info, sampler, waveform_hash))
+
+        if len(jobs) < 1:
+            return sampled_ensembles
+
+        # Keep only a limited number of shared memory buffers allocated at the same time
+        max_pending = 2 * self._sampling_processes
+        pending = list()
+        job_iter = iter(jobs)
+        executor = ProcessPoolExecutor(max_workers=self._sampling_processes,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_sampling_worker,
+                                       initargs=(self._sampling_functions_path_list,))
+        try:
+            while True:
+                # Submit new jobs until the maximum number of pending jobs is reached
+                for ensemble, ensemble_info, sampler, waveform_hash in job_iter:
+                    shm = shared_memory.SharedMemory(create=True,
+                                                     size=get_sample_buffer_size(sampler))
+                    future = executor.submit(sample_to_shared_memory, sampler, shm.name)
+                    pending.append((future, shm, ensemble, ensemble_info, sampler, waveform_hash))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+
+                # Write the oldest job to the device as soon as it is finished
+                future, shm, ensemble, ensemble_info, sampler, waveform_hash = pending.pop(0)
+                try:
+                    try:
+                        rendered_samples = future.result()
+                    except Exception:
+                        self.log.exception('Parallel sampling of PulseBlockEnsemble "{0}" failed.'
+                                           ''.format(ensemble.name))
+                        continue
+                    if rendered_samples != ensemble_info['number_of_samples']:
+                        continue
+                    analog_samples, digital_samples = get_sample_arrays(shm.buf, sampler)
+                    written_samples, wfm_list = self.pulsegenerator().write_waveform(
+                        name=ensemble.name,
+                        analog_samples=analog_samples,
+                        digital_samples=digital_samples,
+                        is_first_chunk=True,
+                        is_last_chunk=True,
+                        total_number_of_samples=ensemble_info['number_of_samples'])
+                    del analog_samples, digital_samples
+                    if written_samples != ensemble_info['number_of_samples']:
+                        self.log.error('Writing PulseBlockEnsemble "{0}" to device failed.'
+                                       ''.format(ensemble.name))
+                        continue
+                finally:
+                    shm.close()
+                    shm.unlink()
+
+                ensemble.sampling_information = dict()
+                ensemble.sampling_information.update(ensemble_info)
+                ensemble.sampling_information['pulse_generator_settings'] = self.pulse_generator_settings
+                ensemble.sampling_information['waveforms'] = natural_sort(wfm_list)
+                ensemble.sampling_information['waveform_hash'] = waveform_hash
+                self.save_ensemble(ensemble)
+                sampled_ensembles.add(ensemble.name)
+        finally:
+            executor.shutdown(wait=True)
+            for future, shm, *_ in pending:
+                shm.close()
+                shm.unlink()
+
+        self.log.info('Time needed for parallel sampling and writing of {0:d} PulseBlockEnsembles '
+                      'to device: {1} sec'.format(len(sampled_ensembles),
+                                                  int(np.rint(time.time() - start_time))))
+        self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+        return sampled_ensembles
+
     def _delete_waveform(self, names):
         if isinstance(names, str):
             names = [names]
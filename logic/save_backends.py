@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the binary file backends of the Qudi SaveLogic.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import abc
+import json
+import operator
+import os
+import struct
+import threading
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+METADATA_VERSION = 1
+
+
+def json_default(obj):
+    """
+    Fallback for json.dump(s) converting numpy arrays/scalars, sets and tuples into JSON types and
+    any other object into its string representation.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def _split_column_names(name, num_columns):
+    """
+    Splits the data dict key of a 2D array (e.g. 'Frequency (MHz), Counts') into column names.
+    Generic names are used if the number of names does not match the number of columns.
+    """
+    names = [col.strip() for col in name.split(',')]
+    if len(names) != num_columns or len(set(names)) != num_columns:
+        names = ['{0} [{1:d}]'.format(name, i) for i in range(num_columns)]
+    return names
+
+
+def build_metadata(data, module_name, timestamp, parameters=None):
+    """
+    Creates the metadata shared by all binary save backends.
+
+    The metadata is a JSON serializable dict with the keys
+        "metadata_version": version of this schema
+        "module": name of the module that saved the data
+        "timestamp": ISO formatted time of the measurement
+        "parameters": measurement parameters (name: value)
+        "arrays": one entry per data array with "name" (data dict key), "key" (name of the array
+                  in the file), "shape", "dtype" and "columns" (column names of 1D/2D arrays)
+
+    @param dict data: data arrays to save (name: numpy.ndarray)
+    @param str module_name: name of the module that saved the data
+    @param datetime.datetime timestamp: time of the measurement
+    @param dict parameters: optional, measurement parameters
+
+    @return dict: metadata
+    """
+    arrays = list()
+    for index, (name, arr) in enumerate(data.items()):
+        if arr.ndim == 2:
+            columns = _split_column_names(name, arr.shape[1])
+        else:
+            columns = [name]
+        arrays.append({'name': name,
+                       'key': 'data{0:d}'.format(index),
+                       'shape': list(arr.shape),
+                       'dtype': arr.dtype.str,
+                       'columns': columns})
+    if parameters is None:
+        parameters = dict()
+    elif not isinstance(parameters, dict):
+        parameters = {'not specified parameters': str(parameters)}
+    return {'metadata_version': METADATA_VERSION,
+            'module': module_name,
+            'timestamp': timestamp.isoformat(),
+            'parameters': json.loads(json.dumps(parameters, default=json_default)),
+            'arrays': arrays}
+
+
+class SaveBackend(metaclass=abc.ABCMeta):
+    """
+    Base class of the binary file backends. A backend writes all data arrays of SaveLogic.save_data
+    together with the metadata created by "build_metadata" and loads them lazily.
+    """
+    extension = ''
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    @abc.abstractmethod
+    def write(self, base_path, data, metadata):
+        """
+        Writes the data arrays and metadata.
+
+        @param str base_path: path of the file without extension
+        @param dict data: data arrays to save (name: numpy.ndarray)
+        @param dict metadata: metadata created by "build_metadata"
+
+        @return list: paths of the written files. The first one is the path to load the data from.
+        """
+        pass
+
+    @abc.abstractmethod
+    def load(self, file_path):
+        """
+        Loads the data arrays without reading them into memory if possible.
+
+        @param str file_path: path of the file returned first by "write"
+
+        @return (dict, dict): data arrays (name: array-like) and metadata
+        """
+        pass
+
+
+class NpySaveBackend(SaveBackend):
+    """
+    Writes every data array into a raw .npy file next to a JSON sidecar file holding the metadata.
+    The arrays are loaded as read-only memory maps.
+    """
+    extension = '.json'
+
+    def write(self, base_path, data, metadata):
+        file_paths = [base_path + self.extension]
+        for entry, arr in zip(metadata['arrays'], data.values()):
+            entry['file'] = os.path.basename(base_path) + '_{0}.npy'.format(entry['key'])
+            file_path = os.path.join(os.path.dirname(base_path), entry['file'])
+            np.save(file_path, arr, allow_pickle=False)
+            file_paths.append(file_path)
+        with open(file_paths[0], 'w') as file:
+            json.dump(metadata, file, indent=1)
+        return file_paths
+
+    def load(self, file_path):
+        with open(file_path, 'r') as file:
+            metadata = json.load(file)
+        directory = os.path.dirname(file_path)
+        data = dict()
+        for entry in metadata['arrays']:
+            data[entry['name']] = np.load(os.path.join(directory, entry['file']), mmap_mode='r')
+        return data, metadata
+
+
+class Hdf5SaveBackend(SaveBackend):
+    """
+    Writes every data array into an uncompressed contiguous HDF5 dataset. The metadata is stored as
+    JSON in the file attribute "metadata" and every parameter additionally as file attribute.
+    Datasets are loaded as read-only memory maps into the file.
+    """
+    extension = '.h5'
+
+    @classmethod
+    def is_available(cls):
+        return h5py is not None
+
+    def write(self, base_path, data, metadata):
+        file_path = base_path + self.extension
+        with h5py.File(file_path, 'w') as file:
+            file.attrs['metadata'] = json.dumps(metadata)
+            for name, value in metadata['parameters'].items():
+                try:
+                    file.attrs[name] = value
+                except (TypeError, ValueError):
+                    file.attrs[name] = json.dumps(value)
+            for entry, arr in zip(metadata['arrays'], data.values()):
+                if arr.dtype.kind == 'U':
+                    dataset = file.create_dataset(entry['key'], data=arr.astype(object),
+                                                  dtype=h5py.string_dtype())
+                else:
+                    dataset = file.create_dataset(entry['key'], data=arr)
+                dataset.attrs['name'] = entry['name']
+        return [file_path]
+
+    def load(self, file_path):
+        data = dict()
+        with h5py.File(file_path, 'r') as file:
+            metadata = json.loads(file.attrs['metadata'])
+            for entry in metadata['arrays']:
+                dataset = file[entry['key']]
+                offset = dataset.id.get_offset()
+                if offset is None or dataset.dtype.kind not in 'biufc':
+                    # Not memory mappable (empty, chunked or string data)
+                    if h5py.check_string_dtype(dataset.dtype) is not None:
+                        data[entry['name']] = np.array(dataset.asstr()[()], dtype=str)
+                    else:
+                        data[entry['name']] = dataset[()]
+                else:
+                    data[entry['name']] = np.memmap(file_path, mode='r', dtype=dataset.dtype,
+                                                    shape=dataset.shape, offset=offset)
+        return data, metadata
+
+
+class ParquetSaveBackend(SaveBackend):
+    """
+    Writes the data arrays as columns of one Parquet table (1D arrays are one column each, 2D
+    arrays one column per array column). Shorter 1D arrays are padded with null values. The
+    metadata is stored as JSON in the table schema metadata under the key "qudi".
+    The file is memory mapped on loading and the columns are converted to numpy without copy if
+    they contain no null values. The padding is removed and the data type recorded in the metadata
+    is restored on loading (padded integer columns are converted to float by pyarrow).
+    """
+    extension = '.parquet'
+
+    @classmethod
+    def is_available(cls):
+        return pyarrow is not None
+
+    def write(self, base_path, data, metadata):
+        file_path = base_path + self.extension
+        num_rows = max((arr.shape[0] for arr in data.values() if arr.ndim > 0), default=0)
+        columns = dict()
+        for entry, arr in zip(metadata['arrays'], data.values()):
+            arr = np.atleast_1d(arr)
+            for name, column in zip(entry['columns'], arr.reshape(arr.shape[0], -1).T):
+                if column.size < num_rows:
+                    mask = np.zeros(num_rows, dtype=bool)
+                    mask[column.size:] = True
+                    column = np.concatenate(
+                        (column, np.zeros(num_rows - column.size, dtype=column.dtype)))
+                    columns[name] = pyarrow.array(column, mask=mask)
+                else:
+                    columns[name] = pyarrow.array(np.ascontiguousarray(column))
+        table = pyarrow.table(columns)
+        table = table.replace_schema_metadata({'qudi': json.dumps(metadata)})
+        pyarrow.parquet.write_table(table, file_path)
+        return [file_path]
+
+    def load(self, file_path):
+        table = pyarrow.parquet.read_table(file_path, memory_map=True)
+        metadata = json.loads(table.schema.metadata[b'qudi'])
+        data = dict()
+        for entry in metadata['arrays']:
+            # 0D arrays are saved as a single row
+            num_rows = entry['shape'][0] if entry['shape'] else 1
+            dtype = np.dtype(entry['dtype'])
+            columns = [table.column(name).to_numpy()[:num_rows].astype(dtype, copy=False)
+                       for name in entry['columns']]
+            if len(entry['shape']) == 2:
+                data[entry['name']] = np.column_stack(columns)
+            else:
+                data[entry['name']] = columns[0].reshape(entry['shape'])
+        return data, metadata
+
+
+class NpyStreamWriter:
+    """
+    Append-only recording of table rows (e.g. a counter time trace) into a raw .npy file next to a
+    JSON sidecar file. The layout is the one of NpySaveBackend, so a recording can be loaded with
+    "load_saved_data".
+
+    Rows are collected in a fixed-size block buffer, so the memory does not grow with the
+    recording. Each full block is appended to the file. Afterwards the shape in the .npy header is
+    updated and the file is flushed to disk. A crash therefore leaves a valid file holding all rows
+    up to the last written block.
+    The writer can be indexed and sliced like a 2D array of all rows recorded so far.
+    A closed recording can be continued with "reopen".
+    """
+    _header_size = 128
+
+    def __init__(self, base_path, metadata, num_columns, dtype=np.float64, block_rows=4096,
+                 resume=False):
+        """
+        @param str base_path: path of the files without extension
+        @param dict metadata: metadata created by "build_metadata" for an empty array of shape
+                              (0, num_columns)
+        @param int num_columns: number of values per row
+        @param dtype: data type of the values
+        @param int block_rows: number of rows written to the file at once
+        @param bool resume: append to the existing .npy file instead of creating a new one
+        """
+        self._dtype = np.dtype(dtype)
+        self._num_columns = int(num_columns)
+        self._buffer = np.empty((max(1, int(block_rows)), self._num_columns), dtype=self._dtype)
+        self._buffered = 0
+        self._num_rows = 0
+        self._lock = threading.Lock()
+
+        self.metadata = metadata
+        self._entry = metadata['arrays'][0]
+        self._entry['file'] = os.path.basename(base_path) + '_{0}.npy'.format(self._entry['key'])
+        self.file_path = base_path + NpySaveBackend.extension
+        self.data_file_path = os.path.join(os.path.dirname(base_path), self._entry['file'])
+
+        if resume:
+            self._file = open(self.data_file_path, 'r+b')
+            self._num_rows = self._read_header()
+            # Drop data written after the last header update (e.g. a partial block of a crash)
+            self._file.truncate(self._header_size + self._num_rows * self._buffer.strides[0])
+        else:
+            self._file = open(self.data_file_path, 'w+b')
+            self._write_header()
+        self._write_sidecar()
+        return
+
+    @classmethod
+    def reopen(cls, file_path, block_rows=4096):
+        """
+        Reopens a recording (e.g. after a restart) to append further rows. The number of rows is
+        taken from the .npy header, which only counts completely written blocks.
+
+        @param str file_path: path of the JSON sidecar file of the recording
+        @param int block_rows: number of rows written to the file at once
+
+        @return NpyStreamWriter: recording to append rows to
+        """
+        with open(file_path, 'r') as file:
+            metadata = json.load(file)
+        entry = metadata['arrays'][0]
+        return cls(file_path[:-len(NpySaveBackend.extension)], metadata, entry['shape'][1],
+                   dtype=entry['dtype'], block_rows=block_rows, resume=True)
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __len__(self):
+        return self._num_rows + self._buffered
+
+    def __getitem__(self, index):
+        with self._lock:
+            num_rows = self._num_rows + self._buffered
+            if isinstance(index, slice):
+                indices = range(*index.indices(num_rows))
+                if len(indices) == 0:
+                    return np.empty((0, self._num_columns), dtype=self._dtype)
+                start = min(indices[0], indices[-1])
+                rows = self._read_rows(start, max(indices[0], indices[-1]) + 1)
+                return rows[indices[0] - start::indices.step]
+            index = operator.index(index)
+            if index < 0:
+                index += num_rows
+            if not 0 <= index < num_rows:
+                raise IndexError('Row index out of range.')
+            return self._read_rows(index, index + 1)[0]
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self[:]
+        return rows if dtype is None else rows.astype(dtype, copy=False)
+
+    def append(self, rows):
+        """
+        Appends one row or a 2D array of rows.
+
+        @param numpy.ndarray rows: row(s) with num_columns values
+        """
+        rows = np.asarray(rows, dtype=self._dtype).reshape(-1, self._num_columns)
+        with self._lock:
+            while rows.shape[0] > 0:
+                num_new = min(self._buffer.shape[0] - self._buffered, rows.shape[0])
+                self._buffer[self._buffered:self._buffered + num_new] = rows[:num_new]
+                self._buffered += num_new
+                rows = rows[num_new:]
+                if self._buffered == self._buffer.shape[0]:
+                    self._write_block()
+        return
+
+    def flush(self, parameters=None):
+        """
+        Writes all buffered rows to disk and updates the sidecar file.
+
+        @param dict parameters: optional, parameters to add to the metadata
+        """
+        with self._lock:
+            if self._buffered > 0:
+                self._write_block()
+            if parameters is not None:
+                self.metadata['parameters'].update(
+                    json.loads(json.dumps(parameters, default=json_default)))
+            self._write_sidecar()
+        return
+
+    def read(self):
+        """
+        Writes all buffered rows to disk and returns all rows as read-only memory map.
+
+        @return numpy.ndarray: rows recorded so far
+        """
+        self.flush()
+        if self._num_rows == 0:
+            return np.empty((0, self._num_columns), dtype=self._dtype)
+        return np.load(self.data_file_path, mmap_mode='r')
+
+    def close(self, parameters=None):
+        """
+        Writes all buffered rows to disk and closes the file.
+        """
+        if self.closed:
+            return
+        self.flush(parameters)
+        self._file.close()
+        return
+
+    def discard(self):
+        """
+        Closes and deletes the files of the recording.
+        """
+        if not self.closed:
+            self._file.close()
+        for path in (self.data_file_path, self.file_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        return
+
+    def _read_rows(self, start, stop):
+        parts = list()
+        if start < self._num_rows:
+            file_rows = np.memmap(self.data_file_path, dtype=self._dtype, mode='r',
+                                  offset=self._header_size,
+                                  shape=(self._num_rows, self._num_columns))
+            parts.append(np.array(file_rows[start:min(stop, self._num_rows)]))
+        parts.append(self._buffer[max(start - self._num_rows, 0):max(stop - self._num_rows, 0)])
+        return np.concatenate(parts)
+
+    def _write_block(self):
+        # Write the data before updating the header, so the header never counts missing rows
+        self._file.seek(self._header_size + self._num_rows * self._buffer.strides[0])
+        self._file.write(self._buffer[:self._buffered].tobytes())
+        self._num_rows += self._buffered
+        self._buffered = 0
+        self._file.flush()
+        self._write_header()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return
+
+    def _read_header(self):
+        self._file.seek(0)
+        np.lib.format.read_magic(self._file)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self._file)
+        if self._file.tell() != self._header_size or fortran_order or dtype != self._dtype \
+                or len(shape) != 2 or shape[1] != self._num_columns:
+            self._file.close()
+            raise ValueError('File "{0}" is not a recording with {1:d} columns of type {2}.'
+                             ''.format(self.data_file_path, self._num_columns, self._dtype))
+        return shape[0]
+
+    def _write_header(self):
+        header = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1:d}, {2:d}), }}".format(
+            self._dtype.str, self._num_rows, self._num_columns)
+        # Fixed header size (magic string, header length and header) to rewrite it in place
+        header = header.ljust(self._header_size - 11) + '\n'
+        self._file.seek(0)
+        self._file.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header))
+                         + header.encode('latin1'))
+        return
+
+    def _write_sidecar(self):
+        self._entry['shape'] = [self._num_rows, self._num_columns]
+        with open(self.file_path, 'w') as file:
+            json.dump(self.metadata, file, indent=1)
+        return
+
+
+SAVE_BACKENDS = {'hdf5': Hdf5SaveBackend,
+                 'parquet': ParquetSaveBackend,
+                 'npy': NpySaveBackend}
+
+
+def load_saved_data(file_path):
+    """
+    Loads a data file written by SaveLogic.save_data with one of the binary backends.
+
+    @param str file_path: path of the HDF5 (.h5), Parquet (.parquet) or JSON sidecar (.json) file
+
+    @return (dict, dict): data arrays (name: array-like) and metadata (see "build_metadata")
+    """
+    for backend_class in SAVE_BACKENDS.values():
+        if file_path.endswith(backend_class.extension):
+            if not backend_class.is_available():
+                raise ImportError('Loading "{0}" files requires a package that is not installed.'
+                                  ''.format(backend_class.extension))
+            return backend_class().load(file_path)
+    raise ValueError('Unknown file type of "{0}". Valid extensions are {1}.'
+                     ''.format(file_path,
+                               tuple(backend.extension for backend in SAVE_BACKENDS.values())))
@@ -21,7 +21,6 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from cycler import cycler
 import datetime
-import inspect
 import logging
 import matplotlib.pyplot as plt
 import numpy as np
@@ -35,11 +34,32 @@ from core.util import units
 from core.util.mutex import Mutex
 from core.util.network import netobtain
 from logic.generic_logic import GenericLogic
+from logic.save_backends import SAVE_BACKENDS, NpyStreamWriter, build_metadata
+from logic.save_text_writer import PARALLEL_FORMAT_SUPPORTED, write_array_as_text
+from logic.save_worker import SaveWorker, fsync_file
 from matplotlib.backends.backend_pdf import PdfPages
 from PIL import Image
 from PIL import PngImagePlugin
 
 
+def _get_calling_module_name():
+    """
+    Returns the name of the module which called the SaveLogic method that called this function.
+    Only the globals of the calling frame are looked up (no walk of the whole call stack).
+
+    @return str: module name ('UNSPECIFIED' if called from a console or script)
+    """
+    try:
+        module_name = sys._getframe(2).f_globals['__name__'].split('.')[-1]
+    except (AttributeError, KeyError, ValueError):
+        # Sometimes it is not possible to get the module which called the save_data function
+        return 'UNSPECIFIED'
+    # Calls from the console or from a script are not made by a module
+    if module_name == '__main__':
+        return 'UNSPECIFIED'
+    return module_name
+
+
 class DailyLogHandler(logging.FileHandler):
     """
     log handler which uses savelogic's get_daily_directory to log to a
@@ -129,6 +149,9 @@ class SaveLogic(GenericLogic):
         log_into_daily_directory: True
         save_pdf: True
         save_png: True
+        async_save: False       # optional, save data in a background writer thread by default
+        save_queue_size: 16     # optional, maximum number of pending background saves
+        text_format_workers: 0  # optional, processes formatting large text files (0: no processes)
     """
 
     _win_data_dir = ConfigOption('win_data_directory', 'C:/Data/')
@@ -136,6 +159,9 @@ class SaveLogic(GenericLogic):
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
     save_pdf = ConfigOption('save_pdf', False)
     save_png = ConfigOption('save_png', True)
+    async_save = ConfigOption('async_save', False)
+    save_queue_size = ConfigOption('save_queue_size', 16)
+    text_format_workers = ConfigOption('text_format_workers', 0)
 
     # Matplotlib style definition for saving plots
     mpl_qd_style = {
@@ -201,6 +227,11 @@ class SaveLogic(GenericLogic):
                 self.log_into_daily_directory = False
 
         self._daily_loghandler = None
+        # cached daily directory (date, path) and module directories of that day
+        self._daily_directory = (None, None)
+        self._module_directories = dict()
+        # background writer thread for asynchronous saving (started upon first use)
+        self._save_worker = SaveWorker(queue_size=self.save_queue_size, log=self.log)
 
     def on_activate(self):
         """ Definition, configuration and initialisation of the SaveLogic.
@@ -217,7 +248,14 @@ class SaveLogic(GenericLogic):
         else:
             self._daily_loghandler = None
 
+        if self.text_format_workers and self.text_format_workers > 1 \
+                and not PARALLEL_FORMAT_SUPPORTED:
+            self.log.warning('ConfigOption "text_format_workers" requires Python 3.7 or newer. '
+                             'Text files are formatted in the calling thread.')
+
     def on_deactivate(self):
+        # write all pending background saves before shutting down
+        self._save_worker.stop()
         if self._daily_loghandler is not None:
             # removes the log handler logging into the daily directory
             logging.getLogger().removeHandler(self._daily_loghandler)
@@ -237,8 +275,27 @@ class SaveLogic(GenericLogic):
         """
         self._daily_loghandler.setLevel(level)
 
+    @property
+    def save_queue_statistics(self):
+        """
+        Returns the statistics of the background writer (see SaveWorker.statistics), e.g. the
+        number of pending saves and how often and how long callers were blocked by a full queue.
+        """
+        return self._save_worker.statistics
+
+    def wait_for_pending_saves(self, timeout=None):
+        """
+        Waits until all data passed to save_data in asynchronous mode has been written.
+
+        @param float timeout: maximum time to wait in s (None for no limit)
+
+        @return bool: True if all pending saves have been written, False on timeout
+        """
+        return self._save_worker.wait(timeout)
+
     def save_data(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
-                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None):
+                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None,
+                  async_save=None):
         """
         General save routine for data.
 
@@ -284,7 +341,12 @@ class SaveLogic(GenericLogic):
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
         @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
+                                are 'text', 'npz', 'hdf5', 'parquet' and 'npy'. Default is 'text'.
+                                The binary filetypes 'hdf5' (needs h5py), 'parquet' (needs pyarrow)
+                                and 'npy' (raw .npy files with JSON sidecar) store the parameters
+                                as metadata (see logic.save_backends) and can be loaded lazily
+                                with logic.save_backends.load_saved_data. The file extension of
+                                filename is replaced for these filetypes.
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -299,6 +361,16 @@ class SaveLogic(GenericLogic):
                                               behaviour or failure to save right away.
         @param string delimiter: optional, insert here the delimiter, like '\n' for new line, '\t'
                                  for tab, ',' for a comma ect.
+        @param matplotlib.figure.Figure plotfig: optional, figure to save as PNG and/or PDF. The
+                                                 figure is closed afterwards.
+        @param bool async_save: optional, write the files in the background writer thread instead
+                                of the calling thread. A snapshot of the data is taken, so the
+                                caller can continue to alter its data arrays right away but must
+                                not alter plotfig anymore. Default is the config option
+                                "async_save".
+
+        @return concurrent.futures.Future: in asynchronous mode a future holding the path of the
+                                           saved data file (None in synchronous mode)
 
         1D data
         =======
@@ -333,6 +405,13 @@ class SaveLogic(GenericLogic):
         # Create timestamp if none is present
         if timestamp is None:
             timestamp = datetime.datetime.now()
+        if async_save is None:
+            async_save = self.async_save
+        # Take a snapshot of the data arrays for the background writer (the caller may alter the
+        # passed arrays right after this call). The dict of the caller is not altered then.
+        if async_save:
+            data = OrderedDict((keyname, np.array(netobtain(value), copy=True))
+                               for keyname, value in data.items())
 
         # Try to cast data array into numpy.ndarray if it is not already one
         # Also collect information on arrays in the process and do sanity checks
@@ -384,17 +463,8 @@ class SaveLogic(GenericLogic):
                            'arrays only. Saving data failed!')
             return -1
 
-        # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
+        # Get the name of the module which called save_data
+        module_name = _get_calling_module_name()
 
         # determine proper file path
         if filepath is None:
@@ -446,10 +516,66 @@ class SaveLogic(GenericLogic):
                 header += 'not specified parameters: {0}\n'.format(parameters)
         header += '\nData:\n=====\n'
 
+        # Collect the metadata for the binary file backends
+        metadata = None
+        if filetype in SAVE_BACKENDS:
+            if not SAVE_BACKENDS[filetype].is_available():
+                self.log.error('Saving data as filetype "{0}" requires a package that is not '
+                               'installed. Saving as filetype "npy".'.format(filetype))
+                filetype = 'npy'
+            if self.active_poi_name != '':
+                if isinstance(parameters, dict):
+                    parameters = {'Measured at POI': self.active_poi_name, **parameters}
+                elif parameters is None:
+                    parameters = {'Measured at POI': self.active_poi_name}
+            metadata = build_metadata(data, module_name, timestamp, parameters)
+
+        write_args = (data, filepath, filename, filetype, fmt, delimiter, header, multiple_dtypes,
+                      found_2d, arr_dtype, max_line_num, max_row_num, metadata)
+        if async_save:
+            # Remove the figure from pyplot in this thread. It is rendered by the writer thread.
+            if plotfig is not None:
+                plt.close(plotfig)
+            return self._save_worker.submit(self._write_data_and_figure, write_args, plotfig,
+                                            module_name, timestamp, start_time, True)
+        self._write_data_and_figure(write_args, plotfig, module_name, timestamp, start_time)
+        return
+
+    def _write_data_and_figure(self, write_args, plotfig, module_name, timestamp, start_time,
+                               background=False):
+        """
+        Writes the data file and the figure prepared by save_data. Runs in the background writer
+        thread in asynchronous mode. The written files are then also flushed to disk.
+
+        @return str: path of the saved data file
+        """
+        file_paths = self._write_data_file(*write_args)
+        filepath, filename = write_args[1], write_args[2]
+        if plotfig is not None:
+            file_paths.extend(self._save_figure(plotfig, filepath, filename, module_name,
+                                                timestamp, close=not background))
+        if background:
+            for path in file_paths:
+                if os.path.isfile(path):
+                    fsync_file(path)
+        self.log.debug('Time needed to save data: {0:.2f}s'.format(time.time()-start_time))
+        return file_paths[0]
+
+    def _write_data_file(self, data, filepath, filename, filetype, fmt, delimiter, header,
+                         multiple_dtypes, found_2d, arr_dtype, max_line_num, max_row_num,
+                         metadata=None):
+        """
+        Writes the data arrays of save_data into a file of the requested filetype.
+
+        @return list: paths of the written files, starting with the path of the saved data file
+        """
         # write data to file
-        # FIXME: Implement other file formats
+        # write binary file with one of the backends
+        if filetype in SAVE_BACKENDS:
+            base_path = os.path.join(filepath, os.path.splitext(filename)[0])
+            return SAVE_BACKENDS[filetype]().write(base_path, data, metadata)
         # write to textfile
-        if filetype == 'text':
+        elif filetype == 'text':
             # Reshape data if multiple 1D arrays have been passed to this method.
             # If a 2D array has been passed, reformat the specifier
             if len(data) != 1:
@@ -498,13 +624,25 @@ class SaveLogic(GenericLogic):
             self.save_array_as_text(data=[], filename=filename[:-4]+'_params.dat', filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
+            return [os.path.join(filepath, filename[:-4] + '.npz'),
+                    os.path.join(filepath, filename[:-4] + '_params.dat')]
         else:
-            self.log.error('Only saving of data as textfile and npz-file is implemented. Filetype "{0}" is not '
-                           'supported yet. Saving as textfile.'.format(filetype))
+            self.log.error('Filetype "{0}" is not supported. Valid filetypes are "text", "npz", '
+                           '{1}. Saving as textfile.'
+                           ''.format(filetype, ', '.join('"{0}"'.format(ft) for ft in SAVE_BACKENDS)))
             self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
+        return [os.path.join(filepath, filename)]
 
+    def _save_figure(self, plotfig, filepath, filename, module_name, timestamp, close=True):
+        """
+        Saves the thumbnail figure of the plot as PDF and/or PNG (see config options save_pdf and
+        save_png).
+
+        @return list: paths of the saved figure files
+        """
+        fig_paths = list()
         #--------------------------------------------------------------------------------------------
         # Save thumbnail figure of plot
         if plotfig is not None:
@@ -536,6 +674,7 @@ class SaveLogic(GenericLogic):
                     pdf_metadata = pdf.infodict()
                     for x in metadata:
                         pdf_metadata[x] = metadata[x]
+                fig_paths.append(fig_fname_vector)
 
             if self.save_png:
                 # determine the PNG-Filename and save the plain PNG
@@ -560,27 +699,90 @@ class SaveLogic(GenericLogic):
 
                 # save the picture again, this time including the metadata
                 png_image.save(fig_fname_image, "png", pnginfo=png_metadata)
+                fig_paths.append(fig_fname_image)
 
-            # close matplotlib figure
-            plt.close(plotfig)
-            self.log.debug('Time needed to save data: {0:.2f}s'.format(time.time()-start_time))
+            # close matplotlib figure (already done by save_data in asynchronous mode)
+            if close:
+                plt.close(plotfig)
             #----------------------------------------------------------------------------------
+        return fig_paths
+
+    def open_data_stream(self, name, num_columns, filepath=None, parameters=None, filelabel=None,
+                         timestamp=None, dtype=float, block_rows=4096):
+        """
+        Opens an append-only recording of table rows (e.g. a time trace recorded over night) as
+        raw .npy file with JSON sidecar (see filetype 'npy' of save_data). Rows are written to disk
+        in blocks of fixed size, so the memory does not grow with the recording and a crash leaves
+        a valid file with all rows up to the last written block.
+
+        @param str name: identifier of the columns like the data dict key of a 2D array in
+                         save_data (e.g. 'Time (s),Signal (counts/s)')
+        @param int num_columns: number of values per row
+        @param string filepath: optional, the path to the directory, where the data will be saved
+                                (see save_data)
+        @param dictionary parameters: optional, parameters to save in the metadata
+        @param string filelabel: optional, label of the filename (see save_data)
+        @param datetime timestamp: optional, timestamp of the filename (see save_data)
+        @param dtype: optional, data type of the values (default float)
+        @param int block_rows: optional, number of rows written to disk at once
+
+        @return NpyStreamWriter: recording to append rows to. Load the files with
+                                 logic.save_backends.load_saved_data(<writer>.file_path).
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        module_name = _get_calling_module_name()
+
+        if filepath is None:
+            filepath = self.get_path_for_module(module_name)
+        elif not os.path.exists(filepath):
+            os.makedirs(filepath)
+            self.log.info('Custom filepath does not exist. Created directory "{0}"'
+                          ''.format(filepath))
+        if filelabel is None:
+            filelabel = module_name
+        if self.active_poi_name != '':
+            filelabel = self.active_poi_name.replace(' ', '_') + '_' + filelabel
+        filename = timestamp.strftime('%Y%m%d-%H%M-%S' + '_' + filelabel)
+
+        if isinstance(parameters, dict):
+            parameters = {**self._additional_parameters, **parameters}
+        if self.active_poi_name != '' and (parameters is None or isinstance(parameters, dict)):
+            parameters = {'Measured at POI': self.active_poi_name, **(parameters or dict())}
+        metadata = build_metadata({name: np.empty((0, num_columns), dtype=dtype)}, module_name,
+                                  timestamp, parameters)
+        return NpyStreamWriter(os.path.join(filepath, filename), metadata, num_columns,
+                               dtype=dtype, block_rows=block_rows)
+
+    def reopen_data_stream(self, file_path, block_rows=4096):
+        """
+        Reopens a recording created by open_data_stream to append further rows (e.g. after the
+        calling module has been reactivated).
+
+        @param str file_path: path of the JSON sidecar file (<writer>.file_path)
+        @param int block_rows: optional, number of rows written to disk at once
+
+        @return NpyStreamWriter: recording to append rows to
+        """
+        return NpyStreamWriter.reopen(file_path, block_rows=block_rows)
 
     def save_array_as_text(self, data, filename, filepath='', fmt='%.15e', header='',
                            delimiter='\t', comments='#', append=False):
         """
         An Independent method, which can save a 1D or 2D numpy.ndarray as textfile.
         Can append to files.
+        The file content is identical to numpy.savetxt but rows are formatted in bulk (see
+        logic.save_text_writer).
         """
         # write to file. Append if requested.
         if append:
             with open(os.path.join(filepath, filename), 'ab') as file:
-                np.savetxt(file, data, fmt=fmt, delimiter=delimiter, header=header,
-                           comments=comments)
+                write_array_as_text(file, data, fmt=fmt, delimiter=delimiter, header=header,
+                                    comments=comments, max_workers=self.text_format_workers)
         else:
             with open(os.path.join(filepath, filename), 'wb') as file:
-                np.savetxt(file, data, fmt=fmt, delimiter=delimiter, header=header,
-                           comments=comments)
+                write_array_as_text(file, data, fmt=fmt, delimiter=delimiter, header=header,
+                                    comments=comments, max_workers=self.text_format_workers)
         return
 
     def get_daily_directory(self):
@@ -595,12 +797,20 @@ class SaveLogic(GenericLogic):
 
         and the filepath is returned. There should be always a filepath
         returned.
+        The path is cached and only determined again at the date rollover or if the directory
+        has been removed.
         """
+        now = time.localtime()
+        today = time.strftime("%Y%m%d", now)
+        cached_date, current_dir = self._daily_directory
+        if cached_date == today and os.path.isdir(current_dir):
+            return current_dir
+
         current_dir = os.path.join(
-            self.data_dir, 
-            time.strftime("%Y"), 
-            time.strftime("%m"),
-            time.strftime("%Y%m%d"))
+            self.data_dir,
+            time.strftime("%Y", now),
+            time.strftime("%m", now),
+            today)
 
         if not os.path.isdir(current_dir):
             self.log.info("Creating directory for today's data:\n"
@@ -610,6 +820,8 @@ class SaveLogic(GenericLogic):
             # Details at http://stackoverflow.com/questions/12468022/python-fileexists-error-when-making-directory
             os.makedirs(current_dir, exist_ok=True)
 
+        self._module_directories = dict()
+        self._daily_directory = (today, current_dir)
         return current_dir
 
     def get_path_for_module(self, module_name):
@@ -620,10 +832,15 @@ class SaveLogic(GenericLogic):
                                    directory. The module_name can be e.g. 'Confocal'.
         @return string: absolute path to the module name
         """
-        dir_path = os.path.join(self.get_daily_directory(), module_name)
+        daily_dir = self.get_daily_directory()
+        dir_path = self._module_directories.get(module_name)
+        if dir_path is not None and os.path.isdir(dir_path):
+            return dir_path
+        dir_path = os.path.join(daily_dir, module_name)
 
         if not os.path.isdir(dir_path):
             os.makedirs(dir_path, exist_ok=True)
+        self._module_directories[module_name] = dir_path
         return dir_path
 
     def get_additional_parameters(self):
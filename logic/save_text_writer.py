@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the text file writer of the Qudi SaveLogic.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import itertools
+import multiprocessing
+import re
+import sys
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Conversion types of printf-style format specifiers
+_CONVERSION_PATTERN = re.compile(
+    r'%(?:\([^)]*\))?[#0\- +]*(?:\*|\d+)?(?:\.(?:\*|\d+))?[hlL]?([diouxXeEfFgGcrsa%])')
+_NUMERIC_CONVERSIONS = frozenset('diouxXeEfFgG')
+# Number of values formatted at once
+_CHUNK_VALUES = 2 ** 17
+# Minimum number of values to format chunks in parallel worker processes
+_PARALLEL_MIN_VALUES = 2 ** 21
+# Worker processes are spawned (not forked) via ProcessPoolExecutor(mp_context=...) (Python >= 3.7)
+PARALLEL_FORMAT_SUPPORTED = sys.version_info >= (3, 7)
+
+
+def _get_row_format(fmt, delimiter, ncol):
+    """
+    Creates the format string of one row like numpy.savetxt does.
+
+    @return str: row format (None if not supported)
+    """
+    if isinstance(fmt, (list, tuple)):
+        if len(fmt) != ncol or not all(isinstance(spec, str) for spec in fmt):
+            return None
+        return delimiter.join(fmt)
+    if isinstance(fmt, str):
+        n_fmt_chars = fmt.count('%')
+        if n_fmt_chars == 1:
+            return delimiter.join([fmt] * ncol)
+        if n_fmt_chars == ncol:
+            return fmt
+    return None
+
+
+def _python_values_format_alike(row_format, dtypes):
+    """
+    Checks whether formatting the values converted to python scalars (ndarray.tolist) results in
+    the same string as formatting the numpy scalars yielded by numpy.savetxt.
+    Numeric conversions are identical since numpy scalars are converted with __float__/__index__.
+    The string conversion is only identical for integer, bool and str arrays (e.g. not for float32).
+    """
+    conversions = set(_CONVERSION_PATTERN.findall(row_format)) - {'%'}
+    if conversions <= _NUMERIC_CONVERSIONS:
+        return True
+    if conversions <= _NUMERIC_CONVERSIONS | {'s'}:
+        return all(dtype.kind in 'iubU' for dtype in dtypes)
+    return False
+
+
+def _format_chunk(line_format, chunk, python_values):
+    """
+    Formats all rows of a chunk of a 2D or 1D structured array at once.
+
+    @return bytes: latin1 encoded text of the rows
+    """
+    if chunk.dtype.names is None:
+        values = chunk.ravel().tolist() if python_values else list(chunk.ravel())
+    elif python_values:
+        values = list(itertools.chain.from_iterable(chunk.tolist()))
+    else:
+        values = list(itertools.chain.from_iterable(tuple(row) for row in chunk))
+    return ((line_format * chunk.shape[0]) % tuple(values)).encode('latin1')
+
+
+def write_array_as_text(file, data, fmt='%.18e', delimiter=' ', newline='\n', header='',
+                        comments='# ', max_workers=0):
+    """
+    Writes a 1D or 2D array into a binary file handle. The written bytes are identical to
+    numpy.savetxt(file, data, fmt, delimiter, newline, header, comments=comments).
+
+    Instead of formatting each row separately, the values of many rows are converted to python
+    scalars at once and formatted by a single string formatting operation per chunk of rows.
+    Optionally, large arrays are formatted chunk by chunk in parallel worker processes since the
+    float to string conversion holds the GIL. The workers are spawned instead of forked since
+    forking a multithreaded (Qt) process can deadlock the child. Arrays that can not be handled this way (e.g. complex data)
+    are written with numpy.savetxt.
+
+    @param file: file handle opened in binary mode
+    @param numpy.ndarray data: 1D, 2D or 1D structured array (or anything castable)
+    @param str or list of str fmt: format specifier(s) (see numpy.savetxt)
+    @param str delimiter: string separating the columns
+    @param str newline: string separating the rows
+    @param str header: header written before the data (prefixed with comments)
+    @param str comments: prefix of the header lines
+    @param int max_workers: optional, number of worker processes for large arrays (Python >= 3.7).
+                            With 0 or 1 (default) all chunks are formatted in this process.
+    """
+    arr = np.asarray(data)
+    if arr.ndim == 1 and arr.dtype.names is None:
+        arr = arr.reshape(-1, 1)
+    if arr.ndim == 1:
+        ncol = len(arr.dtype.names)
+        dtypes = [arr.dtype.fields[name][0] for name in arr.dtype.names]
+    elif arr.ndim == 2 and arr.dtype.names is None:
+        ncol = arr.shape[1]
+        dtypes = [arr.dtype]
+    else:
+        ncol = 0
+        dtypes = list()
+
+    row_format = None
+    if ncol > 0 and isinstance(delimiter, str) and isinstance(newline, str) and '%' not in newline \
+            and not any(dtype.kind in 'cOV' or dtype.names for dtype in dtypes):
+        row_format = _get_row_format(fmt, delimiter, ncol)
+    if row_format is None:
+        np.savetxt(file, data, fmt=fmt, delimiter=delimiter, newline=newline, header=header,
+                   comments=comments)
+        return
+
+    if len(header) > 0:
+        header = header.replace('\n', '\n' + comments)
+        file.write((comments + header + newline).encode('latin1'))
+
+    python_values = _python_values_format_alike(row_format, dtypes)
+    line_format = row_format + newline
+    rows_per_chunk = max(1, _CHUNK_VALUES // ncol)
+    chunks = (arr[start:start + rows_per_chunk] for start in range(0, arr.shape[0], rows_per_chunk))
+    max_workers = int(max_workers) if max_workers and PARALLEL_FORMAT_SUPPORTED else 0
+    try:
+        if max_workers > 1 and arr.shape[0] * ncol >= _PARALLEL_MIN_VALUES:
+            # Keep only a few chunks in flight to bound the memory
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_format_chunk, line_format, chunk,
+                                                   python_values))
+                    if len(pending) >= 2 * max_workers:
+                        file.write(pending.popleft().result())
+                while pending:
+                    file.write(pending.popleft().result())
+        else:
+            for chunk in chunks:
+                file.write(_format_chunk(line_format, chunk, python_values))
+    except TypeError:
+        raise TypeError("Mismatch between array dtype ('{0}') and format specifier ('{1}')"
+                        "".format(arr.dtype, row_format))
+    return
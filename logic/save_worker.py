@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the background writer thread of the Qudi SaveLogic.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from core.util.worker_statistics import WorkerStatistics
+
+
+def fsync_file(file_path):
+    """
+    Flushes the content of a written file from the OS buffers to the disk.
+
+    @param str file_path: path of the file
+    """
+    # Windows needs write access to flush a file
+    with open(file_path, 'ab') as file:
+        os.fsync(file.fileno())
+    return
+
+
+class SaveWorker:
+    """
+    Writer thread executing save jobs (e.g. serializing data and rendering figures) one after the
+    other in the order of submission.
+
+    Jobs wait in a bounded queue. If the queue is full, submit blocks until a job has been written
+    (backpressure) and reports this with a warning. The number of blocked submits and the time
+    spent waiting are available via the "statistics" property.
+    """
+
+    def __init__(self, queue_size=16, log=None):
+        """
+        @param int queue_size: maximum number of jobs waiting to be written
+        @param logger log: logger to report failed jobs and backpressure with
+        """
+        self._queue_size = max(1, int(queue_size))
+        self.log = log
+
+        self._queue = queue.Queue(maxsize=self._queue_size)
+        self._thread = None
+
+        self._statistics = WorkerStatistics(
+            stages=('queue', 'write', 'blocked'),
+            counters=('jobs_submitted', 'jobs_written', 'jobs_failed', 'submits_blocked'))
+        return
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def statistics(self):
+        """
+        Statistics of the writer in s (last, mean and max of the most recent jobs) for "queue"
+        (time a job waited in the queue), "write" (duration of a job) and "blocked" (time a submit
+        waited for a free queue slot).
+        Also contains the number of jobs submitted, written and failed, the number of blocked
+        submits and the current queue length.
+
+        @return dict: statistics
+        """
+        stats = self._statistics.as_dict()
+        stats['queue_length'] = self._queue.qsize()
+        stats['queue_size'] = self._queue_size
+        return stats
+
+    def reset_statistics(self):
+        self._statistics.reset()
+        return
+
+    def start(self):
+        """
+        Starts the writer thread. Does nothing if already running.
+        """
+        if self.is_running:
+            return
+        self._thread = threading.Thread(target=self._write_loop, name='SaveWorker', daemon=True)
+        self._thread.start()
+        return
+
+    def stop(self):
+        """
+        Writes all queued jobs and stops the writer thread afterwards.
+        """
+        if not self.is_running:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        return
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues a save job. All arguments must be snapshots that are not altered by the caller
+        afterwards. Blocks if the queue is full until a queued job has been written.
+
+        @param callable func: save job
+        @param args: positional arguments of func
+        @param kwargs: keyword arguments of func
+
+        @return concurrent.futures.Future: future holding the return value of func
+        """
+        self.start()
+        future = Future()
+        job = (future, func, args, kwargs, time.perf_counter())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            if self.log is not None:
+                self.log.warning('Save queue is full ({0:d} jobs). Waiting for pending saves to '
+                                 'finish.'.format(self._queue_size))
+            start = time.perf_counter()
+            self._queue.put(job)
+            self._statistics.add_duration('blocked', time.perf_counter() - start)
+            self._statistics.increment('submits_blocked')
+        self._statistics.increment('jobs_submitted')
+        return future
+
+    def wait(self, timeout=None):
+        """
+        Waits until all queued jobs have been written.
+
+        @param float timeout: maximum time to wait in s (None for no limit)
+
+        @return bool: True if all jobs have been written, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    break
+                future, func, args, kwargs, submit_time = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    future.set_exception(e)
+                    self._statistics.increment('jobs_failed')
+                    if self.log is not None:
+                        self.log.exception('Background save job failed.')
+                else:
+                    future.set_result(result)
+                    self._statistics.increment('jobs_written')
+                self._statistics.add_duration('queue', start - submit_time)
+                self._statistics.add_duration('write', time.perf_counter() - start)
+            finally:
+                self._queue.task_done()
+        return
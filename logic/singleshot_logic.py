@@ -75,6 +75,8 @@ class SingleShotLogic(GenericLogic):
         self._hist_num_bins = None
 
         self.data_dict = None
+        # streaming flip probability analysis of the fetched data (see start_flip_prob_stream)
+        self._flip_prob_streaming = False
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -94,6 +96,7 @@ class SingleShotLogic(GenericLogic):
 
         self.hist_data = None
         self.trace = None
+        self._flip_prob_streaming = False
         self.sigMeasurementFinished.connect(self.ssr_measurement_analysis)
 
 
@@ -144,8 +147,59 @@ class SingleShotLogic(GenericLogic):
 
         self.data_dict = return_dict
 
+        # update the flip probability with the new data (if a streaming analysis is started)
+        if 'raw_data' in return_dict:
+            self._update_flip_prob_stream()
+
         return 0
 
+    def start_flip_prob_stream(self, init_threshold=None, ana_threshold=None, analyze_mode='full'):
+        """
+        Start a streaming analysis of the flip probability. Each time data is fetched with get_data
+        only the newly measured readouts of the normalized signal are analyzed by the
+        TraceAnalysisLogic (see TraceAnalysisLogic.start_flip_prob_stream).
+
+        @param list init_threshold: [lower, upper] threshold for the initialization readout
+        @param list ana_threshold: [lower, upper] threshold for the analysis readout
+        @param str analyze_mode: 'full', 'bright' or 'dark' initialization to analyze
+        """
+        self._traceanalysis_logic.start_flip_prob_stream(init_threshold=init_threshold,
+                                                         ana_threshold=ana_threshold,
+                                                         analyze_mode=analyze_mode)
+        self._flip_prob_streaming = True
+        return
+
+    def stop_flip_prob_stream(self):
+        """
+        Stop the streaming analysis of the flip probability.
+        """
+        self._flip_prob_streaming = False
+        self._traceanalysis_logic.stop_flip_prob_stream()
+        return
+
+    def _update_flip_prob_stream(self):
+        """
+        Passes the normalized signal of the fetched data to the streaming flip probability analysis.
+        Readouts not measured yet (trailing rows without counts) are not passed on.
+
+        @return tuple(flip_prob, lost_events): see TraceAnalysisLogic.update_flip_prob_stream.
+                                               None if no stream is started.
+        """
+        if not self._flip_prob_streaming:
+            return None
+        sum_single_pulses = self.sum_laserpulse()
+        if sum_single_pulses.ndim != 2 or sum_single_pulses.shape[1] != 2:
+            self.log.warning('Streaming flip probability analysis needs 2 laser pulses per readout '
+                             'for normalization.')
+            return None
+        total = sum_single_pulses[:, 0] + sum_single_pulses[:, 1]
+        measured = np.flatnonzero(total)
+        num_rows = measured[-1] + 1 if len(measured) > 0 else 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized_signal = (sum_single_pulses[:num_rows, 0]
+                                 - sum_single_pulses[:num_rows, 1]) / total[:num_rows]
+        return self._traceanalysis_logic.update_flip_prob_stream(normalized_signal)
+
     def find_laser(self, smoothing=10.0, n_laserpulses=2):
         """
         returns the start and stop indices of laserpulses
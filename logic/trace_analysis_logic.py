@@ -27,6 +27,70 @@ from core.connector import Connector
 from logic.generic_logic import GenericLogic
 
 
+def run_length_encode(trace):
+    """ Run-length encoding of a 1D trace (e.g. a binary single shot readout trace).
+    @param np.array trace: 1D trace
+    @return tuple(values, starts, lengths):
+                np.array values: value of each run of consecutive equal entries
+                np.array starts: index of the first entry of each run in trace
+                np.array lengths: number of entries of each run
+    """
+    trace = np.asarray(trace)
+    if trace.size == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return trace[:0], empty, empty
+    starts = np.concatenate(([0], np.flatnonzero(trace[1:] != trace[:-1]) + 1))
+    lengths = np.diff(np.append(starts, trace.size))
+    return trace[starts], starts, lengths
+
+
+def transition_matrix(states, num_states):
+    """ Count the transitions between consecutive entries of a trace of integer states.
+    @param np.array states: 1D integer trace with values in range(num_states)
+    @param int num_states: number of possible states
+    @return np.array: 2D integer array (num_states x num_states), where entry [i, j] is the
+                      number of transitions from state i to state j
+    """
+    states = np.asarray(states, dtype=np.int64)
+    if states.size < 2:
+        return np.zeros((num_states, num_states), dtype=np.int64)
+    return np.bincount(states[:-1] * num_states + states[1:],
+                       minlength=num_states ** 2).reshape(num_states, num_states)
+
+
+def count_ssr_flips(trace, init_threshold, ana_threshold, analyze_mode='full', previous=None):
+    """ Count the flips and non-flips between consecutive single shot readouts. A readout above
+        init_threshold[1] (below init_threshold[0]) initializes the bright (dark) state, the
+        following readout is analyzed as bright if above ana_threshold[1] and else as dark if below
+        ana_threshold[0]. Readouts in between the thresholds are not counted.
+    @param np.array trace: 1D trace of readout values
+    @param list init_threshold: [lower, upper] threshold for the initialization readout
+    @param list ana_threshold: [lower, upper] threshold for the analysis readout
+    @param str analyze_mode: 'full', 'bright' or 'dark' initialization to analyze
+    @param float previous: optional readout preceding the trace (e.g. the last value of the
+                           previous data chunk), so the transition into the trace is counted
+    @return tuple(flip, no_flip): number of flips and number of non-flips
+    """
+    trace = np.asarray(trace)
+    if previous is not None:
+        trace = np.concatenate(([previous], trace))
+    init, ana = trace[:-1], trace[1:]
+    ana_high = ana > ana_threshold[1]
+    ana_low = (ana < ana_threshold[0]) & ~ana_high
+
+    flip = 0
+    no_flip = 0
+    if analyze_mode == 'bright' or analyze_mode == 'full':
+        init_high = init > init_threshold[1]
+        no_flip += np.count_nonzero(init_high & ana_high)
+        flip += np.count_nonzero(init_high & ana_low)
+    if analyze_mode == 'dark' or analyze_mode == 'full':
+        init_low = init < init_threshold[0]
+        flip += np.count_nonzero(init_low & ana_high)
+        no_flip += np.count_nonzero(init_low & ana_low)
+    return flip, no_flip
+
+
 class TraceAnalysisLogic(GenericLogic):
     """ Perform a gated counting measurement with the hardware.  """
 
@@ -56,6 +120,8 @@ class TraceAnalysisLogic(GenericLogic):
         self.spin_flip_prob = 0
         self.fidelity_left = 0
         self.fidelity_right = 0
+        # settings and accumulated counts of the streaming flip probability analysis
+        self._flip_stream = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -174,11 +240,9 @@ class TraceAnalysisLogic(GenericLogic):
 
         # by shifting the index_arr one value further, one will investigate
         # basically the next state, where a change has happened.
-        next_index_arr = index_arr + 1
-
         # Just for safety neglect the last value in the index_arr so that one
         # will not go beyond the array.
-        next_filtered_bin_arr = bin_trace[next_index_arr[:-1]]
+        next_filtered_bin_arr = bin_trace[index_arr[:-1] + 1]
 
         # calculate how many darkstates are present in the array, remember
         # filtered_arr contains all the bright states.
@@ -187,7 +251,7 @@ class TraceAnalysisLogic(GenericLogic):
 
         # extract the number of state, which has been flipped to dark state
         # (True) started in the bright state (=False)
-        num_flip_to_dark = len(np.where(next_filtered_bin_arr == True)[0])
+        num_flip_to_dark = np.count_nonzero(next_filtered_bin_arr)
 
         # flip probability:
         # In the array filtered_bin_arr all states are in bright state meaning
@@ -232,36 +296,25 @@ class TraceAnalysisLogic(GenericLogic):
                       float lifetime_dark: the lifetime in the dark state in s
                       float lifetime_bright: lifetime in the bright state in s
         """
-        no_flip = 0.0
+        trace = np.asarray(trace)
+        # states: 0 = below threshold (dark), 1 = equal to threshold, 2 = above threshold (bright)
+        states = (trace >= threshold).astype(np.int64) + (trace > threshold)
+        transitions = transition_matrix(states, 3)
 
         if analyze_mode == 'full':
-            for ii in range(len(trace) - 1):
-                if trace[ii] > threshold and trace[ii + 1] > threshold:
-                    no_flip = no_flip + 1
-
-                elif trace[ii] < threshold and trace[ii + 1] < threshold:
-                    no_flip = no_flip + 1
-
+            no_flip = float(transitions[0, 0] + transitions[2, 2])
             probability = 1.0 - (no_flip / len(trace))
             lost_events = 0.0
 
         if analyze_mode == 'dark':
-            dark_counter = 0.0
-            for ii in range(len(trace) - 1):
-                if trace[ii] < threshold:
-                    dark_counter = dark_counter + 1
-                    if trace[ii + 1] < threshold:
-                        no_flip = no_flip + 1
+            dark_counter = float(transitions[0].sum())
+            no_flip = float(transitions[0, 0])
             probability = 1.0 - (no_flip / dark_counter)
             lost_events = (1.0 - (dark_counter / len(trace))) * 100
 
         if analyze_mode == 'bright':
-            bright_counter = 0.0
-            for ii in range(len(trace) - 1):
-                if trace[ii] > threshold:
-                    bright_counter = bright_counter + 1
-                    if trace[ii + 1] > threshold:
-                        no_flip = no_flip + 1
+            bright_counter = float(transitions[2].sum())
+            no_flip = float(transitions[2, 2])
             probability = 1.0 - (no_flip / bright_counter)
             lost_events = (1.0 - (bright_counter / len(trace))) * 100
 
@@ -284,35 +337,8 @@ class TraceAnalysisLogic(GenericLogic):
         """
         init_threshold = init_threshold if init_threshold is not None else [1, 1]
         ana_threshold = ana_threshold if ana_threshold is not None else [1, 1]
-        no_flip = 0.0
-        flip = 0.0
-
-        # find all indices in the trace-array, where the value is above init_threshold[1]
-        init_high = np.where(trace[:-1] > init_threshold[1])[0]
-        # find all indices in the trace-array, where the value is below init_threshold[0]
-        init_low = np.where(trace[:-1] < init_threshold[0])[0]
-        # find all indices in the trace-array, where the value is above ana_threshold[1]
-        ana_high = np.where(trace > ana_threshold[1])[0]
-        # find all indices in the trace-array, where the value is below ana_threshold[0]
-        ana_low = np.where(trace < ana_threshold[0])[0]
-
-        if analyze_mode == 'bright' or analyze_mode == 'full':
-            # analyze the trace where the data were the nuclear was initalized into one direction
-            for index in init_high:
-                # check if the following data point is in the analysis array
-                if index + 1 in ana_high:
-                    no_flip = no_flip + 1
-                elif index + 1 in ana_low:
-                    flip = flip + 1
-
-        if analyze_mode == 'dark' or analyze_mode == 'full':
-            # repeat the same if the nucleus was initalized into the other array
-            for index in init_low:
-                # check if the following data point is in the analysis array
-                if index + 1 in ana_high:
-                    flip = flip + 1
-                elif index + 1 in ana_low:
-                    no_flip = no_flip + 1
+        # count the flips of consecutive data points initialized into and analyzed in either direction
+        flip, no_flip = count_ssr_flips(trace, init_threshold, ana_threshold, analyze_mode)
 
         # the flip probability is given by the number of flips divided by the total number of analyzed data points
         if (flip + no_flip) == 0:
@@ -366,33 +392,7 @@ class TraceAnalysisLogic(GenericLogic):
             self.log.warning('Not enough data points yet!')
 
         # calculate the flip probability
-        no_flip = 0.0
-        flip = 0.0
-        # find all indices in the trace-array, where the value is above init_threshold[1]
-        init_high = np.where(trace[:-1] > init_threshold[1])[0]
-        # find all indices in the trace-array, where the value is below init_threshold[0]
-        init_low = np.where(trace[:-1] < init_threshold[0])[0]
-        # find all indices in the trace-array, where the value is above ana_threshold[1]
-        ana_high = np.where(trace > ana_threshold[1])[0]
-        # find all indices in the trace-array, where the value is below ana_threshold[0]
-        ana_low = np.where(trace < ana_threshold[0])[0]
-
-        if analyze_mode == 'bright' or analyze_mode == 'full':
-            # analyze the trace where the data were the nuclear was initalized into one direction
-            for index in init_high:
-                # check if the following data point is in the analysis array
-                if index + 1 in ana_high:
-                    no_flip = no_flip + 1
-                elif index + 1 in ana_low:
-                    flip = flip + 1
-        if analyze_mode == 'dark' or analyze_mode == 'full':
-            # repeat the same if the nucleus was initalized into the other array
-            for index in init_low:
-                # check if the following data point is in the analysis array
-                if index + 1 in ana_high:
-                    flip = flip + 1
-                elif index + 1 in ana_low:
-                    no_flip = no_flip + 1
+        flip, no_flip = count_ssr_flips(trace, init_threshold, ana_threshold, analyze_mode)
 
         # the flip probability is given by the number of flips divided by the total number of analyzed data points
         if (flip + no_flip) == 0:
@@ -419,6 +419,71 @@ class TraceAnalysisLogic(GenericLogic):
         """
         pass
 
+    def start_flip_prob_stream(self, init_threshold=None, ana_threshold=None, analyze_mode='full'):
+        """ Start a streaming analysis of the flip probability (see analyze_flip_prob3). Each call
+            of update_flip_prob_stream only analyzes the newly arrived data points and adds the
+            counted flips to the ones of the previous data.
+        @param list init_threshold: [lower, upper] threshold for the initialization readout
+        @param list ana_threshold: [lower, upper] threshold for the analysis readout
+        @param str analyze_mode: 'full', 'bright' or 'dark' initialization to analyze
+        """
+        init_threshold = init_threshold if init_threshold is not None else [1, 1]
+        ana_threshold = ana_threshold if ana_threshold is not None else [1, 1]
+        self._flip_stream = {'init_threshold': init_threshold,
+                             'ana_threshold': ana_threshold,
+                             'analyze_mode': analyze_mode,
+                             'flip': 0,
+                             'no_flip': 0,
+                             'num_points': 0,
+                             'last_value': None}
+        return
+
+    def stop_flip_prob_stream(self):
+        """ Stop the streaming analysis of the flip probability.
+        """
+        self._flip_stream = None
+        return
+
+    def update_flip_prob_stream(self, data, cumulative=True):
+        """ Add new single shot readout data to the streaming flip probability analysis.
+        @param np.array data: 1D trace of readout values
+        @param bool cumulative: if True, data is the complete trace measured so far and only its
+                                points not analyzed yet are taken into account (a shorter trace
+                                restarts the analysis). If False, data only contains new points.
+        @return tuple(flip_prob, lost_events): the flip probability and the number of data points
+                                               not analyzed so far. None if no stream is started.
+        """
+        stream = self._flip_stream
+        if stream is None:
+            return None
+        data = np.asarray(data)
+        if cumulative:
+            if len(data) < stream['num_points']:
+                self.start_flip_prob_stream(stream['init_threshold'],
+                                            stream['ana_threshold'],
+                                            stream['analyze_mode'])
+                stream = self._flip_stream
+            data = data[stream['num_points']:]
+        if len(data) == 0:
+            return self.spin_flip_prob, stream['num_points'] - (stream['flip'] + stream['no_flip'])
+
+        flip, no_flip = count_ssr_flips(data,
+                                        stream['init_threshold'],
+                                        stream['ana_threshold'],
+                                        stream['analyze_mode'],
+                                        previous=stream['last_value'])
+        stream['flip'] += flip
+        stream['no_flip'] += no_flip
+        stream['num_points'] += len(data)
+        stream['last_value'] = data[-1]
+
+        if stream['flip'] + stream['no_flip'] > 0:
+            self.spin_flip_prob = stream['flip'] / (stream['flip'] + stream['no_flip'])
+        lost_events = stream['num_points'] - (stream['flip'] + stream['no_flip'])
+
+        self.sigAnalysisResultsUpdated.emit()
+        return self.spin_flip_prob, lost_events
+
     def get_fit_functions(self):
         """ Return all fit functions, which are currently implemented for that module.
         @return list: with string entries denoting the name of the fit.
@@ -507,48 +572,15 @@ class TraceAnalysisLogic(GenericLogic):
                 threshold = threshold_fit
 
             # helper functions to get and analyze the timetrace
-            def analog_digitial_converter(cut_off, data):
-                new_digital_trace = []
-                for data_point in data:
-                    if data_point >= cut_off:
-                        new_digital_trace.append(1)
-                    else:
-                        new_digital_trace.append(0)
-                return new_digital_trace
-
             def time_in_high_low(raw_digital_trace, local_dt):
                 """
-                What I need this function to do is to get all consecutive {1, ... , n} 1s or 0s and add
-                them up and put into a list to later make a histogram from them.
+                Get the durations of all consecutive 1s (positive) and 0s (negative) to later
+                make a histogram from them.
                 """
-                occurances = []
-                index = 0
-                index2 = 0
-
-                while index < len(raw_digital_trace):
-                    occurances.append(0)
-                    # start following the consecutive 1s
-                    while raw_digital_trace[index] == 1:
-                        occurances[index2] += 1
-                        if index == (len(raw_digital_trace) - 1):
-                            occurances = np.array(occurances)
-                            return occurances * local_dt
-                        else:
-                            index += 1
-                    if raw_digital_trace[index - 1] == 1:
-                        index2 += 1
-                        occurances.append(0)
-                    # start following the consecutive 0s
-                    while raw_digital_trace[index] == 0:
-                        occurances[index2] -= 1
-                        if index == (len(raw_digital_trace) - 1):
-                            occurances = np.array(occurances)
-                            return occurances * local_dt
-                        else:
-                            index += 1
-                    index2 += 1
-
-            digital_trace = analog_digitial_converter(threshold, trace)
+                values, starts, lengths = run_length_encode(raw_digital_trace)
+                return np.where(values, lengths, -lengths) * local_dt
+
+            digital_trace = np.asarray(trace) >= threshold
             time_array = time_in_high_low(digital_trace, dt)
 
             # now we need to make a histogram as well as a fit
@@ -558,15 +590,12 @@ class TraceAnalysisLogic(GenericLogic):
             # number of steps in between, rather not use that for now
             # est_bins = np.int(longest/dt)
 
-            time_array_high = np.array([ii for ii in filter(lambda x: x > 0, time_array)])
-            time_array_low = np.array([ii for ii in filter(lambda x: x < 0, time_array)])
+            time_array_high = time_array[time_array > 0]
+            time_array_low = time_array[time_array < 0]
 
             # get lifetime of bright state
             time_hist_high = np.histogram(time_array_high, bins=num_bins)
-            vals = [i for i in filter(lambda x: x[1] > 0, enumerate(time_hist_high[0][0:num_bins]))]
-
-            indices = np.array([val[0] for val in vals])
-            indices = np.array([np.int(indice) for indice in indices])
+            indices = np.flatnonzero(time_hist_high[0][0:num_bins] > 0)
             self.log.debug('threshold {0}'.format(threshold))
             self.log.debug('time_array:{0}'.format(time_array))
             self.log.debug('time_array_high:{0}'.format(time_array_high))
@@ -588,10 +617,8 @@ class TraceAnalysisLogic(GenericLogic):
 
             # get lifetime of dark state
             time_hist_low = np.histogram(time_array_low, bins=num_bins)
-            vals = [i for i in filter(lambda x: x[1] > 0, enumerate(time_hist_low[0][0:num_bins]))]
-            indices = np.array([val[0] for val in vals])
-            indices = np.array([np.int(indice) for indice in indices])
-            values = np.array([val[1] for val in vals])
+            indices = np.flatnonzero(time_hist_low[0][0:num_bins] > 0)
+            values = time_hist_low[0][indices]
             # positive axis
             mirror_axis = -time_hist_low[1][indices]
             result = self._fit_logic.make_decayexponential_fit(mirror_axis,
@@ -1055,7 +1082,7 @@ class TraceAnalysisLogic(GenericLogic):
         @return np.array: 1D trace of the length(trace) but now with boolean
                           entries
         """
-        return trace <= threshold
+        return np.asarray(trace) <= threshold
 
     def extract_filtered_values(self, trace, threshold, below=True):
         """ Extract only those values, which are below or equal a certain Threshold.
@@ -1068,10 +1095,9 @@ class TraceAnalysisLogic(GenericLogic):
                     np.array filtered_array: the actual values of the trace,
                                              which are equal or below threshold
         """
-        if below:
-            index_array = np.where(trace <= threshold)[0]
-        else:
-            index_array = np.where(trace > threshold)[0]
-        filtered_array = trace[index_array]
+        trace = np.asarray(trace)
+        mask = trace <= threshold if below else trace > threshold
+        index_array = np.flatnonzero(mask)
+        filtered_array = trace[mask]
         return index_array, filtered_array
 
@@ -292,7 +292,7 @@ class WavemeterLoggerLogic(GenericLogic):
 
         self._wavemeter_device.start_acqusition()
 
-        self._counter_logic.start_saving(resume=resume)
+        self._counter_logic.start_saving(resume=resume, to_file=False)
 
         if not resume:
             self._acqusition_start_time = self._counter_logic._saving_start_time
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Standalone benchmark of the Qudi pulsed generation stack.
+
+Generates a fixed matrix of predefined methods (basic_predefined_methods) at several sample rates
+and sizes with a SequenceGeneratorLogic connected to the dummy pulser (simulated transfer time
+disabled) and reports the per-stage timing (generate, analyze, sample and the time spent in the
+pulser write calls), the sampling throughput in samples/s and the peak RSS as JSON.
+Each benchmark case runs in a fresh process so the peak RSS is measured per case.
+
+Usage (from the qudi main directory):
+
+    python tools/pulsed_sampling_benchmark.py -o results.json
+    python tools/pulsed_sampling_benchmark.py --methods rabi xy8_tau --sizes small
+    python tools/pulsed_sampling_benchmark.py -o new.json --compare old.json
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+QUDI_MAIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Parameters of the predefined methods for each benchmark size. Parameters not given here are
+# taken from the method defaults.
+BENCHMARK_CASES = OrderedDict([
+    ('rabi', OrderedDict([
+        ('small', {'tau_start': 10e-9, 'tau_step': 10e-9, 'num_of_points': 20}),
+        ('large', {'tau_start': 10e-9, 'tau_step': 10e-9, 'num_of_points': 200})])),
+    ('hahnecho', OrderedDict([
+        ('small', {'tau_start': 0.0, 'tau_step': 0.1e-6, 'num_of_points': 10}),
+        ('large', {'tau_start': 0.0, 'tau_step': 0.1e-6, 'num_of_points': 50})])),
+    ('xy8_tau', OrderedDict([
+        ('small', {'tau_start': 0.5e-6, 'tau_step': 0.01e-6, 'num_of_points': 10,
+                   'xy8_order': 2}),
+        ('large', {'tau_start': 0.5e-6, 'tau_step': 0.01e-6, 'num_of_points': 50,
+                   'xy8_order': 8})])),
+    ('xy8_freq', OrderedDict([
+        ('small', {'freq_start': 1.0e6, 'freq_step': 0.1e6, 'num_of_points': 10,
+                   'xy8_order': 2}),
+        ('large', {'freq_start': 1.0e6, 'freq_step': 0.1e6, 'num_of_points': 50,
+                   'xy8_order': 8})])),
+    ('t1_sequencing', OrderedDict([
+        ('small', {'tau_start': 1.0e-6, 'tau_max': 100.0e-6, 'num_of_points': 5}),
+        ('large', {'tau_start': 1.0e-6, 'tau_max': 1.0e-3, 'num_of_points': 20})])),
+    ('chirpedodmr', OrderedDict([
+        ('small', {'num_of_points': 10}),
+        ('large', {'num_of_points': 50})])),
+])
+
+DEFAULT_SAMPLE_RATES = (1.25e9, 2.5e9, 5.0e9)
+
+GENERATION_PARAMETERS = {'laser_channel': 'd_ch1',
+                         'sync_channel': '',
+                         'gate_channel': '',
+                         'microwave_channel': 'a_ch1',
+                         'microwave_frequency': 2.87e9,
+                         'microwave_amplitude': 0.25,
+                         'rabi_period': 100e-9,
+                         'laser_length': 3e-6,
+                         'laser_delay': 500e-9,
+                         'wait_time': 1e-6}
+
+
+def get_peak_rss():
+    """ Returns the peak resident set size of the current process in bytes (None if unknown) """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in kilobytes on Linux
+    return int(peak) if sys.platform == 'darwin' else int(peak) * 1024
+
+
+def get_git_revision():
+    """ Returns the commit hash of the qudi checkout (None if not available) """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=QUDI_MAIN_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(method, size, sample_rate, overhead_bytes=0):
+    """
+    Runs a single benchmark case with freshly created and activated modules.
+
+    @param str method: name of the predefined method (without "generate_" prefix)
+    @param str size: size key in BENCHMARK_CASES
+    @param float sample_rate: sample rate in samples/s
+    @param int overhead_bytes: overhead_bytes config option of the SequenceGeneratorLogic
+
+    @return dict: benchmark results of this case
+    """
+    if QUDI_MAIN_DIR not in sys.path:
+        sys.path.insert(0, QUDI_MAIN_DIR)
+    logging.basicConfig(level=logging.WARNING)
+    from hardware.pulser_dummy import PulserDummy
+    from logic.pulsed.sequence_generator_logic import SequenceGeneratorLogic
+
+    parameters = dict(BENCHMARK_CASES[method][size])
+    parameters['name'] = method
+    assets_dir = tempfile.mkdtemp(prefix='qudi_benchmark_')
+    timing = OrderedDict([('generate', 0.0), ('analyze', 0.0), ('sample', 0.0), ('write', 0.0)])
+    try:
+        pulser = PulserDummy(manager=None,
+                             name='pulser_dummy',
+                             config={'simulate_transfer_time': False})
+        pulser.module_state.activate()
+        sequencegenerator = SequenceGeneratorLogic(manager=None,
+                                                   name='sequencegeneratorlogic',
+                                                   config={'assets_storage_path': assets_dir,
+                                                           'overhead_bytes': overhead_bytes})
+        sequencegenerator.connectors['pulsegenerator'].connect(pulser)
+        sequencegenerator.module_state.activate()
+
+        # Measure the time spent inside the pulser write methods
+        def timed(func):
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    timing['write'] += time.perf_counter() - start
+            return wrapper
+        pulser.write_waveform = timed(pulser.write_waveform)
+        pulser.write_sequence = timed(pulser.write_sequence)
+
+        sequencegenerator.set_pulse_generator_settings(sample_rate=sample_rate)
+        sequencegenerator.set_generation_parameters(GENERATION_PARAMETERS)
+        actual_sample_rate = sequencegenerator.pulse_generator_settings['sample_rate']
+
+        start = time.perf_counter()
+        sequencegenerator.generate_predefined_sequence(method, parameters)
+        timing['generate'] = time.perf_counter() - start
+
+        is_sequence = method in sequencegenerator.saved_pulse_sequences
+        if not is_sequence and method not in sequencegenerator.saved_pulse_block_ensembles:
+            raise RuntimeError('Predefined method "{0}" did not create an asset named "{0}".'
+                               ''.format(method))
+
+        start = time.perf_counter()
+        if is_sequence:
+            info = sequencegenerator.analyze_sequence(method)
+        else:
+            info = sequencegenerator.analyze_block_ensemble(method)
+        timing['analyze'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if is_sequence:
+            sequencegenerator.sample_pulse_sequence(method)
+        else:
+            sequencegenerator.sample_pulse_block_ensemble(method)
+        timing['sample'] = time.perf_counter() - start
+
+        sequencegenerator.module_state.deactivate()
+        pulser.module_state.deactivate()
+    finally:
+        shutil.rmtree(assets_dir, ignore_errors=True)
+
+    number_of_samples = int(info['number_of_samples'])
+    result = OrderedDict()
+    result['method'] = method
+    result['size'] = size
+    result['sample_rate'] = actual_sample_rate
+    result['parameters'] = BENCHMARK_CASES[method][size]
+    result['asset_type'] = 'sequence' if is_sequence else 'ensemble'
+    result['number_of_samples'] = number_of_samples
+    result['number_of_elements'] = int(info.get('number_of_elements', 0))
+    result['samples_per_s'] = number_of_samples / timing['sample'] if timing['sample'] > 0 else None
+    result['peak_rss_bytes'] = get_peak_rss()
+    result['timing_s'] = timing
+    return result
+
+
+def _run_case_star(args):
+    return run_case(*args)
+
+
+def run_benchmark(methods, sizes, sample_rates, overhead_bytes=0, isolate=True):
+    """
+    Runs all combinations of methods, sizes and sample rates.
+
+    @param list methods: names of predefined methods (keys of BENCHMARK_CASES)
+    @param list sizes: benchmark sizes ("small" and/or "large")
+    @param list sample_rates: sample rates in samples/s
+    @param int overhead_bytes: overhead_bytes config option of the SequenceGeneratorLogic
+    @param bool isolate: run each case in a fresh process (needed for per-case peak RSS)
+
+    @return list: result dicts of all cases (see run_case)
+    """
+    cases = [(method, size, sample_rate, overhead_bytes)
+             for method in methods for size in sizes for sample_rate in sample_rates]
+    results = list()
+    if isolate:
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+            for result in pool.imap(_run_case_star, cases):
+                _print_result(result)
+                results.append(result)
+    else:
+        for case in cases:
+            result = run_case(*case)
+            _print_result(result)
+            results.append(result)
+    return results
+
+
+def _print_result(result):
+    timing = ', '.join('{0} {1:.3f}s'.format(stage, t) for stage, t in result['timing_s'].items())
+    throughput = result['samples_per_s']
+    print('{0:>15s} {1:>5s} {2:7.3g} S/s: {3:>11d} samples, {4} S/s ({5})'.format(
+        result['method'], result['size'], result['sample_rate'], result['number_of_samples'],
+        '{0:.3g}'.format(throughput) if throughput else '-', timing), file=sys.stderr)
+    return
+
+
+def compare_results(results, reference):
+    """
+    Prints the relative change of sampling throughput and stage timings with respect to a
+    reference benchmark run.
+
+    @param list results: result dicts of the current run
+    @param dict reference: complete JSON content of a previous benchmark run
+    """
+    ref_cases = {(r['method'], r['size'], r['sample_rate']): r for r in reference['results']}
+    print('Comparison to revision {0}:'.format(reference.get('git_revision')), file=sys.stderr)
+    for result in results:
+        ref = ref_cases.get((result['method'], result['size'], result['sample_rate']))
+        if ref is None:
+            continue
+        changes = list()
+        for stage, t in result['timing_s'].items():
+            ref_t = ref['timing_s'].get(stage)
+            if ref_t:
+                changes.append('{0} x{1:.2f}'.format(stage, t / ref_t))
+        print('{0:>15s} {1:>5s} {2:7.3g} S/s: {3}'.format(
+            result['method'], result['size'], result['sample_rate'], ', '.join(changes)),
+            file=sys.stderr)
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Qudi pulsed generation stack.')
+    parser.add_argument('--methods', nargs='+', default=list(BENCHMARK_CASES),
+                        choices=list(BENCHMARK_CASES), help='predefined methods to benchmark')
+    parser.add_argument('--sizes', nargs='+', default=['small', 'large'],
+                        choices=['small', 'large'], help='benchmark sizes')
+    parser.add_argument('--sample-rates', nargs='+', type=float, default=DEFAULT_SAMPLE_RATES,
+                        help='sample rates in samples/s')
+    parser.add_argument('--overhead-bytes', type=int, default=0,
+                        help='overhead_bytes of the SequenceGeneratorLogic (0: unlimited memory)')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='run all cases in this process (peak RSS is not per case anymore)')
+    parser.add_argument('-o', '--output', help='JSON output file (default: stdout)')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    report = OrderedDict()
+    report['date'] = datetime.datetime.now().isoformat()
+    report['git_revision'] = get_git_revision()
+    report['platform'] = platform.platform()
+    report['python'] = platform.python_version()
+    report['numpy'] = np.__version__
+    report['cpu_count'] = os.cpu_count()
+    report['overhead_bytes'] = args.overhead_bytes
+    report['isolated'] = not args.no_isolate
+    report['results'] = run_benchmark(methods=args.methods,
+                                      sizes=args.sizes,
+                                      sample_rates=args.sample_rates,
+                                      overhead_bytes=args.overhead_bytes,
+                                      isolate=not args.no_isolate)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare_results(report['results'], json.load(file))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())